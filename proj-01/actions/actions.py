@@ -1,37 +1,131 @@
 import json
+import logging
 from utils import message as MSG
+from utils import metrics as METRICS
+
+logger = logging.getLogger("chat.actions")
+
+# Argument types an action schema may declare, with the function that decodes each
+ARG_TYPES = {"str": str, "int": int}
+
+def compile_field(spec: dict):
+    """Build the decoder of one argument from its schema entry."""
+    name = spec["name"]
+    kind = spec.get("type", "str")
+    if kind not in ARG_TYPES:
+        raise ValueError(f"Unknown type '{kind}' of argument '{name}'.")
+    convert = ARG_TYPES[kind]
+    max_length = spec.get("max_length")
+    choices = spec.get("choices")
+    minimum, maximum = spec.get("min"), spec.get("max")
+    has_default, default = "default" in spec, spec.get("default")
+
+    def decode_field(value: str):
+        if value == "" and has_default:
+            return default
+        if max_length is not None and len(value) > max_length:
+            raise ValueError(f"'{name}' is longer than {max_length} characters")
+        if choices is not None and value not in choices:
+            raise ValueError(f"'{name}' must be one of {', '.join(choices)}")
+        try:
+            value = convert(value)
+        except ValueError:
+            raise ValueError(f"'{name}' is not a valid {kind}") from None
+        if minimum is not None and value < minimum:
+            raise ValueError(f"'{name}' is less than {minimum}")
+        if maximum is not None and value > maximum:
+            raise ValueError(f"'{name}' is greater than {maximum}")
+        return value
+    return decode_field
+
+def compile_decoder(specs: list[dict] | None):
+    """
+    Build the decoder of an action's arguments from its schema (None if it has none).
+    The decoder checks the arity, converts every argument and raises ValueError if one is malformed.
+    Only the last argument may be `variadic`, taking any number of values.
+    """
+    if specs is None:
+        return None
+    fields = [compile_field(spec) for spec in specs]
+    variadic = fields.pop() if specs and specs[-1].get("variadic") else None
+    arity = len(fields)
+
+    def decode(args: list[str]) -> list:
+        if not specs and args == [""]:
+            args = []  # The legacy framing delivers an empty argument for none
+        if len(args) < arity or (variadic is None and len(args) > arity):
+            raise ValueError(f"expected {arity}{' or more' if variadic else ''} arguments, got {len(args)}")
+        decoded = [decode_field(arg) for decode_field, arg in zip(fields, args)]
+        if variadic is not None:
+            decoded.extend(variadic(arg) for arg in args[arity:])
+        return decoded
+    return decode
 
 class BaseActionHandler:
     """Base class for client and server action implementations."""
-    
+
+    # Whether `execute_action` decodes arguments with the schemas of `actions.json`,
+    # which describe the requests sent to the server
+    decodes_arguments = False
+
     def __init__(self, file_path: str):
         """Load action mappings from a JSON file when an instance is created."""
-        self.action_map = self.load_action_map(file_path)
+        self.actions = self.load_actions(file_path)
+        self.action_map = {code: action["name"] for code, action in self.actions.items()}
         self.inverse_action_map = {v: k for k, v in self.action_map.items()}
+        self.opcode_map = {int(k): k for k in self.action_map}
+        # Each code, and each action name, mapped to the code and its binary opcode
+        self.code_opcodes = {key: (k, int(k)) for k, v in self.action_map.items() for key in (k, v)}
 
-    def load_action_map(self, file_path: str):
-        """Load action mappings from a JSON file and return as a dictionary."""
+        # Each code's bound method (None if this handler lacks it) and argument decoder,
+        # built once so dispatching a message is a single lookup
+        self.dispatch_table = {
+            code: (getattr(self, action["name"], None), compile_decoder(action.get("args")))
+            for code, action in self.actions.items()
+        }
+
+    def load_actions(self, file_path: str) -> dict:
+        """
+        Load the actions from a JSON file as {code: {"name": ..., "args": [...]}}.
+        An entry may also be just the action's name, in which case it has no schema.
+        """
         try:
             with open(file_path, "r") as file:
-                print("[Base] Loaded action mappings.")
-                return json.load(file)
+                actions = json.load(file)
+            logger.info("[Base] Loaded action mappings.")
         except (FileNotFoundError, json.JSONDecodeError) as e:
-            print(f"[Base] Error loading action map: {e}")
+            logger.warning("[Base] Error loading action map: %s", e)
             return {}
-    
+        return {code: {"name": action} if isinstance(action, str) else action for code, action in actions.items()}
+
+    def decode_arguments(self, action_code: str, args: list[str]) -> list:
+        """Validate and convert an action's arguments with its schema; raises ValueError if it cannot run."""
+        action_function, decode = self.dispatch_table.get(action_code, (None, None))
+        if action_function is None:
+            raise ValueError(f"no action {action_code} in {self.__class__.__name__}")
+        return decode(args) if decode is not None else list(args)
+
+    def call_action(self, action_code: str, args: list):
+        """Execute an action whose arguments are already decoded."""
+        return self.dispatch_table[action_code][0](*args)
+
     def execute_action(self, action_code: str, args: list[str]):
         """Dynamically execute an action on `this` handler."""
-        # print("[Base] Action map loaded:", self.action_map)
-        action_name = self.action_map.get(action_code)
-        if not action_name:
-            print("[Base] Action execution was unsuccessful.")
+        if action_code not in self.dispatch_table:
+            logger.warning("[Base] Action execution was unsuccessful.")
             return False
-        
-        action_function = getattr(self, action_name, None)
+
+        action_function, decode = self.dispatch_table[action_code]
         if not action_function:
-            print(f"[Base] Function {action_name} not found in {self.__class__.__name__}")
+            logger.warning("[Base] Function %s not found in %s", self.action_map[action_code], self.__class__.__name__)
             return False
 
+        if self.decodes_arguments and decode is not None:
+            try:
+                args = decode(args)
+            except ValueError as e:
+                logger.info("[Base] Invalid arguments for %s: %s", self.action_map[action_code], e)
+                return False
         return action_function(*args)  # Execute function
 
 class ClientCallbackHandler(BaseActionHandler):
@@ -40,13 +134,14 @@ class ClientCallbackHandler(BaseActionHandler):
         super().__init__(file_path)
         self.client = client
         self.session_state = session_state
+        self.pending_rows = []
 
     def status(self, contents: str):
-        print(f"[Client Callback] Status: {contents}")
+        logger.info("[Client Callback] Status: %s", contents)
         return True
 
     def create_account(self, contents: str):
-        print(f"[Client Callback] Created account: {contents}")
+        logger.info("[Client Callback] Created account: %s", contents)
         if contents == 'True':
             self.session_state["account_status"] = True
         else:
@@ -54,7 +149,7 @@ class ClientCallbackHandler(BaseActionHandler):
         return True
 
     def login_account(self, contents: str):
-        print(f"[Client Callback] Logged in: {contents}")
+        logger.info("[Client Callback] Logged in: %s", contents)
         if contents == 'True':
             self.session_state["auth_status"] = True
         else:
@@ -62,7 +157,7 @@ class ClientCallbackHandler(BaseActionHandler):
         return True
 
     def send_text_message(self, contents: str):
-        print(f"[Client Callback] Sent text message: {contents}")
+        logger.info("[Client Callback] Sent text message: %s", contents)
         if contents == 'True':
             self.session_state["message_status"] = True
         else:
@@ -70,14 +165,140 @@ class ClientCallbackHandler(BaseActionHandler):
         return True
 
     def fetch_text_messages(self, m_id: str, sender: str, receiver: str, text: str):
-        print(f"[Client Callback] Retrieved recent text messages: {'|'.join([m_id, sender, receiver, text])}")
+        logger.debug("[Client Callback] Retrieved recent text messages: %s|%s|%s|%s", m_id, sender, receiver, text)
+        self.add_text_message(self.session_state['texts'], m_id, sender, receiver, text)
+        return True
+
+    def fetch_text_messages_batch(self, more: str, width: str, *fields: str):
+        """Collects a batch of (id, sender, receiver, text) rows; the inbox is replaced once the last part arrives."""
+        self.collect_rows("fetch_text_messages_batch", width, fields)
+        if more == "1":
+            return True
+
+        logger.info("[Client Callback] Retrieved %s recent text messages.", len(self.pending_rows))
+        texts = {}
+        for m_id, sender, receiver, text in self.pending_rows:
+            self.add_text_message(texts, m_id, sender, receiver, text)
+        self.session_state['texts'] = texts
+        self.session_state['oldest_id'] = None
+        self.session_state['newest_id'] = None
+        self.update_cursors(self.pending_rows)
+        self.pending_rows = []
+        return True
+
+    def fetch_message_history(self, more: str, width: str, *fields: str):
+        """Collects a page of (id, sender, receiver, text) rows and merges it into the inbox."""
+        self.collect_rows("fetch_message_history", width, fields)
+        if more == "1":
+            return True
+
+        logger.info("[Client Callback] Retrieved a page of %s text messages.", len(self.pending_rows))
+        self.merge_pending_rows()
+        return True
+
+    def fetch_conversation(self, more: str, width: str, *fields: str):
+        """Collects a page of one chat's (id, sender, receiver, text) rows and merges it into the inbox."""
+        self.collect_rows("fetch_conversation", width, fields)
+        if more == "1":
+            return True
+
+        logger.info("[Client Callback] Retrieved %s text messages of a chat.", len(self.pending_rows))
+        self.merge_pending_rows()
+        self.session_state['inbox_changed'] = True
+        return True
+
+    def fetch_conversation_list(self, more: str, width: str, *fields: str):
+        """Collects (counterparty, last id, last sender, last text, unread) rows; the chat list is replaced once the last part arrives."""
+        self.collect_rows("fetch_conversation_list", width, fields)
+        if more == "1":
+            return True
+
+        logger.info("[Client Callback] Retrieved %s chats.", len(self.pending_rows))
+        self.session_state['conversations'] = {
+            counterparty: {'last_id': last_id, 'last_sender': last_sender, 'last_text': last_text, 'unread': int(unread)}
+            for counterparty, last_id, last_sender, last_text, unread in self.pending_rows
+        }
+        self.pending_rows = []
+        self.session_state['inbox_changed'] = True
+        return True
+
+    def mark_conversation_read(self, contents: str):
+        logger.info("[Client Callback] Marked chat as read: %s", contents)
+        return True
+
+    def collect_rows(self, action_name: str, width: str, fields: tuple):
+        """Adds the rows of one part of a batched response to `pending_rows`; a part that does not split into rows is logged and skipped."""
+        width = int(width)
+        if not width:
+            return
+        if len(fields) % width:
+            logger.warning("[Client Callback] Dropped a part of %s: %d fields do not split into rows of %d.", action_name, len(fields), width)
+            return
+        self.pending_rows.extend(fields[i:i + width] for i in range(0, len(fields), width))
+
+    def merge_pending_rows(self):
+        """Merges the collected (id, sender, receiver, text) rows into the inbox, skipping ones already shown."""
+        texts = self.session_state['texts']
+        known_ids = {txt['id'] for counterparty in texts for txt in texts[counterparty]}
+        for m_id, sender, receiver, text in self.pending_rows:
+            if m_id not in known_ids:
+                self.add_text_message(texts, m_id, sender, receiver, text)
+        for counterparty in texts:
+            texts[counterparty].sort(key=lambda txt: int(txt['id']), reverse=True)
+        self.update_cursors(self.pending_rows)
+        self.pending_rows = []
+
+    def push_text_message(self, m_id: str, sender: str, receiver: str, text: str):
+        """Files a message the server delivered without being asked, newest first."""
+        if self.session_state.get('username') not in (sender, receiver):
+            return True  # Addressed to an account this session has since logged out of
+        logger.info("[Client Callback] Received text message %s from %s.", m_id, sender)
+        texts = self.session_state['texts']
+        counterparty = receiver if sender == self.session_state['username'] else sender
+        if any(txt['id'] == m_id for txt in texts.get(counterparty, [])):
+            return True
+        self.add_text_message(texts, m_id, sender, receiver, text)
+        texts[counterparty].sort(key=lambda txt: int(txt['id']), reverse=True)
+        self.update_cursors([(m_id,)])
+        conversations = self.session_state.setdefault('conversations', {})
+        unread = conversations.get(counterparty, {}).get('unread', 0) + (sender != self.session_state['username'])
+        conversations[counterparty] = {'last_id': m_id, 'last_sender': sender, 'last_text': text, 'unread': unread}
+        self.session_state['inbox_changed'] = True
+        return True
+
+    def stats(self, more: str, width: str, *fields: str):
+        """Collects the server's (name, value) metrics; they replace the last ones once the last part arrives."""
+        self.collect_rows("stats", width, fields)
+        if more == "1":
+            return True
+
+        logger.info("[Client Callback] Retrieved %s server metrics.", len(self.pending_rows))
+        self.session_state['stats'] = dict(self.pending_rows)
+        self.pending_rows = []
+        return True
+
+    def delete_text_messages(self, *statuses: str):
+        deleted = statuses.count('True')
+        logger.info("[Client Callback] Deleted %s of %s text messages.", deleted, len(statuses))
+        return True
+
+    def update_cursors(self, rows):
+        """Widens the (oldest_id, newest_id) range of loaded messages to include `rows`."""
+        ids = [int(row[0]) for row in rows]
+        if not ids:
+            return
+        oldest, newest = self.session_state.get('oldest_id'), self.session_state.get('newest_id')
+        self.session_state['oldest_id'] = min(ids) if oldest is None else min(oldest, min(ids))
+        self.session_state['newest_id'] = max(ids) if newest is None else max(newest, max(ids))
+
+    def add_text_message(self, texts: dict, m_id: str, sender: str, receiver: str, text: str):
+        """Files a message under its counterparty in `texts`."""
         is_sender = (sender == self.session_state['username'])
         counterparty = receiver if is_sender else sender
-        if counterparty in self.session_state['texts']:
-            self.session_state['texts'][counterparty].append({'id': m_id, 'is_sender': is_sender, 'text': text})
+        if counterparty in texts:
+            texts[counterparty].append({'id': m_id, 'is_sender': is_sender, 'text': text})
         else:
-            self.session_state['texts'][counterparty] = [{'id': m_id, 'is_sender': is_sender, 'text': text}]
-        return True
+            texts[counterparty] = [{'id': m_id, 'is_sender': is_sender, 'text': text}]
 
 class ClientActionHandler(BaseActionHandler):
     """Handles client-specific actions."""
@@ -86,82 +307,173 @@ class ClientActionHandler(BaseActionHandler):
         self.client = client
 
     def status(self, contents: str) -> bool:
-        print(f"[Client] Status: {contents}")
+        logger.debug("[Client] Status: %s", contents)
         return True
 
     def create_account(self, username: str, hashed_password: str) -> bool:
-        print(f"[Client] Creating account for {username}...")
+        logger.debug("[Client] Creating account for %s...", username)
         msg_content = MSG.MessageArgs(username, hashed_password)
         msg = MSG.Message(message_args=msg_content, message_type="create_account", endpoint=self.client)
         self.client.send_server_message(msg)
         return True
 
     def delete_account(self, username: str) -> bool:
-        print(f"[Client] Deleting account for {username}...")
+        logger.debug("[Client] Deleting account for %s...", username)
         msg_content = MSG.MessageArgs(username)
         msg = MSG.Message(message_args=msg_content, message_type="delete_account", endpoint=self.client)
         self.client.send_server_message(msg)
         return True
 
     def login_account(self, username: str, hashed_password: str) -> bool:
-        print(f"[Client] Logging in {username}...")
+        logger.debug("[Client] Logging in %s...", username)
         msg_content = MSG.MessageArgs(username, hashed_password)
         msg = MSG.Message(message_args=msg_content, message_type="login_account", endpoint=self.client)
         self.client.send_server_message(msg)
         return True
 
     def send_text_message(self, username1: str, username2: str, message_text: str) -> bool:
-        print(f"[Client] Sending text message from {username1} to {username2}...")
+        logger.debug("[Client] Sending text message from %s to %s...", username1, username2)
         msg_content = MSG.MessageArgs(username1, username2, message_text)
         msg = MSG.Message(message_args=msg_content, message_type="send_text_message", endpoint=self.client)
         self.client.send_server_message(msg)
         return True
     
     def fetch_text_messages(self, username: str, k: int) -> bool:
-        print("[Client] Retrieving recent text messages...")
+        logger.debug("[Client] Retrieving recent text messages...")
         msg_content = MSG.MessageArgs(username, str(k))
         msg = MSG.Message(message_args=msg_content, message_type="fetch_text_messages", endpoint=self.client)
         self.client.send_server_message(msg)
         return True
 
+    def fetch_text_messages_batch(self, username: str, k: int) -> bool:
+        logger.debug("[Client] Retrieving recent text messages in batches...")
+        msg_content = MSG.MessageArgs(username, str(k))
+        msg = MSG.Message(message_args=msg_content, message_type="fetch_text_messages_batch", endpoint=self.client)
+        self.client.send_server_message(msg)
+        return True
+
+    def fetch_message_history(self, username: str, direction: str, cursor_id: int, k: int) -> bool:
+        logger.debug("[Client] Retrieving %s text messages %s id %s...", k, direction, cursor_id)
+        msg_content = MSG.MessageArgs(username, direction, str(cursor_id), str(k))
+        msg = MSG.Message(message_args=msg_content, message_type="fetch_message_history", endpoint=self.client)
+        self.client.send_server_message(msg)
+        return True
+
+    def fetch_conversation(self, username: str, counterparty: str, direction: str, cursor_id: int, k: int) -> bool:
+        logger.debug("[Client] Retrieving %s text messages with %s %s id %s...", k, counterparty, direction, cursor_id)
+        msg_content = MSG.MessageArgs(username, counterparty, direction, str(cursor_id), str(k))
+        msg = MSG.Message(message_args=msg_content, message_type="fetch_conversation", endpoint=self.client)
+        self.client.send_server_message(msg)
+        return True
+
+    def fetch_conversation_list(self, username: str) -> bool:
+        logger.debug("[Client] Retrieving chats...")
+        msg_content = MSG.MessageArgs(username)
+        msg = MSG.Message(message_args=msg_content, message_type="fetch_conversation_list", endpoint=self.client)
+        self.client.send_server_message(msg)
+        return True
+
+    def mark_conversation_read(self, username: str, counterparty: str, message_id: int) -> bool:
+        logger.debug("[Client] Marking chat with %s as read up to id %s...", counterparty, message_id)
+        msg_content = MSG.MessageArgs(username, counterparty, str(message_id))
+        msg = MSG.Message(message_args=msg_content, message_type="mark_conversation_read", endpoint=self.client)
+        self.client.send_server_message(msg)
+        return True
+
     def delete_text_message(self, message_id: str) -> bool:
-        print(f"[Client] Deleting text message with id {message_id}...")
+        logger.debug("[Client] Deleting text message with id %s...", message_id)
         msg_content = MSG.MessageArgs(message_id)
         msg = MSG.Message(message_args=msg_content, message_type="delete_text_message", endpoint=self.client)
         self.client.send_server_message(msg)
         return True
 
+    def stats(self) -> bool:
+        logger.debug("[Client] Retrieving server metrics...")
+        msg = MSG.Message(message_args=MSG.MessageArgs(), message_type="stats", endpoint=self.client)
+        self.client.send_server_message(msg)
+        return True
+
+    def delete_text_messages(self, message_ids: list[str]) -> bool:
+        logger.debug("[Client] Deleting %s text messages...", len(message_ids))
+        msg_content = MSG.MessageArgs(*message_ids)
+        msg = MSG.Message(message_args=msg_content, message_type="delete_text_messages", endpoint=self.client)
+        self.client.send_server_message(msg)
+        return True
+
 class ServerActionHandler(BaseActionHandler):
-    """Handles server-specific actions."""
+    """Handles server-specific actions, with arguments decoded by the schemas of `actions.json`."""
+    decodes_arguments = True
+
     def __init__(self, server, file_path: str):
         super().__init__(file_path)
         self.server = server
 
-    def status(self, contents: str) -> bool:
-        print(f"[Server] Status: {contents}")
+    def status(self, contents: str):
+        logger.debug("[Server] Status: %s", contents)
+        if contents.startswith(MSG.PROTOCOL_HELLO):
+            # Protocol negotiation: answer with the highest version both sides support
+            requested = contents[len(MSG.PROTOCOL_HELLO):]
+            version = min(int(requested), MSG.PROTOCOL_VERSION) if requested.isdigit() else MSG.PROTOCOL_LEGACY
+            return [f"{MSG.PROTOCOL_HELLO}{version}"]
         return True
 
     def create_account(self, username: str, hashed_password: str) -> bool:
-        print(f"[Server] Creating account for {username}...")
+        logger.debug("[Server] Creating account for %s...", username)
         return self.server.account_db.create_account(username, hashed_password)
 
     def delete_account(self, username: str) -> bool:
-        print(f"[Server] Deleting account for {username}...")
+        logger.debug("[Server] Deleting account for %s...", username)
         return self.server.account_db.delete_account(username)
 
     def login_account(self, username: str, hashed_password: str) -> bool:
-        print(f"[Server] Handling login request for {username}...")
+        logger.debug("[Server] Handling login request for %s...", username)
         return self.server.account_db.login_account(username, hashed_password)
 
     def send_text_message(self, username1: str, username2: str, message_text: str) -> bool:
-        print(f"[Server] Processing text message from {username1} to {username2}...")
-        return self.server.account_db.send_text_message(username1, username2, message_text)
+        logger.debug("[Server] Processing text message from %s to %s...", username1, username2)
+        m_id = self.server.account_db.store_text_message(username1, username2, message_text)
+        if m_id is None:
+            return False
+        self.server.push_text_message(m_id, username1, username2, message_text)
+        return True
 
-    def fetch_text_messages(self, username: str, k: str) -> list[str]:
-        print("[Server] Fetching recent text messages...")
-        k = int(k)
-        return self.server.account_db.fetch_text_messages(username, k)
+    def fetch_text_messages(self, username: str, k: int) -> list[list[str]]:
+        logger.debug("[Server] Fetching recent text messages...")
+        messages = self.server.account_db.fetch_text_messages(username, k)
+        # Send each message as (id, sender, receiver, text) fields; the text may itself contain '|'
+        return [message.split("|", 3) for message in messages]
 
-    def delete_text_message(self, message_id: str) -> bool:
-        print("[Server] Deleting text message...")
-        return self.server.account_db.delete_text_message(message_id)
\ No newline at end of file
+    def fetch_text_messages_batch(self, username: str, k: int) -> MSG.MessageRows:
+        logger.debug("[Server] Fetching recent text messages in batches...")
+        messages = self.server.account_db.fetch_text_messages(username, k)
+        return MSG.MessageRows(message.split("|", 3) for message in messages if message)
+
+    def fetch_message_history(self, username: str, direction: str, cursor_id: int, k: int) -> MSG.MessageRows:
+        logger.debug("[Server] Fetching text messages %s id %s...", direction, cursor_id)
+        return MSG.MessageRows(self.server.account_db.fetch_text_message_page(username, direction, cursor_id, k))
+
+    def fetch_conversation(self, username: str, counterparty: str, direction: str, cursor_id: int, k: int) -> MSG.MessageRows:
+        logger.debug("[Server] Fetching text messages between %s and %s %s id %s...", username, counterparty, direction, cursor_id)
+        return MSG.MessageRows(self.server.account_db.fetch_conversation_page(username, counterparty, direction, cursor_id, k))
+
+    def fetch_conversation_list(self, username: str) -> MSG.MessageRows:
+        logger.debug("[Server] Fetching chats of %s...", username)
+        return MSG.MessageRows(self.server.account_db.fetch_conversation_list(username))
+
+    def mark_conversation_read(self, username: str, counterparty: str, message_id: int) -> bool:
+        logger.debug("[Server] Marking chat between %s and %s as read...", username, counterparty)
+        return self.server.account_db.mark_conversation_read(username, counterparty, message_id)
+
+    def delete_text_message(self, message_id: int) -> bool:
+        logger.debug("[Server] Deleting text message...")
+        return self.server.account_db.delete_text_message(message_id)
+
+    def delete_text_messages(self, *message_ids: int) -> list[list[bool]]:
+        logger.debug("[Server] Deleting %s text messages...", len(message_ids))
+        # One row holding a status per id, in the order they were given
+        return [self.server.account_db.delete_text_messages(message_ids)]
+
+    def stats(self) -> MSG.MessageRows:
+        logger.debug("[Server] Reporting metrics...")
+        # (name, value) rows, such as ("actions.login_account.db.p99_ms", "0.42"), without other clients' addresses
+        return MSG.MessageRows(METRICS.rows(self.server.metrics_snapshot(peers=False)))
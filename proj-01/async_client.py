@@ -0,0 +1,220 @@
+import asyncio
+import itertools
+import random
+import socket
+
+from utils import message as MSG
+from utils import config
+from utils import utils
+from actions import actions
+
+# Action maps by file, shared by every client in the process
+action_handlers = {}
+
+class AsyncClient:
+    """
+    A client session on an asyncio event loop, without tkinter or threads.
+    Messages are encoded and dispatched exactly as in `Client`. Every request carries a
+    request id, so a session can keep many requests in flight, and a single process can run
+    thousands of sessions as tasks on one loop. Needs a server that speaks the binary protocol.
+    """
+
+    def __init__(self, config_file="config.ini", callback_handler: actions.BaseActionHandler = None):
+        CFG = config.Config(config_file)
+        self.action_dict_name = CFG.get_actions_dict()
+
+        self.msg_magic = CFG.get_msg_magic()
+        self.msg_magic_size = CFG.get_msg_magic_size()
+        self.msg_type_size = CFG.get_msg_type_size()
+
+        self.msg_min_size = self.msg_magic_size + self.msg_type_size + self.msg_magic_size
+        self.msg_max_size = CFG.get_msg_max_size()
+        self.protocol_version = MSG.PROTOCOL_LEGACY
+
+        self.host = CFG.get_client_config()['host']
+        self.port = CFG.get_client_config()['port']
+        self.connected = False
+
+        if self.action_dict_name not in action_handlers:
+            action_handlers[self.action_dict_name] = actions.BaseActionHandler(self.action_dict_name)
+        self.action_handler = action_handlers[self.action_dict_name]
+
+        # Messages the server sends unprompted (such as pushed text messages) go to
+        # `callback_handler.execute_action` if one is given, and onto this queue otherwise
+        self.callback_handler = callback_handler
+        self.server_message_queue = asyncio.Queue()
+
+        # Requests in flight, by id, with the response messages received so far
+        self.request_ids = itertools.count(1)
+        self.pending_requests = {}
+
+        # A request the server refuses as busy is retried up to `busy_retries` times, after
+        # a random delay of up to `busy_backoff` seconds that doubles on every retry
+        self.busy_retries = 5
+        self.busy_backoff = 0.01
+        self.reader = None
+        self.writer = None
+        self.receiver = None
+
+    async def connect(self, timeout=2.0):
+        """Connect to the server, agree on the binary protocol and start receiving."""
+        if self.connected:
+            return
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connected = True
+
+        # The offer is a legacy `status` message, as in `Client.negotiate_protocol`
+        msg_content = MSG.MessageArgs(f"{MSG.PROTOCOL_HELLO}{MSG.PROTOCOL_BINARY}")
+        self.send(MSG.Message(message_args=msg_content, message_type="status", endpoint=self, version=MSG.PROTOCOL_LEGACY))
+        try:
+            message = MSG.Message.from_bytes(await asyncio.wait_for(self.read_frame(), timeout), self)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            message = None
+        reply = ""
+        if message is not None and message.valid() and message.args():
+            reply = message.args()[0]
+        if reply != f"{MSG.PROTOCOL_HELLO}{MSG.PROTOCOL_BINARY}":
+            await self.close()
+            raise ConnectionError("The server does not speak the binary protocol.")
+        self.protocol_version = MSG.PROTOCOL_BINARY
+        self.receiver = asyncio.create_task(self.recv_server_messages())
+
+    async def read_frame(self) -> bytes:
+        """Read one length-prefixed frame."""
+        length = utils.FRAME_LENGTH.unpack(await self.reader.readexactly(utils.FRAME_LENGTH.size))[0]
+        return await self.reader.readexactly(length)
+
+    def send(self, message: MSG.Message):
+        """Queue a message's frame on the stream."""
+        payload = message.encode()
+        self.writer.write(utils.FRAME_LENGTH.pack(len(payload)) + payload)
+
+    async def recv_server_messages(self):
+        """Resolve requests with their responses, and hand on everything else."""
+        try:
+            while True:
+                message = MSG.Message.from_bytes(await self.read_frame(), self)
+                if not message.valid():
+                    continue  # Ignore invalid messages.
+                message_type, message_args = message.unpack_args()
+
+                pending = self.pending_requests.get(message.request_id)
+                if pending is not None:
+                    future, responses = pending
+                    responses.append((message_type, message_args))
+                    if not message.more:
+                        del self.pending_requests[message.request_id]
+                        if not future.done():
+                            future.set_result(responses)
+                elif self.callback_handler is not None:
+                    self.callback_handler.execute_action(message_type, message_args)
+                else:
+                    self.server_message_queue.put_nowait((message_type, message_args))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connected = False
+            self.fail_pending_requests()
+
+    def fail_pending_requests(self):
+        """Fail the futures of requests that can no longer be answered."""
+        pending, self.pending_requests = self.pending_requests, {}
+        for future, _ in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Disconnected from the server."))
+
+    async def request(self, message_type: str, *args) -> list[tuple[str, list[str]]]:
+        """
+        Send a request and wait for all of its response's (message_type, message_args) messages,
+        retrying with exponential backoff while the server answers that it is busy.
+        """
+        busy = [(self.action_handler.inverse_action_map.get("status"), [MSG.STATUS_BUSY])]
+        for attempt in range(self.busy_retries + 1):
+            responses = await self.request_once(message_type, *args)
+            if responses != busy:
+                break
+            await asyncio.sleep(random.uniform(0, self.busy_backoff * 2 ** attempt))
+        return responses
+
+    async def request_once(self, message_type: str, *args) -> list[tuple[str, list[str]]]:
+        """Send a request once and wait for all of its response's messages."""
+        if not self.connected:
+            raise ConnectionError("Not connected to the server.")
+        request_id = next(self.request_ids)
+        msg = MSG.Message(message_args=MSG.MessageArgs(*args), message_type=message_type, endpoint=self, request_id=request_id)
+        if not msg.valid():
+            raise ValueError(f"Invalid {message_type} request.")
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending_requests[request_id] = (future, [])
+        self.send(msg)
+        await self.writer.drain()
+        return await future
+
+    async def request_status(self, message_type: str, *args) -> bool:
+        """Send a request answered by a single True/False."""
+        responses = await self.request(message_type, *args)
+        return responses[0][1] == ["True"]
+
+    async def create_account(self, username: str, hashed_password: str) -> bool:
+        return await self.request_status("create_account", username, hashed_password)
+
+    async def delete_account(self, username: str) -> bool:
+        return await self.request_status("delete_account", username)
+
+    async def login_account(self, username: str, hashed_password: str) -> bool:
+        return await self.request_status("login_account", username, hashed_password)
+
+    async def send_text_message(self, username1: str, username2: str, message_text: str) -> bool:
+        return await self.request_status("send_text_message", username1, username2, message_text)
+
+    async def request_rows(self, message_type: str, *args) -> list[tuple[str, ...]]:
+        """
+        Send a request answered by rows packed into messages (see `Message.pack_rows`) and return the rows.
+        A `status` reply instead of rows raises `ValueError` if the server found the request invalid,
+        and `RuntimeError` if it was still busy once the retries ran out.
+        """
+        status = self.action_handler.inverse_action_map.get("status")
+        rows = []
+        for response_type, message_args in await self.request(message_type, *args):
+            if response_type == status:
+                reply = message_args[0] if message_args else ""
+                if reply == MSG.STATUS_INVALID:
+                    raise ValueError(f"Invalid {message_type} request.")
+                if reply == MSG.STATUS_BUSY:
+                    raise RuntimeError(f"The server was busy for {self.busy_retries + 1} {message_type} requests in a row.")
+                raise RuntimeError(f"Unexpected {message_type} reply '{reply}'.")
+            more, width, *fields = message_args
+            width = int(width)
+            if width:
+                rows.extend(tuple(fields[i:i + width]) for i in range(0, len(fields), width))
+        return rows
+
+    async def fetch_text_messages(self, username: str, k: int) -> list[tuple[str, str, str, str]]:
+        """The k most recent (id, sender, receiver, text) messages involving a user."""
+        return await self.request_rows("fetch_text_messages_batch", username, str(k))
+
+    async def stats(self) -> dict[str, str]:
+        """The server's metrics, by dotted name (see `utils.metrics.rows`)."""
+        return dict(await self.request_rows("stats"))
+
+    async def close(self):
+        """Disconnect from the server."""
+        if self.receiver is not None:
+            self.receiver.cancel()
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        self.connected = False
+        self.fail_pending_requests()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -0,0 +1,87 @@
+"""
+Runs many `AsyncClient` sessions from a single process.
+
+A server is started in a subprocess (asyncio engine by default), then
+`--sessions` sessions connect concurrently from one event loop. Each one
+creates and logs into its own account, sends `--messages` messages to the
+next session's account and fetches its inbox. Reports connect time,
+request throughput and the client process's resident memory and thread
+count, which stays at one thread however many sessions there are.
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_async_clients --sessions 2000
+"""
+import argparse
+import asyncio
+import glob
+import os
+import resource
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from async_client import AsyncClient
+from benchmarks.bench_utils import write_config, start_server, server_usage
+
+async def run_sessions(config_file: str, sessions: int, messages: int) -> dict:
+    """Connects every session, then runs their requests concurrently."""
+    clients = [AsyncClient(config_file) for _ in range(sessions)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client.connect(timeout=30) for client in clients))
+    connect_s = time.perf_counter() - start
+    rss_kib, threads = server_usage(os.getpid())
+
+    async def session(i: int, client: AsyncClient) -> int:
+        await client.create_account(f"session_{i}", "hash")
+        await client.login_account(f"session_{i}", "hash")
+        for m in range(messages):
+            await client.send_text_message(f"session_{i}", f"session_{(i + 1) % sessions}", f"Message {m}")
+        await client.fetch_text_messages(f"session_{i}", 10)
+        return 3 + messages
+
+    start = time.perf_counter()
+    requests = sum(await asyncio.gather(*(session(i, client) for i, client in enumerate(clients))))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*(client.close() for client in clients))
+    return {
+        "sessions": sessions,
+        "connect_s": round(connect_s, 3),
+        "requests": requests,
+        "throughput_rps": round(requests / elapsed, 1),
+        "client_rss_kib": rss_kib,
+        "client_threads": threads,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=2)
+    parser.add_argument("--engine", default="asyncio")
+    parser.add_argument("--port", type=int, default=5800)
+    args = parser.parse_args()
+
+    # Each session needs a descriptor on both ends.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    db_name = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    config_file = write_config({
+        "SERVER": {"engine": args.engine, "port": args.port, "backlog": max(128, args.sessions)},
+        "CLIENT": {"port": args.port},
+        "ACCOUNT": {"db_name": db_name},
+    })
+    server = start_server(config_file, args.port)
+    try:
+        # The action map logs when it loads; keep that out of the results
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            result = asyncio.run(run_sessions(config_file, args.sessions, args.messages))
+        print(result)
+    finally:
+        server.terminate()
+        server.wait()
+        os.remove(config_file)
+        for path in glob.glob(os.path.splitext(db_name)[0] + "*"):
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
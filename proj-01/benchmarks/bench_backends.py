@@ -0,0 +1,62 @@
+"""
+Compares the per-operation latency of the storage backends.
+
+Each backend gets `--users` accounts, then runs `--ops` of each operation
+the server performs: login, send, fetch of the newest 10 messages and a
+page of history. Results are mean microseconds per call.
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_backends --ops 2000
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from database import db
+
+def timed(ops: int, call) -> float:
+    """Calls `call(i)` for i in range(ops) and returns the mean microseconds per call."""
+    start = time.perf_counter()
+    for i in range(ops):
+        call(i)
+    return round(1e6 * (time.perf_counter() - start) / ops, 1)
+
+def run(backend: str, db_name: str, users: int, ops: int) -> dict:
+    """Times each operation against one backend."""
+    account_db = db.open_database(db_name, backend=backend)
+    for i in range(users):
+        account_db.create_account(f"user_{i}", "hash")
+    user = lambda i: f"user_{i % users}"
+    result = {
+        "backend": backend,
+        "login_us": timed(ops, lambda i: account_db.login_account(user(i), "hash")),
+        "send_us": timed(ops, lambda i: account_db.send_text_message(user(i), user(i + 1), f"Message number {i}.")),
+        "fetch_us": timed(ops, lambda i: account_db.fetch_text_messages(user(i), 10)),
+        "page_us": timed(ops, lambda i: account_db.fetch_text_message_page(user(i), "before", 0, 10)),
+    }
+    account_db.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    db_name = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    # The database logs every query to stdout; keep that out of the results
+    try:
+        with open(os.devnull, "w") as devnull:
+            for backend in ("sqlite", "memory"):
+                with redirect_stdout(devnull):
+                    result = run(backend, db_name, args.users, args.ops)
+                print(result)
+    finally:
+        for path in glob.glob(db_name + "*"):
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
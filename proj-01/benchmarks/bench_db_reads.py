@@ -0,0 +1,92 @@
+"""
+Measures how `AccountDatabase` read throughput scales with reader threads.
+
+A database is seeded with `--users` users exchanging `--messages` messages,
+then 1, 2, 4, ... `--max-threads` threads share one `AccountDatabase` and
+repeatedly call `login_account` and `fetch_text_messages` for `--seconds`.
+Each run is repeated with every read held under one global lock, as every
+query was before reads moved to their own WAL connections.
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_db_reads --max-threads 8
+"""
+import argparse
+import glob
+import os
+import tempfile
+import threading
+import time
+from contextlib import nullcontext, redirect_stdout
+
+from database import db
+
+def seed(account_db: db.AccountDatabase, users: int, count: int):
+    """Creates `users` users and `count` messages spread over pairs of them."""
+    for i in range(users):
+        account_db.create_account(f"user_{i}", "hash")
+    for i in range(count):
+        account_db.send_text_message(f"user_{i % users}", f"user_{(i + 1) % users}", f"Message number {i}.")
+
+def run(account_db: db.AccountDatabase, threads: int, users: int, seconds: float, serialized: bool) -> dict:
+    """Reads from `threads` threads for `seconds` and reports reads per second."""
+    lock = threading.Lock() if serialized else None
+    counts = [0] * threads
+    stop = threading.Event()
+
+    def reader(index: int):
+        i = index
+        while not stop.is_set():
+            username = f"user_{i % users}"
+            with lock or nullcontext():
+                account_db.login_account(username, "hash")
+            with lock or nullcontext():
+                account_db.fetch_text_messages(username, 10)
+            counts[index] += 2
+            i += threads
+
+    workers = [threading.Thread(target=reader, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "threads": threads,
+        "serialized": serialized,
+        "reads_per_s": round(sum(counts) / elapsed, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--max-threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--journal-mode", default="wal")
+    args = parser.parse_args()
+
+    db_name = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    # The database logs every query to stdout; keep that out of the results
+    devnull = open(os.devnull, "w")
+    try:
+        with redirect_stdout(devnull):
+            account_db = db.AccountDatabase(db_name, journal_mode=args.journal_mode)
+            seed(account_db, args.users, args.messages)
+        threads = 1
+        while threads <= args.max_threads:
+            for serialized in (True, False):
+                with redirect_stdout(devnull):
+                    result = run(account_db, threads, args.users, args.seconds, serialized)
+                print(result)
+            threads *= 2
+        account_db.close()
+    finally:
+        devnull.close()
+        for path in glob.glob(db_name + "*"):
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Measures `send_text_message` throughput with and without group commit.
+
+`--threads` threads share one `AccountDatabase` and each sends `--messages`
+messages. The run is repeated for each `synchronous` setting, committing
+every message alone (`batch_size` 1) and in groups of `--batch-size`.
+With `--shards` above 1, conversations are spread over that many files.
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_db_writes --threads 8 --messages 200
+"""
+import argparse
+import glob
+import os
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+
+from database import db
+
+def run(synchronous: str, batch_size: int, batch_delay: float, threads: int, count: int, shards: int) -> dict:
+    """Sends `count` messages from each of `threads` threads and reports messages per second."""
+    db_name = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    try:
+        account_db = db.open_database(db_name, shards=shards, synchronous=synchronous, batch_size=batch_size, batch_delay=batch_delay)
+        for i in range(threads + 1):
+            account_db.create_account(f"user_{i}", "hash")
+
+        def sender(index: int):
+            for i in range(count):
+                account_db.send_text_message(f"user_{index}", f"user_{threads}", f"Message number {i}.")
+
+        workers = [threading.Thread(target=sender, args=(i,)) for i in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        databases = account_db.shards if shards > 1 else [account_db]
+        batches = sum(database.committer.batches if database.committer else 0 for database in databases) or threads * count
+        account_db.close()
+    finally:
+        for path in glob.glob(os.path.splitext(db_name)[0] + "*"):
+            os.remove(path)
+    return {
+        "shards": shards,
+        "synchronous": synchronous,
+        "batch_size": batch_size,
+        "commits": batches,
+        "messages_per_s": round(threads * count / elapsed, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--batch-delay", type=float, default=0.0)
+    parser.add_argument("--shards", type=int, default=1)
+    args = parser.parse_args()
+
+    # The database logs every query to stdout; keep that out of the results
+    with open(os.devnull, "w") as devnull:
+        for synchronous in ("full", "normal"):
+            for batch_size in (1, args.batch_size):
+                with redirect_stdout(devnull):
+                    result = run(synchronous, batch_size, args.batch_delay, args.threads, args.messages, args.shards)
+                print(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measures `delete_account` on an account with many conversations.
+
+An account is seeded with `--conversations` conversations (each with
+`--messages` messages), then deleted while another thread keeps sending
+messages between two unrelated users. The run reports how long the delete
+took and the slowest concurrent send, compared against deleting the same
+data one conversation at a time (two DELETEs per conversation, as
+`delete_account` used to).
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_delete_account --conversations 10000
+"""
+import argparse
+import glob
+import os
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+
+from database import db
+
+def seed(account_db: db.AccountDatabase, conversations: int, messages: int):
+    """Creates `hub` with one conversation per spoke user, plus two unrelated users."""
+    with account_db.writing() as cursor:
+        cursor.executemany(
+            "INSERT INTO users (username, password_hash) VALUES (?, 'hash')",
+            [("hub",), ("other_a",), ("other_b",)] + [(f"spoke_{i}",) for i in range(conversations)]
+        )
+        hub_id = account_db.get_user_id(cursor, "hub")
+        cursor.execute("SELECT id FROM users WHERE username LIKE 'spoke_%'")
+        pairs = [(hub_id, spoke_id) for (spoke_id,) in cursor.fetchall()]
+        cursor.executemany("INSERT INTO conversations (user_id_1, user_id_2) VALUES (?, ?)", pairs)
+        cursor.execute("SELECT conversation_id, user_id_2 FROM conversations WHERE user_id_1 = ?", (hub_id,))
+        cursor.executemany(
+            "INSERT INTO messages (conversation_id, user_id, message_text) VALUES (?, ?, ?)",
+            [(conv_id, spoke_id, f"Message {i}") for conv_id, spoke_id in cursor.fetchall() for i in range(messages)]
+        )
+
+def delete_per_conversation(account_db: db.AccountDatabase, username: str):
+    """The previous `delete_account`: two DELETE statements per conversation."""
+    with account_db.writing() as cursor:
+        user_id = account_db.get_user_id(cursor, username)
+        cursor.execute("SELECT conversation_id FROM conversations WHERE user_id_1 = ? OR user_id_2 = ?", (user_id, user_id))
+        for (conv_id,) in cursor.fetchall():
+            cursor.execute("DELETE FROM messages WHERE conversation_id = ?", (conv_id,))
+            cursor.execute("DELETE FROM conversations WHERE conversation_id = ?", (conv_id,))
+        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+    account_db.user_cache.invalidate()
+    account_db.conversation_cache.invalidate()
+
+def run(method: str, conversations: int, messages: int) -> dict:
+    """Deletes the seeded account with `method` while timing concurrent sends."""
+    db_name = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    try:
+        account_db = db.AccountDatabase(db_name)
+        seed(account_db, conversations, messages)
+
+        send_latencies = []
+        stop = threading.Event()
+        def sender():
+            while not stop.is_set():
+                start = time.perf_counter()
+                account_db.send_text_message("other_a", "other_b", "Still here")
+                send_latencies.append(time.perf_counter() - start)
+
+        sending = threading.Thread(target=sender)
+        sending.start()
+        time.sleep(0.1)
+        start = time.perf_counter()
+        if method == "set_based":
+            account_db.delete_account("hub")
+        else:
+            delete_per_conversation(account_db, "hub")
+        elapsed = time.perf_counter() - start
+        time.sleep(0.1)
+        stop.set()
+        sending.join()
+        account_db.close()
+    finally:
+        for path in glob.glob(db_name + "*"):
+            os.remove(path)
+    return {
+        "method": method,
+        "conversations": conversations,
+        "delete_ms": round(1000 * elapsed, 1),
+        "max_send_ms": round(1000 * max(send_latencies), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=3)
+    args = parser.parse_args()
+
+    # The database logs every query to stdout; keep that out of the results
+    with open(os.devnull, "w") as devnull:
+        for method in ("per_conversation", "set_based"):
+            with redirect_stdout(devnull):
+                result = run(method, args.conversations, args.messages)
+            print(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Measures how a flooding client delays other clients' logins.
+
+A server is started in a subprocess with one worker. One `Client` keeps
+`--depth` pipelined `fetch_text_messages_batch` requests in flight for an
+inbox of `--messages` messages, while another sends `--logins` logins one
+after another. Reports the login latency with the scheduler's priority
+classes from `config.ini` and with every action in a single class.
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_fairness --depth 64 --logins 200
+"""
+import argparse
+import glob
+import os
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+
+from benchmarks.bench_utils import write_config, start_server, percentile
+from client import Client
+
+def run(label: str, scheduler: dict, args) -> dict:
+    """Floods fetches on one connection while timing logins on another."""
+    db_name = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    config_file = write_config({
+        "SERVER": {"port": args.port, "workers": 1, "queue_size": 0},
+        "CLIENT": {"port": args.port},
+        "ACCOUNT": {"db_name": db_name},
+        "SCHEDULER": scheduler,
+    })
+    server = start_server(config_file, args.port)
+    flooder, prober = Client(config_file), Client(config_file)
+    try:
+        flooder.request("create_account", "flooder", "hash").result(timeout=10)
+        flooder.request("create_account", "prober", "hash").result(timeout=10)
+        for i in range(args.messages):
+            flooder.request("send_text_message", "flooder", "prober", f"Message number {i}.")
+        flooder.request("status", "sync").result(timeout=60)
+
+        stop = threading.Event()
+        def flood():
+            in_flight = []
+            while not stop.is_set():
+                while len(in_flight) < args.depth:
+                    in_flight.append(flooder.request("fetch_text_messages_batch", "flooder", str(args.messages)))
+                in_flight.pop(0).result(timeout=60)
+        thread = threading.Thread(target=flood)
+        thread.start()
+        time.sleep(0.5)
+
+        latencies = []
+        for _ in range(args.logins):
+            start = time.perf_counter()
+            prober.request("login_account", "prober", "hash").result(timeout=60)
+            latencies.append(time.perf_counter() - start)
+        stop.set()
+        thread.join()
+    finally:
+        flooder.disconnect()
+        prober.disconnect()
+        server.terminate()
+        server.wait()
+        os.remove(config_file)
+        for path in glob.glob(os.path.splitext(db_name)[0] + "*"):
+            os.remove(path)
+
+    latencies.sort()
+    return {
+        "scheduler": label,
+        "login_p50_ms": round(1000 * percentile(latencies, 50), 3),
+        "login_p99_ms": round(1000 * percentile(latencies, 99), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depth", type=int, default=64)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--port", type=int, default=5900)
+    args = parser.parse_args()
+
+    for label, scheduler in (("classes", {}), ("single class", {"classes": "default:1", "default_class": "default"})):
+        # The clients print their connection events; keep that out of the results
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            result = run(label, scheduler, args)
+        print(result)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Measures throughput of large `fetch_text_messages` responses.
+
+A database is seeded with `--messages` messages between two users, then a
+single connection repeatedly fetches all of them. The run is repeated with
+per-message sends and with batched responses (`[SERVER] batch_responses`).
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_fetch --messages 500
+"""
+import argparse
+import os
+import socket
+import tempfile
+import time
+
+from benchmarks.bench_utils import Endpoint, write_config, start_server, frame, recv_frame
+from database import db
+from utils import message as MSG
+
+def seed(db_name: str, count: int):
+    """Creates two users with `count` messages between them."""
+    account_db = db.AccountDatabase(db_name)
+    account_db.create_account("alice", "hash")
+    account_db.create_account("bob", "hash")
+    for i in range(count):
+        account_db.send_text_message("alice", "bob", f"Message number {i} from alice to bob.")
+    account_db.close()
+
+def run(batch_responses: bool, protocol_version: int, port: int, db_name: str, count: int, rounds: int) -> dict:
+    """Fetches every seeded message `rounds` times and reports rows per second."""
+    config_file = write_config({
+        "SERVER": {"port": port, "batch_responses": batch_responses},
+        "CLIENT": {"port": port},
+        "ACCOUNT": {"db_name": db_name},
+    })
+    server = start_server(config_file, port)
+    try:
+        endpoint = Endpoint(config_file, protocol_version=protocol_version)
+        msg = MSG.Message(MSG.MessageArgs("alice", count), "fetch_text_messages", endpoint)
+        request = frame(msg.encode())
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            start = time.perf_counter()
+            for _ in range(rounds):
+                sock.sendall(request)
+                for _ in range(count):
+                    recv_frame(sock)
+            elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+        os.remove(config_file)
+    return {
+        "batch_responses": batch_responses,
+        "protocol": protocol_version,
+        "fetch_ms": round(1000 * elapsed / rounds, 3),
+        "rows_per_s": round(count * rounds / elapsed, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--port", type=int, default=5610)
+    args = parser.parse_args()
+
+    db_name = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    try:
+        seed(db_name, args.messages)
+        port = args.port
+        for protocol_version in (MSG.PROTOCOL_LEGACY, MSG.PROTOCOL_BINARY):
+            for batch_responses in (False, True):
+                print(run(batch_responses, protocol_version, port, db_name, args.messages, args.rounds))
+                port += 1
+    finally:
+        os.remove(db_name)
+
+if __name__ == "__main__":
+    main()
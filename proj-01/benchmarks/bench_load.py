@@ -0,0 +1,270 @@
+"""
+Load generator: many simulated users driving a server through headless `Client`s.
+
+A server is started in a subprocess (with `--set SECTION.key=value` overrides
+applied to a copy of `config.ini`), `--users` accounts are created, and the
+users are spread over `--connections` `Client` connections. Each connection
+then runs a closed loop for `--seconds`: it picks one of its users and an
+action according to `--mix`, sends the request and waits for the response.
+Actions:
+    create  create_account for a fresh account
+    login   login_account
+    send    send_text_message to a random other user
+    fetch   fetch_text_messages_batch of the 10 newest messages
+    delete  delete_account of an account this connection created
+            (one is created first, unmeasured, if there is none)
+
+Reports throughput and p50/p95/p99 latency per action. `--output` saves the
+results as JSON; `--baseline` compares against an earlier JSON file and exits
+with status 1 if any action's throughput or p95 latency regressed by more
+than `--tolerance`.
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_load --users 200 --connections 20 --output load.json
+    python3 -m benchmarks.bench_load --users 200 --connections 20 --baseline load.json
+"""
+import argparse
+import glob
+import json
+import os
+import queue
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from benchmarks.bench_utils import write_config, start_server, percentile
+from client import Client
+
+ACTIONS = {
+    "create": "create_account",
+    "login": "login_account",
+    "send": "send_text_message",
+    "fetch": "fetch_text_messages_batch",
+    "delete": "delete_account",
+}
+RESPONSE_TIMEOUT = 10.0
+
+def parse_mix(mix: str) -> dict:
+    """Parses "send=5,fetch=3" into {action: weight}."""
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ACTIONS:
+            raise ValueError(f"unknown action '{name}' (expected one of {', '.join(ACTIONS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+def parse_settings(settings: list[str]) -> dict:
+    """Parses ["SERVER.engine=asyncio"] into {"SERVER": {"engine": "asyncio"}}."""
+    parsed = {}
+    for setting in settings:
+        key, _, value = setting.partition("=")
+        section, _, option = key.partition(".")
+        parsed.setdefault(section, {})[option] = value
+    return parsed
+
+class Connection:
+    """One headless `Client` driving its share of the simulated users in a closed loop."""
+
+    def __init__(self, index: int, config_file: str, users: list[str], all_users: list[str], seed: int):
+        self.index = index
+        self.client = Client(config_file)
+        self.users = users
+        self.all_users = all_users
+        self.random = random.Random(seed + index)
+        self.created = []  # Accounts made by `create`, for `delete` to remove
+        self.next_account = 0
+        self.latencies = {name: [] for name in ACTIONS.values()}
+        self.errors = {name: 0 for name in ACTIONS.values()}
+
+    def request(self, action: str, *args) -> list[list[str]] | None:
+        """Sends one request and waits for its whole response; returns the response arguments (None on timeout)."""
+        getattr(self.client.action_handler, action)(*args)
+        action_map = self.client.action_handler.action_map
+        responses = []
+        deadline = time.monotonic() + RESPONSE_TIMEOUT
+        while True:
+            try:
+                message_type, message_args = self.client.server_message_queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                return None
+            if action_map.get(message_type) != action:
+                continue  # A message pushed to a user logged in on this connection
+            responses.append(message_args)
+            # Row responses end with a "0" more flag; everything else is a single message
+            if action != "fetch_text_messages_batch" or message_args[0] == "0":
+                return responses
+
+    def measure(self, action: str, *args):
+        """Runs `request` and records its latency and whether it failed."""
+        start = time.perf_counter()
+        responses = self.request(action, *args)
+        self.latencies[action].append(time.perf_counter() - start)
+        if responses is None or any("False" in message_args for message_args in responses):
+            self.errors[action] += 1
+
+    def new_account(self) -> str:
+        """A username no other connection will use."""
+        self.next_account += 1
+        return f"load_{self.index}_{self.next_account}"
+
+    def run_action(self, name: str):
+        """Performs one action of the mix as a random user of this connection."""
+        user = self.random.choice(self.users)
+        if name == "create":
+            account = self.new_account()
+            self.measure("create_account", account, "hash")
+            self.created.append(account)
+        elif name == "login":
+            self.measure("login_account", user, "hash")
+        elif name == "send":
+            receiver = self.random.choice(self.all_users)
+            while receiver == user and len(self.all_users) > 1:
+                receiver = self.random.choice(self.all_users)
+            self.measure("send_text_message", user, receiver, f"Load test message from {user}")
+        elif name == "fetch":
+            self.measure("fetch_text_messages_batch", user, 10)
+        elif name == "delete":
+            if not self.created:
+                account = self.new_account()
+                self.request("create_account", account, "hash")
+                self.created.append(account)
+            self.measure("delete_account", self.created.pop())
+
+    def run(self, weights: dict, stop: threading.Event):
+        names = list(weights)
+        while not stop.is_set():
+            self.run_action(self.random.choices(names, weights=list(weights.values()))[0])
+
+def latency_stats(latencies: list[float], errors: int, elapsed: float) -> dict:
+    """Throughput and latency percentiles of `latencies` (seconds) measured over `elapsed` seconds."""
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(1000 * percentile(latencies, 50), 3),
+        "p95_ms": round(1000 * percentile(latencies, 95), 3),
+        "p99_ms": round(1000 * percentile(latencies, 99), 3),
+        "mean_ms": round(1000 * statistics.fmean(latencies), 3),
+    }
+
+def summarize(connections: list[Connection], elapsed: float) -> dict:
+    """Stats per action, and over all actions as "all"."""
+    results = {}
+    everything, total_errors = [], 0
+    for action in ACTIONS.values():
+        latencies = [latency for connection in connections for latency in connection.latencies[action]]
+        if not latencies:
+            continue
+        errors = sum(connection.errors[action] for connection in connections)
+        results[action] = latency_stats(latencies, errors, elapsed)
+        everything.extend(latencies)
+        total_errors += errors
+    if everything:
+        results["all"] = latency_stats(everything, total_errors, elapsed)
+    return results
+
+def run(args) -> dict:
+    """Starts a server, runs the load against it and returns the results."""
+    weights = parse_mix(args.mix)
+    settings = parse_settings(args.set)
+    db_name = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    settings.setdefault("SERVER", {})["port"] = args.port
+    settings.setdefault("CLIENT", {})["port"] = args.port
+    settings.setdefault("ACCOUNT", {})["db_name"] = db_name
+    config_file = write_config(settings)
+    server = start_server(config_file, args.port)
+    connections = []
+    try:
+        users = [f"user_{i}" for i in range(args.users)]
+        connections = [
+            Connection(i, config_file, users[i::args.connections] or users, users, args.seed)
+            for i in range(args.connections)
+        ]
+        # Every simulated user exists before the clock starts
+        for i, user in enumerate(users):
+            connections[i % len(connections)].request("create_account", user, "hash")
+
+        stop = threading.Event()
+        workers = [threading.Thread(target=connection.run, args=(weights, stop)) for connection in connections]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        for connection in connections:
+            connection.client.disconnect()
+        server.terminate()
+        server.wait()
+        os.remove(config_file)
+        for path in glob.glob(os.path.splitext(db_name)[0] + "*"):
+            os.remove(path)
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "params": {
+            "users": args.users, "connections": args.connections, "seconds": args.seconds,
+            "mix": weights, "settings": {section: {k: str(v) for k, v in values.items() if k not in ("port", "db_name")} for section, values in settings.items()},
+        },
+        "elapsed_s": round(elapsed, 3),
+        "actions": summarize(connections, elapsed),
+    }
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Lists every action whose throughput fell, or whose p95 latency rose, by more than `tolerance`."""
+    regressions = []
+    for action, current in results["actions"].items():
+        previous = baseline.get("actions", {}).get(action)
+        if previous is None:
+            continue
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{action}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s")
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{action}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--connections", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--mix", default="create=1,login=2,send=5,fetch=3,delete=1",
+                        help="relative weights of the actions (default: %(default)s)")
+    parser.add_argument("--set", action="append", default=[], metavar="SECTION.key=value",
+                        help="override a config.ini setting for the server, e.g. SERVER.engine=asyncio")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=5700)
+    parser.add_argument("--output", help="save the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against results saved earlier with --output")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction by which throughput or p95 may worsen before it counts as a regression")
+    args = parser.parse_args()
+
+    # The clients log every request and response to stdout; keep that out of the results
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        results = run(args)
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
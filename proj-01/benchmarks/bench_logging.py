@@ -0,0 +1,67 @@
+"""
+Measures what hot-path logging costs a request.
+
+An `AccountDatabase` serves `--requests` rounds of `send_text_message` and
+`fetch_text_messages` (whose every message text and fetched row are logged
+at debug level) with the "chat" loggers configured at each level, writing to
+/dev/null through the queue handler. Also reports the cost of a single
+`logger.debug` call when debug is off and when it is on.
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_logging --requests 2000
+"""
+import argparse
+import glob
+import logging
+import os
+import tempfile
+import time
+
+from database import db
+from utils import log as LOG
+
+def run_requests(level: str, requests: int, stream) -> dict:
+    """Sends and fetches `requests` times with the loggers at `level`, and reports requests per second."""
+    LOG.configure(level, stream=stream)
+    db_name = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    try:
+        account_db = db.AccountDatabase(db_name)
+        account_db.create_account("alice", "hash")
+        account_db.create_account("bob", "hash")
+        start = time.perf_counter()
+        for i in range(requests):
+            account_db.send_text_message("alice", "bob", f"Message number {i}.")
+            account_db.fetch_text_messages("alice", 10)
+        elapsed = time.perf_counter() - start
+        account_db.close()
+    finally:
+        LOG.shutdown()
+        for path in glob.glob(os.path.splitext(db_name)[0] + "*"):
+            os.remove(path)
+    return {"level": level, "requests": requests, "requests_per_s": round(requests / elapsed, 1)}
+
+def call_cost(level: str, calls: int, stream) -> dict:
+    """Average nanoseconds of one `logger.debug` call with the loggers at `level`."""
+    LOG.configure(level, stream=stream)
+    logger = logging.getLogger("chat.server")
+    start = time.perf_counter()
+    for i in range(calls):
+        logger.debug("retval: %s", i)
+    elapsed = time.perf_counter() - start
+    LOG.shutdown()
+    return {"level": level, "debug_call_ns": round(1e9 * elapsed / calls, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as devnull:
+        for level in ("debug", "info", "off"):
+            print(run_requests(level, args.requests, devnull))
+        for level in ("debug", "info"):
+            print(call_cost(level, args.calls, devnull))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Compares the legacy text framing with the binary framing of `Message`.
+
+Reports encoded bytes per message and the CPU time to encode and decode a
+message for a few representative payloads, as the best of `--repeat` runs.
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_message
+"""
+import argparse
+import time
+
+from benchmarks.bench_utils import Endpoint
+from utils import message as MSG
+
+PAYLOADS = {
+    "login": ("login_account", ("alice", "5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8")),
+    "send": ("send_text_message", ("alice", "bob", "Are we still on for lunch tomorrow?")),
+    "fetch_row": ("fetch_text_messages", ("1042", "alice", "bob", "x" * 200)),
+}
+
+def bench(endpoint: Endpoint, message_type: str, args: tuple, n: int, repeat: int) -> dict:
+    """Times `n` encodes and decodes of a single payload, keeping the fastest of `repeat` runs."""
+    message_args = MSG.MessageArgs(*args)
+    encode_s = decode_s = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        for _ in range(n):
+            frame = MSG.Message(message_args, message_type, endpoint).encode()
+        encode_s = min(encode_s, time.process_time() - start)
+
+        start = time.process_time()
+        for _ in range(n):
+            MSG.Message.from_bytes(frame, endpoint).unpack_args()
+        decode_s = min(decode_s, time.process_time() - start)
+
+    return {
+        "bytes": len(frame),
+        "encode_us": round(1e6 * encode_s / n, 3),
+        "decode_us": round(1e6 * decode_s / n, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    endpoints = {
+        "legacy": Endpoint(protocol_version=MSG.PROTOCOL_LEGACY),
+        "binary": Endpoint(protocol_version=MSG.PROTOCOL_BINARY),
+    }
+    for name, (message_type, payload) in PAYLOADS.items():
+        for protocol, endpoint in endpoints.items():
+            print(name, protocol, bench(endpoint, message_type, payload, args.n, args.repeat))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Compares the threaded and asyncio server engines.
+
+For each engine a server is started in a subprocess, `--connections` idle
+clients are opened against it, and every client then sends `--rounds` status
+requests. Reports connect time, request latency, and the server's resident
+memory and thread count.
+
+Run from `proj-01`:
+    python3 -m benchmarks.bench_server_engines --connections 10000
+"""
+import argparse
+import os
+import resource
+import selectors
+import socket
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_utils import Endpoint, write_config, start_server, frame, recv_frame, server_usage
+from utils import message as MSG
+
+def run_engine(engine: str, port: int, connections: int, rounds: int) -> dict:
+    """Benchmarks a single server engine."""
+    db_name = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    config_file = write_config({
+        "SERVER": {"engine": engine, "port": port},
+        "CLIENT": {"port": port},
+        "ACCOUNT": {"db_name": db_name},
+    })
+    server = start_server(config_file, port)
+    result = {"engine": engine, "connections": 0}
+    socks = []
+    try:
+        endpoint = Endpoint(config_file)
+        msg = MSG.Message(message_args=MSG.MessageArgs("ping"), message_type="status", endpoint=endpoint)
+        request = frame(msg.encode())
+
+        start = time.perf_counter()
+        for _ in range(connections):
+            sock = socket.create_connection(("127.0.0.1", port))
+            socks.append(sock)
+        result["connections"] = len(socks)
+        result["connect_s"] = round(time.perf_counter() - start, 3)
+        time.sleep(0.5)
+        result["idle_rss_kib"], result["idle_threads"] = server_usage(server.pid)
+
+        # Every connection keeps one request in flight per round.
+        latencies = []
+        selector = selectors.DefaultSelector()
+        start = time.perf_counter()
+        for _ in range(rounds):
+            sent_at = {}
+            for sock in socks:
+                sock.sendall(request)
+                sent_at[sock] = time.perf_counter()
+                selector.register(sock, selectors.EVENT_READ)
+            while sent_at:
+                for key, _ in selector.select(timeout=30):
+                    sock = key.fileobj
+                    recv_frame(sock)
+                    latencies.append(time.perf_counter() - sent_at.pop(sock))
+                    selector.unregister(sock)
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        result["requests"] = len(latencies)
+        result["throughput_rps"] = round(len(latencies) / elapsed, 1)
+        result["p50_ms"] = round(1000 * latencies[len(latencies) // 2], 3)
+        result["p99_ms"] = round(1000 * latencies[int(len(latencies) * 0.99)], 3)
+        result["mean_ms"] = round(1000 * statistics.fmean(latencies), 3)
+        result["busy_rss_kib"], result["busy_threads"] = server_usage(server.pid)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        for sock in socks:
+            sock.close()
+        server.terminate()
+        server.wait()
+        os.remove(config_file)
+        os.remove(db_name)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", default=["threaded", "asyncio"])
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--port", type=int, default=5600)
+    args = parser.parse_args()
+
+    # Each connection needs a descriptor on both ends.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    for i, engine in enumerate(args.engines):
+        print(run_engine(engine, args.port + i, args.connections, args.rounds))
+
+if __name__ == "__main__":
+    main()
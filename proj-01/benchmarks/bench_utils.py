@@ -0,0 +1,89 @@
+"""Helpers shared by the benchmarks: config files, server processes and raw framing."""
+import configparser
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from actions import actions
+from utils import config
+
+class Endpoint:
+    """Minimal message endpoint so benchmark clients can build `Message`s without a `Client`."""
+    def __init__(self, config_file: str = "config.ini", protocol_version: int = None):
+        CFG = config.Config(config_file)
+        self.msg_magic = CFG.get_msg_magic()
+        self.msg_magic_size = CFG.get_msg_magic_size()
+        self.msg_type_size = CFG.get_msg_type_size()
+        self.msg_min_size = self.msg_magic_size + self.msg_type_size + self.msg_magic_size
+        self.msg_max_size = CFG.get_msg_max_size()
+        if protocol_version is not None:
+            self.protocol_version = protocol_version
+        self.action_handler = actions.BaseActionHandler(CFG.get_actions_dict())
+
+def write_config(settings: dict) -> str:
+    """Writes a copy of `config.ini` with `settings` ({section: {key: value}}) applied and returns its path."""
+    parser = configparser.ConfigParser()
+    parser.read("config.ini")
+    for section, values in settings.items():
+        for key, value in values.items():
+            parser[section][key] = str(value)
+    fd, path = tempfile.mkstemp(suffix=".ini")
+    with os.fdopen(fd, "w") as file:
+        parser.write(file)
+    return path
+
+def start_server(config_file: str, port: int, timeout: float = 10.0) -> subprocess.Popen:
+    """Starts a server using `config_file` and waits until it accepts connections."""
+    server = subprocess.Popen(
+        [sys.executable, "-c", "import sys, server; server.Server(sys.argv[1])", config_file],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+    server.terminate()
+    raise RuntimeError("server did not start")
+
+def frame(payload: bytes) -> bytes:
+    """Prefixes `payload` with its 4-byte length."""
+    return len(payload).to_bytes(4, "big") + bytes(payload)
+
+def recv_frame(sock: socket.socket) -> bytes:
+    """Reads a single length-prefixed frame."""
+    header = b""
+    while len(header) < 4:
+        chunk = sock.recv(4 - len(header))
+        if not chunk:
+            raise ConnectionError("server closed connection")
+        header += chunk
+    remaining = int.from_bytes(header, "big")
+    body = bytearray()
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            raise ConnectionError("server closed connection")
+        body += chunk
+        remaining -= len(chunk)
+    return bytes(body)
+
+def percentile(sorted_values: list, q: float):
+    """The `q`-th percentile (0-100) of an already sorted, non-empty list, by nearest rank."""
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q / 100))]
+
+def server_usage(pid: int) -> tuple[int, int]:
+    """Returns (resident memory in KiB, thread count) of process `pid`."""
+    rss_kib, threads = 0, 0
+    with open(f"/proc/{pid}/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                rss_kib = int(line.split()[1])
+            elif line.startswith("Threads:"):
+                threads = int(line.split()[1])
+    return rss_kib, threads
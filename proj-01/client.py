@@ -2,19 +2,18 @@ import socket
 import threading
 import hashlib as hasher
 import queue
-from concurrent.futures import ThreadPoolExecutor
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from utils import message as MSG
 from utils import config
 from utils import utils
+from utils import log as LOG
 from actions import actions
 
-import tkinter as tk
-from tkinter import messagebox, simpledialog, scrolledtext
-
 class Client:
-    def __init__(self):
-        CFG = config.Config()
+    def __init__(self, config_file="config.ini"):
+        CFG = config.Config(config_file)
         self.action_dict_name = CFG.get_actions_dict()
 
         self.msg_magic = CFG.get_msg_magic()
@@ -23,6 +22,8 @@ class Client:
 
         self.msg_min_size = self.msg_magic_size + self.msg_type_size + self.msg_magic_size
         self.msg_max_size = CFG.get_msg_max_size()
+        self.msg_protocol = CFG.get_msg_protocol()
+        self.protocol_version = MSG.PROTOCOL_LEGACY
 
         self.host = CFG.get_client_config()['host']
         self.port = CFG.get_client_config()['port']
@@ -33,6 +34,12 @@ class Client:
         self.server_message_queue = queue.Queue()
         self.executor = ThreadPoolExecutor(max_workers=1)
 
+        # Requests sent with `request`, by id, with the response messages received so far
+        self.request_ids = itertools.count(1)
+        self.pending_requests = {}
+        self.pending_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+
         print("Client host:", self.host)
         print("Client port:", self.port)
 
@@ -43,12 +50,10 @@ class Client:
         if self.connected:
             try:
                 if message.valid():
-                    # Send message to server
+                    # Send message to server (length prefix and body in one write)
                     # print("Send message to server...")
-                    encoded_message = message.encode()
-                    length = len(encoded_message)
-                    self.client_socket.sendall(length.to_bytes(4, 'big'))
-                    self.client_socket.sendall(encoded_message)
+                    with self.send_lock:
+                        utils.send_frames(self.client_socket, [message.encode()])
             except Exception as e:
                 print("[Client] Failed to send message. Connection lost:", e)
                 self.disconnect()
@@ -59,26 +64,29 @@ class Client:
         """Handle server messages."""
         try:
             while self.connected:
-                # First read the message length (4 bytes)
-
-                length_bytes = utils.recv_all(self.client_socket, 4)
-                if length_bytes is None:
-                    break
-                message_length = int.from_bytes(length_bytes, 'big')
-
-                # Now read the actual message
-                message_bytes = utils.recv_all(self.client_socket, message_length)
+                # Read the next length-prefixed message out of the receive buffer
+                message_bytes = self.frame_reader.read_frame()
                 if message_bytes is None:
                     break
                 
-                message = MSG.Message.from_bytes(message_bytes.decode("utf-8"), self)
+                message = MSG.Message.from_bytes(message_bytes, self)
                 if message.valid():
-                    message_type, message_content = message.unpack()
-                    message_args = MSG.MessageArgs.to_arglist(message_content)
+                    message_type, message_args = message.unpack_args()
                     # print(f"[Client] Received message type {message_type}")
 
-                    # Push server response to job queue
-                    self.server_message_queue.put((message_type, message_args))
+                    with self.pending_lock:
+                        pending = self.pending_requests.get(message.request_id)
+                        if pending is not None and not message.more:
+                            del self.pending_requests[message.request_id]
+                    if pending is not None:
+                        # Part of the response to a `request`; resolve its future on the last message
+                        future, responses = pending
+                        responses.append((message_type, message_args))
+                        if not message.more:
+                            future.set_result(responses)
+                    else:
+                        # Push server response to job queue
+                        self.server_message_queue.put((message_type, message_args))
                 else:
                     # Ignore invalid messages.
                     # print("Invalid message.")
@@ -96,21 +104,92 @@ class Client:
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             self.client_socket.connect((self.host, self.port))
+            self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Legacy messages are bounded in characters, which may take up to 4 bytes each
+            self.frame_reader = utils.FrameReader(self.client_socket, max_frame_size=4 * self.msg_max_size)
             print("[Client] Connected to the server.")
             self.connected = True
+            self.negotiate_protocol()
             threading.Thread(target=self.recv_server_message, daemon=True).start()
             # threading.Thread(target=self.process_queued_messages, daemon=True).start()
         except Exception as e:
             print("[Client] Failed to connect to the server due to:", e)
 
+    def negotiate_protocol(self, timeout=2.0):
+        """
+        Agrees on a wire protocol version with the server before any other traffic.
+        The offer is sent as a legacy `status` message; servers that predate the binary
+        protocol answer it like any other status, and the client stays on the legacy protocol.
+        """
+        self.protocol_version = MSG.PROTOCOL_LEGACY
+        if self.msg_protocol == MSG.PROTOCOL_LEGACY:
+            return
+
+        msg_content = MSG.MessageArgs(f"{MSG.PROTOCOL_HELLO}{self.msg_protocol}")
+        msg = MSG.Message(message_args=msg_content, message_type="status", endpoint=self, version=MSG.PROTOCOL_LEGACY)
+        self.send_server_message(msg)
+        try:
+            self.client_socket.settimeout(timeout)
+            message_bytes = self.frame_reader.read_frame()
+            if message_bytes is None:
+                return
+            message = MSG.Message.from_bytes(message_bytes, self)
+            if message.valid():
+                _, message_args = message.unpack_args()
+                reply = message_args[0] if message_args else ""
+                if reply.startswith(MSG.PROTOCOL_HELLO) and reply[len(MSG.PROTOCOL_HELLO):].isdigit():
+                    self.protocol_version = int(reply[len(MSG.PROTOCOL_HELLO):])
+        except socket.timeout:
+            print("[Client] Protocol negotiation timed out.")
+        finally:
+            if self.connected:
+                self.client_socket.settimeout(None)
+        print(f"[Client] Using protocol version {self.protocol_version}.")
+
+    def request(self, message_type: str, *args) -> Future:
+        """
+        Sends a request tagged with a fresh request id, without waiting for the response.
+        The returned future resolves to the response's (message_type, message_args) messages, in order.
+        Many requests can be in flight at once; the server may complete them in any order.
+        Needs the binary protocol, the only one that carries request ids.
+        """
+        future = Future()
+        if self.protocol_version != MSG.PROTOCOL_BINARY:
+            future.set_exception(RuntimeError("Request ids need the binary protocol."))
+            return future
+
+        request_id = next(self.request_ids)
+        msg = MSG.Message(message_args=MSG.MessageArgs(*args), message_type=message_type, endpoint=self, request_id=request_id)
+        if not msg.valid():
+            future.set_exception(ValueError(f"Invalid {message_type} request."))
+            return future
+        with self.pending_lock:
+            self.pending_requests[request_id] = (future, [])
+        self.send_server_message(msg)
+        if not self.connected:
+            self.fail_pending_requests()
+        return future
+
+    def fail_pending_requests(self):
+        """Fails the futures of requests that can no longer be answered."""
+        with self.pending_lock:
+            pending, self.pending_requests = self.pending_requests, {}
+        for future, _ in pending.values():
+            future.set_exception(ConnectionError("Disconnected from the server."))
+
     def disconnect(self):
         """Disconnect from the server."""
         if self.client_socket:
             self.client_socket.close()
             self.connected = False
             print("[Client] Disconnected from the server.")
+        self.fail_pending_requests()
 
     def run_app(self):
+        # Only the GUI needs tkinter; headless users of `Client` never import it
+        import tkinter as tk
+        from tkinter import messagebox, simpledialog, scrolledtext
+
         process_queue = self.process_queued_messages
         action_handler = self.action_handler
         callback_handler = self.callback_handler
@@ -122,6 +201,10 @@ class Client:
                     "logged_in": False,
                     "username": None,
                     "texts": {},
+                    "conversations": {},
+                    "oldest_id": None,
+                    "newest_id": None,
+                    "inbox_changed": False,
                     "max_texts": 5,
                     "current_page": "auth",
                     "auth_status": None,
@@ -135,6 +218,15 @@ class Client:
                 self.geometry("500x500")
 
                 self.update_ui()
+                self.after(100, self.pump_messages)
+
+            def pump_messages(self):
+                """Apply server responses and pushed messages as they arrive, without asking the server."""
+                process_queue()
+                if self.session_state['inbox_changed'] and self.session_state['current_page'] == 'main':
+                    self.session_state['inbox_changed'] = False
+                    self.update_inbox()
+                self.after(100, self.pump_messages)
 
             def update_ui(self):
                 process_queue()
@@ -260,6 +352,9 @@ class Client:
                 self.session_state["logged_in"] = False
                 self.session_state["username"] = None
                 self.session_state["texts"] = {}
+                self.session_state["conversations"] = {}
+                self.session_state["oldest_id"] = None
+                self.session_state["newest_id"] = None
                 self.show_auth_ui()
 
             def delete_account(self):
@@ -345,11 +440,34 @@ class Client:
                 canvas.pack(side="left", fill="both", expand=True)
                 scrollbar.pack(side="right", fill="y")
 
-                for counterparty in self.session_state['texts']:
+                # Chats from the chat list (most recently active first), then any only known from loaded messages
+                conversations = self.session_state['conversations']
+                counterparties = sorted(conversations, key=lambda cp: int(conversations[cp]['last_id']), reverse=True)
+                counterparties += [cp for cp in self.session_state['texts'] if cp not in conversations]
+
+                for counterparty in counterparties:
                     if filter_text in counterparty.lower():
                         # Chat header
-                        tk.Label(messages_frame, text=f"📨 Chat with {counterparty}:", font=("Arial", 10, "bold")).pack(pady=(10, 5), anchor="center")
-                        texts = self.session_state['texts'][counterparty]
+                        summary = conversations.get(counterparty)
+                        unread = f" ({summary['unread']} unread)" if summary and summary['unread'] else ""
+                        tk.Label(messages_frame, text=f"📨 Chat with {counterparty}{unread}:", font=("Arial", 10, "bold")).pack(pady=(10, 5), anchor="center")
+                        header_buttons = tk.Frame(messages_frame)
+                        tk.Button(
+                            header_buttons, text="📖 Open chat", font=("Arial", 8),
+                            command=lambda cp=counterparty: self.open_chat(cp)
+                        ).pack(side="left", padx=2)
+                        tk.Button(
+                            header_buttons, text="🗑 Delete chat", font=("Arial", 8),
+                            command=lambda cp=counterparty: self.delete_chat(cp)
+                        ).pack(side="left", padx=2)
+                        header_buttons.pack(anchor="center")
+
+                        texts = self.session_state['texts'].get(counterparty)
+                        if not texts:
+                            # Not opened yet: preview the last message only
+                            if summary and summary['last_text']:
+                                tk.Label(messages_frame, text=f"{summary['last_sender']}: {summary['last_text']}", fg="gray", wraplength=400).pack(anchor="center")
+                            continue
 
                         for txt in texts[:self.session_state["max_texts"]]:
                             text_message = txt['text']
@@ -395,8 +513,29 @@ class Client:
                 self.update_inbox() 
                 action_handler.delete_text_message(message_id)
 
+            def open_chat(self, counterparty):
+                """Loads the newest messages of one chat and marks it as read."""
+                username = self.session_state['username']
+                action_handler.fetch_conversation(username, counterparty, "before", 0, self.session_state['max_texts'])
+                summary = self.session_state['conversations'].get(counterparty)
+                if summary and summary['unread']:
+                    action_handler.mark_conversation_read(username, counterparty, summary['last_id'])
+                    summary['unread'] = 0
+
+            def delete_chat(self, counterparty):
+                """Deletes every loaded message of a chat with one request and updates the inbox."""
+                self.session_state['conversations'].pop(counterparty, None)
+                texts = self.session_state['texts'].pop(counterparty, [])
+                self.update_inbox()
+                if texts:
+                    action_handler.delete_text_messages([txt['id'] for txt in texts])
+
             def refresh_inbox(self):
-                action_handler.fetch_text_messages(self.session_state['username'], self.session_state['max_texts'])
+                # The chat list carries each chat's last message and unread count; messages load per chat when opened
+                action_handler.fetch_conversation_list(self.session_state['username'])
+                if self.session_state['newest_id'] is not None:
+                    # Only ask for what arrived since the newest message already shown
+                    action_handler.fetch_message_history(self.session_state['username'], "after", self.session_state['newest_id'], self.session_state['max_texts'])
                 self.after(1000, self.update_ui)
 
         app = MessagingApp()
@@ -459,5 +598,6 @@ def test_end_to_end(client):
 
 
 if __name__ == "__main__":
+    LOG.configure(**config.Config().get_logging_config())
     client = Client()
     client.run_app()
@@ -0,0 +1,106 @@
+import configparser
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+# Import the `utils` package before any test directory is put on `sys.path`. Collecting
+# `utils/` prepends it, after which a first `import utils` would find `utils/utils.py`.
+import utils.message  # noqa: F401
+from utils import config
+from actions import actions
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+class Endpoint:
+    """Minimal message endpoint, so tests can build `Message`s for raw sockets without a `Client`."""
+    def __init__(self, config_file: str, protocol_version: int = None):
+        CFG = config.Config(config_file)
+        self.msg_magic = CFG.get_msg_magic()
+        self.msg_magic_size = CFG.get_msg_magic_size()
+        self.msg_type_size = CFG.get_msg_type_size()
+        self.msg_min_size = self.msg_magic_size + self.msg_type_size + self.msg_magic_size
+        self.msg_max_size = CFG.get_msg_max_size()
+        if protocol_version is not None:
+            self.protocol_version = protocol_version
+        self.action_handler = actions.BaseActionHandler(CFG.get_actions_dict())
+
+def server_reachable(port: int) -> bool:
+    """Whether something accepts connections on `port` of this host."""
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+def spawn_server(config_file: str, port: int, timeout: float = 10.0) -> subprocess.Popen:
+    """Starts a server using `config_file` and waits until it accepts connections."""
+    server = subprocess.Popen(
+        [sys.executable, "-c", "import sys, server; server.Server(sys.argv[1])", config_file],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server_reachable(port):
+            return server
+        time.sleep(0.05)
+    server.terminate()
+    server.wait()
+    raise RuntimeError("server did not start")
+
+def stop_server(server: subprocess.Popen):
+    server.terminate()
+    server.wait()
+
+def copy_config(path: str, settings: dict) -> str:
+    """Writes a copy of `config.ini` with `settings` ({section: {key: value}}) applied to `path`."""
+    parser = configparser.ConfigParser()
+    parser.read(os.path.join(ROOT, "config.ini"))
+    for section, values in settings.items():
+        for key, value in values.items():
+            parser[section][key] = str(value)
+    with open(path, "w") as file:
+        parser.write(file)
+    return path
+
+@pytest.fixture(scope="session")
+def write_config(tmp_path_factory):
+    """Fixture returning a function that writes a copy of `config.ini` with some settings changed and returns its path."""
+    def write(settings: dict) -> str:
+        return copy_config(str(tmp_path_factory.mktemp("config") / "config.ini"), settings)
+    return write
+
+@pytest.fixture
+def start_server():
+    """Fixture returning a function that starts a server from a config file; every server is stopped afterwards."""
+    servers = []
+    def start(config_file: str, port: int) -> subprocess.Popen:
+        servers.append(spawn_server(config_file, port))
+        return servers[-1]
+    yield start
+    for server in servers:
+        stop_server(server)
+
+@pytest.fixture
+def make_endpoint():
+    """Fixture returning the `Endpoint` class, which builds messages for raw sockets from a config file."""
+    return Endpoint
+
+@pytest.fixture(scope="session")
+def chat_server(tmp_path_factory):
+    """
+    Fixture for the server that clients configured by `config.ini` connect to. A server already
+    listening on that port is used as it is; otherwise one is started on an empty database.
+    """
+    port = config.Config(os.path.join(ROOT, "config.ini")).get_client_config()["port"]
+    if server_reachable(port):
+        yield None
+        return
+    directory = tmp_path_factory.mktemp("chat_server")
+    config_file = copy_config(str(directory / "config.ini"), {"ACCOUNT": {"db_name": str(directory / "central.db")}})
+    server = spawn_server(config_file, port)
+    yield server
+    stop_server(server)
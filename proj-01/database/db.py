@@ -1,19 +1,316 @@
+import logging
 import sqlite3 as sql
 import threading
+import queue
+import time
+import heapq
+import os
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
 
-class AccountDatabase:
-    def __init__(self, db_name):
+logger = logging.getLogger("chat.db")
+
+# Largest value of a SQLite INTEGER PRIMARY KEY
+MAX_MESSAGE_ID = 2**63 - 1
+
+# Stored in `PRAGMA user_version`; bump it when `migrate_db` learns a new step
+SCHEMA_VERSION = 2
+
+# Messages involving a user, as (message_id, sender, receiver, message_text) rows.
+# The user's conversations are found through the participant indexes first (CROSS JOIN
+# keeps SQLite from scanning `messages` instead), then each one's messages by index.
+MESSAGE_ROWS_SQL = """
+    SELECT m.message_id, s.username, r.username, m.message_text
+    FROM conversations c
+    CROSS JOIN messages m ON m.conversation_id = c.conversation_id
+    JOIN users s ON s.id = m.user_id
+    JOIN users r ON r.id = (CASE WHEN m.user_id = c.user_id_1 THEN c.user_id_2 ELSE c.user_id_1 END)
+    WHERE (c.user_id_1 = :user_id OR c.user_id_2 = :user_id)
+"""
+FETCH_MESSAGES_SQL = MESSAGE_ROWS_SQL + "ORDER BY m.message_id DESC LIMIT :k"
+FETCH_PAGE_BEFORE_SQL = MESSAGE_ROWS_SQL + "AND m.message_id < :cursor_id ORDER BY m.message_id DESC LIMIT :k"
+FETCH_PAGE_AFTER_SQL = MESSAGE_ROWS_SQL + "AND m.message_id > :cursor_id ORDER BY m.message_id ASC LIMIT :k"
+
+# One conversation's messages as (message_id, sender_id, message_text) rows, found
+# through the pair index and then `idx_messages_conversation` alone
+CONVERSATION_ROWS_SQL = """
+    SELECT m.message_id, m.user_id, m.message_text
+    FROM conversations c
+    CROSS JOIN messages m ON m.conversation_id = c.conversation_id
+    WHERE c.user_id_1 = :user_id_1 AND c.user_id_2 = :user_id_2
+"""
+CONVERSATION_PAGE_BEFORE_SQL = CONVERSATION_ROWS_SQL + "AND m.message_id < :cursor_id ORDER BY m.message_id DESC LIMIT :k"
+CONVERSATION_PAGE_AFTER_SQL = CONVERSATION_ROWS_SQL + "AND m.message_id > :cursor_id ORDER BY m.message_id ASC LIMIT :k"
+
+# A user's conversations as (counterparty_id, last_message_id, last_sender_id, last_message_text, unread) rows,
+# most recently active first. The last message and the unread count (messages from the counterparty
+# newer than the user's read marker) are each read from `idx_messages_conversation`.
+CONVERSATION_LIST_SQL = """
+    SELECT
+        CASE WHEN c.user_id_1 = :user_id THEN c.user_id_2 ELSE c.user_id_1 END,
+        COALESCE(m.message_id, 0), m.user_id, COALESCE(m.message_text, ''),
+        (
+            SELECT COUNT(*) FROM messages u
+            WHERE u.conversation_id = c.conversation_id AND u.user_id != :user_id
+            AND u.message_id > (CASE WHEN c.user_id_1 = :user_id THEN c.last_read_1 ELSE c.last_read_2 END)
+        )
+    FROM conversations c
+    LEFT JOIN messages m ON m.message_id = (
+        SELECT message_id FROM messages WHERE conversation_id = c.conversation_id ORDER BY message_id DESC LIMIT 1
+    )
+    WHERE c.user_id_1 = :user_id OR c.user_id_2 = :user_id
+    ORDER BY COALESCE(m.message_id, 0) DESC
+"""
+
+# Ids bound per `IN (...)` list, well under SQLite's limit on host parameters
+DELETE_CHUNK_SIZE = 500
+
+# A shard holds no users, so its rows carry user ids for the directory to resolve:
+# (message_id, sender_id, user_id_1, user_id_2, message_text)
+SHARD_ROWS_SQL = """
+    SELECT m.message_id, m.user_id, c.user_id_1, c.user_id_2, m.message_text
+    FROM conversations c
+    CROSS JOIN messages m ON m.conversation_id = c.conversation_id
+    WHERE (c.user_id_1 = :user_id OR c.user_id_2 = :user_id)
+"""
+SHARD_PAGE_BEFORE_SQL = SHARD_ROWS_SQL + "AND m.message_id < :cursor_id ORDER BY m.message_id DESC LIMIT :k"
+SHARD_PAGE_AFTER_SQL = SHARD_ROWS_SQL + "AND m.message_id > :cursor_id ORDER BY m.message_id ASC LIMIT :k"
+
+class LRUCache:
+    """
+    Bounded mapping that evicts its least recently used entry, counting hits and misses.
+    `version` changes on every invalidation; a reader records it before querying the database
+    and passes it to `put`, so a value read before an invalidation is never cached after it.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value for `key` (None on a miss)."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, version: int):
+        """Cache `value` unless the cache was invalidated since `version` was read."""
+        with self.lock:
+            if version != self.version or self.capacity <= 0:
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop `key` (or every entry, if None)."""
+        with self.lock:
+            self.version += 1
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """Return the cache's size and hit/miss counts."""
+        with self.lock:
+            return {"size": len(self.entries), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
+
+class GroupCommitter:
+    """
+    Runs queued writes in shared transactions on the database's writer connection.
+    A batch takes every write queued (up to `batch_size`) and, with a positive `batch_delay`,
+    waits up to that many milliseconds after its first write for more, so many writes share
+    one commit (and one fsync). Writes arriving during a commit form the next batch.
+    Each write runs in its own savepoint, so one write failing does not undo the rest of its batch.
+    """
+
+    def __init__(self, database, batch_size: int, batch_delay: float):
+        self.database = database
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay / 1000
+        self.write_queue = queue.Queue()
+        self.batches = 0  # Transactions committed so far
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, write, *args) -> Future:
+        """Queue `write(cursor, *args)`; the returned future resolves with its result once committed."""
+        future = Future()
+        self.write_queue.put((future, write, args))
+        return future
+
+    def stop(self):
+        """Commit whatever is queued and stop the committing thread."""
+        self.write_queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        """Collect writes into batches and commit them until stopped."""
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.batch_delay
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.write_queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.commit(batch)
+                    return
+                batch.append(item)
+            self.commit(batch)
+
+    def commit(self, batch: list):
+        """Run a batch of writes in one transaction and resolve their futures."""
+        results = []
+        try:
+            with self.database.writing() as cursor:
+                cursor.execute("BEGIN")
+                for future, write, args in batch:
+                    cursor.execute("SAVEPOINT write")
+                    try:
+                        results.append((future, write(cursor, *args), None))
+                    except Exception as e:
+                        cursor.execute("ROLLBACK TO write")
+                        # The write may have cached a conversation it created
+                        self.database.conversation_cache.invalidate()
+                        results.append((future, None, e))
+                    cursor.execute("RELEASE write")
+            self.batches += 1
+        except Exception as e:
+            # The commit itself failed, so none of the batch was stored
+            for future, _, _ in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+class StorageBackend(ABC):
+    """The account and message storage operations the server relies on."""
+
+    @abstractmethod
+    def create_account(self, username: str, hashed_password: str) -> bool:
+        """Adds an account; False if the username is taken or either field is empty."""
+
+    @abstractmethod
+    def login_account(self, username: str, hashed_password: str) -> bool:
+        """Check if username and password match."""
+
+    @abstractmethod
+    def delete_account(self, username: str) -> bool:
+        """Deletes an account with all of its conversations and messages; False if it does not exist."""
+
+    @abstractmethod
+    def create_conversation(self, username_1: str, username_2: str) -> bool:
+        """Create a conversation between two users; False if either is missing, they are the same, or it exists."""
+
+    @abstractmethod
+    def store_text_message(self, username_1: str, username_2: str, message_text: str) -> int | None:
+        """Stores a message from `username_1` to `username_2` and returns its id (None if it could not be delivered)."""
+
+    @abstractmethod
+    def fetch_text_message_page(self, username_1: str, direction: str, cursor_id: int, k: int) -> list[tuple]:
+        """
+        Retrieve up to k (message_id, sender, receiver, message_text) rows involving a user, paging by message id.
+        "before" pages backward from `cursor_id` (newest first; 0 starts at the newest), "after" pages forward (oldest first).
+        """
+
+    @abstractmethod
+    def fetch_conversation_page(self, username_1: str, username_2: str, direction: str, cursor_id: int, k: int) -> list[tuple]:
+        """
+        Like `fetch_text_message_page`, but only the messages between `username_1` and `username_2`.
+        Rows are (message_id, sender, receiver, message_text).
+        """
+
+    @abstractmethod
+    def fetch_conversation_list(self, username: str) -> list[tuple]:
+        """
+        Retrieve a user's conversations, most recently active first, as
+        (counterparty, last_message_id, last_sender, last_message_text, unread) rows.
+        A conversation without messages has a last_message_id of 0 and empty sender and text.
+        """
+
+    @abstractmethod
+    def mark_conversation_read(self, username_1: str, username_2: str, message_id: int) -> bool:
+        """Marks the messages `username_1` received from `username_2` up to `message_id` as read; False if there is no such conversation."""
+
+    @abstractmethod
+    def delete_text_messages(self, message_ids) -> list[bool]:
+        """
+        Deletes messages at once, and any conversation left empty; one status per id in `message_ids`,
+        False for ids that do not exist (or repeat an id already deleted).
+        """
+
+    def delete_text_message(self, message_id) -> bool:
+        """Deletes a message, and its conversation if it was the last one; False if it does not exist."""
+        return self.delete_text_messages([message_id])[0]
+
+    def send_text_message(self, username_1: str, username_2: str, message_text: str) -> bool:
+        """Add a message to a conversation between two users where `username_1` is sender and `username_2` is receiver."""
+        return self.store_text_message(username_1, username_2, message_text) is not None
+
+    def fetch_text_messages(self, username_1: str, k: int) -> list[str]:
+        """Retrieve the k most recent messages involving a user as "id|sender|receiver|text" strings ([""] if none)."""
+        messages = ['|'.join(str(field) for field in row) for row in self.fetch_text_message_page(username_1, "before", 0, k)]
+        return messages or [""]
+
+    def close(self):
+        """Release the backend's resources."""
+
+class AccountDatabase(StorageBackend):
+    def __init__(self, db_name, journal_mode="wal", synchronous="normal", busy_timeout=5000, batch_size=1, batch_delay=0.0, cache_size=1024):
         self.db_name = db_name
-        self.local = threading.local()  # Thread-local storage
-        self.query_lock = threading.Lock()
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout  # Milliseconds to wait on another process's lock
+
+        # Messages are committed in groups of up to `batch_size`, waiting at most
+        # `batch_delay` milliseconds for a group to fill (a size of 1 commits each alone)
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.committer = None
+
+        # In WAL mode readers never block the writer (or each other), so each thread
+        # reads through its own connection without locking, while writes are
+        # serialized through a single writer connection.
+        self.local = threading.local()  # Thread-local read connections
+        self.write_lock = threading.Lock()
+        self.writer = None
+
+        # username -> (id, password_hash), and (smaller user id, larger user id) -> conversation_id.
+        # Only writers (under `write_lock`) use the conversation cache.
+        self.user_cache = LRUCache(cache_size)
+        self.conversation_cache = LRUCache(cache_size)
+        self.stale_keys = []  # Invalidated again once the current write commits
         
         self.init_db()
 
     def init_db(self):
         """Initialize the user database, conversations, and messages tables if they don't exist."""
-        conn = self.get_conn()
+        conn = self.get_writer()
         cursor = conn.cursor()
+        # The journal mode is persistent, and must be set outside a transaction
+        cursor.execute(f"PRAGMA journal_mode = {self.journal_mode}")
 
         # Create users table
         cursor.execute(
@@ -49,148 +346,245 @@ class AccountDatabase:
         )
         conn.commit()
 
+        # Migrate under a write lock so concurrently opened databases migrate once
+        with self.writing() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            self.migrate_db(cursor)
+
+    def migrate_db(self, cursor):
+        """Bring the schema of an existing database up to `SCHEMA_VERSION`."""
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        if version < 1:
+            # Messages used to record the sender's username instead of their id
+            cursor.execute("""
+                UPDATE messages SET user_id = (SELECT id FROM users WHERE username = messages.user_id)
+                WHERE typeof(user_id) = 'text'
+            """)
+            # Conversations store their participants as a canonical (smaller id, larger id) pair
+            cursor.execute("""
+                UPDATE conversations SET user_id_1 = user_id_2, user_id_2 = user_id_1
+                WHERE user_id_1 > user_id_2
+            """)
+            # Fold duplicate conversations of a pair into the oldest one
+            cursor.execute("""
+                UPDATE messages SET conversation_id = (
+                    SELECT MIN(c2.conversation_id)
+                    FROM conversations c1
+                    JOIN conversations c2 ON c2.user_id_1 = c1.user_id_1 AND c2.user_id_2 = c1.user_id_2
+                    WHERE c1.conversation_id = messages.conversation_id
+                )
+                WHERE conversation_id IN (SELECT conversation_id FROM conversations)
+            """)
+            cursor.execute("""
+                DELETE FROM conversations WHERE conversation_id NOT IN (
+                    SELECT MIN(conversation_id) FROM conversations GROUP BY user_id_1, user_id_2
+                )
+            """)
+            # Participant lookups, and each conversation's messages in id order
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_conversations_pair ON conversations (user_id_1, user_id_2)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_2 ON conversations (user_id_2)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, message_id)")
+
+        if version < 2:
+            # The newest message id each participant has read, for unread counts
+            cursor.execute("ALTER TABLE conversations ADD COLUMN last_read_1 INTEGER NOT NULL DEFAULT 0")
+            cursor.execute("ALTER TABLE conversations ADD COLUMN last_read_2 INTEGER NOT NULL DEFAULT 0")
+
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        logger.info("[Server] Migrated database schema from version %s to %s.", version, SCHEMA_VERSION)
+
+    def connect(self):
+        """Open a SQLite connection with the configured durability and lock waiting."""
+        conn = sql.connect(self.db_name, check_same_thread=False, timeout=self.busy_timeout / 1000)
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        return conn
+
     def get_conn(self):
-        """Return a thread-local SQLite connection."""
+        """Return a thread-local SQLite connection, used for reads."""
         if not hasattr(self.local, 'conn'):
             # Create a new connection for this thread
-            self.local.conn = sql.connect(self.db_name, check_same_thread=False)
+            self.local.conn = self.connect()
         return self.local.conn
 
+    def get_writer(self):
+        """Return the connection all writes go through."""
+        if self.writer is None:
+            self.writer = self.connect()
+        return self.writer
+
+    @contextmanager
+    def reading(self):
+        """Yield a cursor on this thread's read connection; reads see the last committed write."""
+        cursor = self.get_conn().cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def writing(self):
+        """Yield a cursor on the writer connection, committing when the block ends (rolling back on error)."""
+        with self.write_lock:
+            conn = self.get_writer()
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                # Cached conversations may have been created by the rolled back transaction
+                self.conversation_cache.invalidate()
+                raise
+            finally:
+                cursor.close()
+                # Readers may have cached rows from before the commit
+                for cache, key in self.stale_keys:
+                    cache.invalidate(key)
+                self.stale_keys.clear()
+
+    def invalidate(self, cache: LRUCache, key):
+        """Drop a cached entry during a write, and again once the write commits."""
+        cache.invalidate(key)
+        self.stale_keys.append((cache, key))
+
+    def cache_stats(self) -> dict:
+        """Return the hit/miss counters of the user and conversation caches."""
+        return {"users": self.user_cache.stats(), "conversations": self.conversation_cache.stats()}
+
+    def get_user(self, cursor, username: str) -> tuple | None:
+        """Look up a user's (id, password_hash) through the cache (None if there is no such user)."""
+        user = self.user_cache.get(username)
+        if user is None:
+            version = self.user_cache.version
+            cursor.execute("SELECT id, password_hash FROM users WHERE username = ?", (username,))
+            user = cursor.fetchone()
+            if user is not None:
+                self.user_cache.put(username, user, version)
+        return user
+
+    def get_user_id(self, cursor, username: str) -> int | None:
+        """Look up a user's id (None if there is no such user)."""
+        user = self.get_user(cursor, username)
+        return user[0] if user else None
+
+    def get_conversation_id(self, cursor, user_id_1: int, user_id_2: int) -> int:
+        """Find or create the conversation between two users with the writer's `cursor`."""
+        pair = (min(user_id_1, user_id_2), max(user_id_1, user_id_2))
+        conversation_id = self.conversation_cache.get(pair)
+        if conversation_id is None:
+            version = self.conversation_cache.version
+            # Concurrent writers (in other processes) are reconciled by the unique pair index
+            cursor.execute("INSERT OR IGNORE INTO conversations (user_id_1, user_id_2) VALUES (?, ?)", pair)
+            cursor.execute("SELECT conversation_id FROM conversations WHERE user_id_1 = ? AND user_id_2 = ?", pair)
+            conversation_id = cursor.fetchone()[0]
+            self.conversation_cache.put(pair, conversation_id, version)
+        return conversation_id
+
     def create_account(self, username: str, hashed_password: str) -> bool:
         """Adds an account to the user database given a `username` and `password`."""
         if not username or not hashed_password:
-            print("[Server] Error: Empty username or password.")
+            logger.info("[Server] Error: Empty username or password.")
             return False
 
-        with self.query_lock:
-            conn = self.get_conn()
-            cursor = conn.cursor()
+        with self.writing() as cursor:
             try:
                 cursor.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, hashed_password))
-                conn.commit()
-                print(f"[Server] Account '{username}' added successfully.")
+                logger.info("[Server] Account '%s' added successfully.", username)
                 return True
             except sql.IntegrityError:
-                print("[Server] Error: Username already exists.")
+                logger.info("[Server] Error: Username already exists.")
                 return False
 
     def login_account(self, username: str, hashed_password: str) -> bool:
         """Check if username and password match."""
-        with self.query_lock:
-            conn = self.get_conn()
-            cursor = conn.cursor()
-
-            cursor.execute("SELECT password_hash FROM users WHERE username = ?", (username,))
-            result = cursor.fetchone()
+        with self.reading() as cursor:
+            result = self.get_user(cursor, username)
             if result:
-                return hashed_password == result[0]
+                return hashed_password == result[1]
             return False
 
     def create_conversation(self, username_1: str, username_2: str) -> bool:
         """Create a conversation (chat) between two users."""
         if username_1 == username_2:
-            print("[Server] Error: Users are the same.")
+            logger.info("[Server] Error: Users are the same.")
             return False
 
-        conn = self.get_conn()
-        cursor = conn.cursor()
-
-        # Get user IDs for both users
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username_1,))
-        user_1 = cursor.fetchone()
-
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username_2,))
-        user_2 = cursor.fetchone()
+        with self.writing() as cursor:
+            # Get user IDs for both users
+            user_1_id = self.get_user_id(cursor, username_1)
+            user_2_id = self.get_user_id(cursor, username_2)
 
-        if user_1 and user_2:
-            user_1_id, user_2_id = user_1[0], user_2[0]
-
-            # Check if conversation already exists
-            cursor.execute("""
-                SELECT conversation_id FROM conversations 
-                WHERE (user_id_1 = ? AND user_id_2 = ?) 
-                OR (user_id_1 = ? AND user_id_2 = ?)
-            """, (user_1_id, user_2_id, user_2_id, user_1_id))
-
-            existing_conversation = cursor.fetchone()
-            if existing_conversation:
-                print(f"[Server] Error: Conversation between '{username_1}' and '{username_2}' already exists.")
+            if user_1_id is None or user_2_id is None:
+                logger.info("[Server] Error: One or more users not found.")
                 return False
 
-            # Insert new conversation if none exists
-            cursor.execute("""
-                INSERT INTO conversations (user_id_1, user_id_2) 
-                VALUES (?, ?)
-            """, (user_1_id, user_2_id))
-            conn.commit()
+            try:
+                # Participants are stored as a canonical pair, which the unique index keeps to one conversation
+                cursor.execute("""
+                    INSERT INTO conversations (user_id_1, user_id_2) 
+                    VALUES (?, ?)
+                """, (min(user_1_id, user_2_id), max(user_1_id, user_2_id)))
+            except sql.IntegrityError:
+                logger.info("[Server] Error: Conversation between '%s' and '%s' already exists.", username_1, username_2)
+                return False
             
-            print(f"[Server] Conversation between '{username_1}' and '{username_2}' created.")
+            logger.info("[Server] Conversation between '%s' and '%s' created.", username_1, username_2)
             return True
 
-        else:
-            print("[Server] Error: One or more users not found.")
-            return False
+    def store_text_message(self, username_1: str, username_2: str, message_text: str) -> int | None:
+        """Like `send_text_message`, but returns the new message's id (or None if it could not be delivered)."""
+        if not message_text:
+            logger.info("[Server] Error: Empty message.")
+            return None
 
+        return self.write(self.insert_text_message, username_1, username_2, message_text)
 
-    def send_text_message(self, username_1: str, username_2: str, message_text: str) -> bool:
-        """Add a message to a conversation between two users where `username_1` is sender and `username_2` is receiver."""
-        if not message_text:
-            print("[Server] Error: Empty message.")
-            return False
-        
-        with self.query_lock:
-            conn = self.get_conn()
-            cursor = conn.cursor()
+    def submit_text_message(self, username_1: str, username_2: str, message_text: str) -> Future:
+        """Queue a message for the next group commit; the future resolves with its id (or None) once committed."""
+        return self.submit_write(self.insert_text_message, username_1, username_2, message_text)
 
-            def cursor_fetch_execute():
-                cursor.execute("""
-                    SELECT c.conversation_id 
-                    FROM conversations c
-                    JOIN users u1 ON u1.id = c.user_id_1
-                    JOIN users u2 ON u2.id = c.user_id_2
-                    WHERE (u1.username = ? AND u2.username = ?)
-                    OR (u1.username = ? AND u2.username = ?)
-                """, (username_1, username_2, username_2, username_1))
-
-            cursor_fetch_execute()
-            conversation = cursor.fetchone()
-            if not conversation:
-                status = self.create_conversation(username_1, username_2)
-                if not status:
-                    print("[Server] Message could not be delivered.")
-                    return False
-                cursor_fetch_execute()
-                conversation = cursor.fetchone()
-                if not conversation:
-                    print("[Server] Message could not be delivered.")
-                    return False
-            conversation_id = conversation[0]
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.') + f"{datetime.now().microsecond}"
-            cursor.execute("""
-                INSERT INTO messages (conversation_id, user_id, message_text, timestamp) 
-                VALUES (?, ?, ?, ?)
-            """, (conversation_id, username_1, message_text, timestamp)) 
-            conn.commit()
-            print(f"[Server] Message '{message_text}' added to conversation between '{username_1}' and '{username_2}'.")
-            return True
+    def submit_write(self, write, *args) -> Future:
+        """Queue `write(cursor, *args)` for the next group commit; the future resolves with its result once committed."""
+        if self.committer is None:
+            with self.write_lock:
+                if self.committer is None:
+                    self.committer = GroupCommitter(self, self.batch_size, self.batch_delay)
+        return self.committer.submit(write, *args)
+
+    def write(self, write, *args):
+        """Run `write(cursor, *args)` on the writer, through group commit if it is enabled, and return its result."""
+        if self.batch_size > 1:
+            return self.submit_write(write, *args).result()
+        with self.writing() as cursor:
+            return write(cursor, *args)
+
+    def insert_text_message(self, cursor, username_1: str, username_2: str, message_text: str) -> int | None:
+        """Insert a message with the writer's `cursor`, leaving the commit to the caller."""
+        sender_id = self.get_user_id(cursor, username_1)
+        receiver_id = self.get_user_id(cursor, username_2)
+        if not message_text or sender_id is None or receiver_id is None or sender_id == receiver_id:
+            logger.info("[Server] Message could not be delivered.")
+            return None
+
+        conversation_id = self.get_conversation_id(cursor, sender_id, receiver_id)
+
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')
+        cursor.execute("""
+            INSERT INTO messages (conversation_id, user_id, message_text, timestamp) 
+            VALUES (?, ?, ?, ?)
+        """, (conversation_id, sender_id, message_text, timestamp)) 
+        logger.debug("[Server] Message '%s' added to conversation between '%s' and '%s'.", message_text, username_1, username_2)
+        return cursor.lastrowid
 
     def fetch_text_messages(self, username_1: str, k: int) -> list[str]:
         """Retrieve the k most recent messages between two users."""
-        with self.query_lock:
-            conn = self.get_conn()
-            cursor = conn.cursor()
-
-            cursor.execute("""
-                SELECT m.message_id, u1.username, u2.username, m.message_text
-                FROM messages m
-                JOIN conversations c ON m.conversation_id = c.conversation_id
-                JOIN users u1 ON u1.id = c.user_id_1
-                JOIN users u2 ON u2.id = c.user_id_2
-                WHERE (u1.username = ?) 
-                OR (u2.username = ?)
-                ORDER BY m.timestamp DESC
-                LIMIT ?
-            """, (username_1, username_1, k))
+        with self.reading() as cursor:
+            user_id = self.get_user_id(cursor, username_1)
+            cursor.execute(FETCH_MESSAGES_SQL, {"user_id": user_id, "k": k})
 
             fetched_messages = cursor.fetchall()
             messages = []
@@ -201,89 +595,719 @@ class AccountDatabase:
                 messages.append('|'.join(message_data))
 
             if messages:
-                print(f"[Server] The k={k} most recent messages involving '{username_1}':")
-                for message in messages:
-                    print("[+]", message)
+                logger.debug("[Server] The k=%s most recent messages involving '%s':", k, username_1)
+                if logger.isEnabledFor(logging.DEBUG):
+                    for message in messages:
+                        logger.debug("[+] %s", message)
             else:
-                print(f"[Server] No messages found involving'{username_1}'.")
+                logger.debug("[Server] No messages found involving'%s'.", username_1)
                 messages.append("")
             return messages
 
-    def delete_text_message(self, message_id):
+    def fetch_text_message_page(self, username_1: str, direction: str, cursor_id: int, k: int) -> list[tuple]:
         """
-        Deletes a message from the database based on the given message_id.
-        If the deleted message was the last in its conversation, the conversation is also deleted.
+        Retrieve up to k messages involving a user, paging by message id.
+        `direction` "before" returns the messages just older than `cursor_id` (newest first; 0 starts at the newest),
+        and "after" returns the messages just newer than `cursor_id` (oldest first).
+        Rows are (message_id, sender, receiver, message_text).
         """
-        message_id = int(message_id)
-        conn = self.get_conn()
-        cursor = conn.cursor()
+        if direction == "before":
+            query = FETCH_PAGE_BEFORE_SQL
+            if cursor_id <= 0:
+                cursor_id = MAX_MESSAGE_ID
+        elif direction == "after":
+            query = FETCH_PAGE_AFTER_SQL
+        else:
+            logger.info("[Server] Error: Unknown page direction '%s'.", direction)
+            return []
 
-        # Find the conversation_id of the message to be deleted
-        cursor.execute("SELECT conversation_id FROM messages WHERE message_id = ?", (message_id,))
-        row = cursor.fetchone()
-        
-        if not row:
-            cursor.close()
-            return False  # Message not found
+        with self.reading() as cursor:
+            user_id = self.get_user_id(cursor, username_1)
+            cursor.execute(query, {"user_id": user_id, "cursor_id": cursor_id, "k": k})
+            return cursor.fetchall()
+
+    def fetch_conversation_page(self, username_1: str, username_2: str, direction: str, cursor_id: int, k: int) -> list[tuple]:
+        """
+        Retrieve up to k messages between two users, paging by message id like `fetch_text_message_page`.
+        Rows are (message_id, sender, receiver, message_text).
+        """
+        with self.reading() as cursor:
+            user_1_id, user_2_id = self.get_user_id(cursor, username_1), self.get_user_id(cursor, username_2)
+            if user_1_id is None or user_2_id is None:
+                return []
+            rows = self.read_conversation_page(cursor, user_1_id, user_2_id, direction, cursor_id, k)
+        return [
+            (m_id, username_1, username_2, message_text) if sender_id == user_1_id else (m_id, username_2, username_1, message_text)
+            for m_id, sender_id, message_text in rows
+        ]
+
+    def read_conversation_page(self, cursor, user_id_1: int, user_id_2: int, direction: str, cursor_id: int, k: int) -> list[tuple]:
+        """Read a page of one conversation's (message_id, sender_id, message_text) rows with `cursor`."""
+        if direction == "before":
+            query = CONVERSATION_PAGE_BEFORE_SQL
+            if cursor_id <= 0:
+                cursor_id = MAX_MESSAGE_ID
+        elif direction == "after":
+            query = CONVERSATION_PAGE_AFTER_SQL
+        else:
+            logger.info("[Server] Error: Unknown page direction '%s'.", direction)
+            return []
 
-        conversation_id = row[0]
+        cursor.execute(query, {
+            "user_id_1": min(user_id_1, user_id_2), "user_id_2": max(user_id_1, user_id_2), "cursor_id": cursor_id, "k": k
+        })
+        return cursor.fetchall()
 
-        # Delete the message
-        cursor.execute("DELETE FROM messages WHERE message_id = ?", (message_id,))
-        conn.commit()
+    def fetch_conversation_list(self, username: str) -> list[tuple]:
+        """
+        Retrieve a user's conversations, most recently active first, as
+        (counterparty, last_message_id, last_sender, last_message_text, unread) rows.
+        """
+        with self.reading() as cursor:
+            user_id = self.get_user_id(cursor, username)
+            if user_id is None:
+                return []
+            cursor.execute(CONVERSATION_LIST_SQL, {"user_id": user_id})
+            rows = cursor.fetchall()
+            usernames = self.get_usernames(cursor, {row[0] for row in rows} | {user_id})
+        return [
+            (usernames.get(other_id), last_id, usernames.get(sender_id, ""), last_text, unread)
+            for other_id, last_id, sender_id, last_text, unread in rows
+        ]
 
-        # Check if there are any remaining messages in the conversation
-        cursor.execute("SELECT COUNT(*) FROM messages WHERE conversation_id = ?", (conversation_id,))
-        remaining_messages = cursor.fetchone()[0]
+    def get_usernames(self, cursor, user_ids) -> dict:
+        """Map user ids to usernames (ids with no user are left out)."""
+        user_ids = tuple(user_ids)
+        cursor.execute(f"SELECT id, username FROM users WHERE id IN ({','.join('?' * len(user_ids))})", user_ids)
+        return dict(cursor.fetchall())
 
-        if remaining_messages == 0:
-            # Delete the conversation if no messages are left
-            cursor.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
-            conn.commit()
+    def mark_conversation_read(self, username_1: str, username_2: str, message_id: int) -> bool:
+        """Marks the messages `username_1` received from `username_2` up to `message_id` as read."""
+        with self.writing() as cursor:
+            user_1_id, user_2_id = self.get_user_id(cursor, username_1), self.get_user_id(cursor, username_2)
+            if user_1_id is None or user_2_id is None:
+                return False
+            return self.write_read_marker(cursor, user_1_id, user_2_id, int(message_id))
 
-        cursor.close()
-        return True
+    def write_read_marker(self, cursor, user_id: int, other_id: int, message_id: int) -> bool:
+        """Move `user_id`'s read marker in its conversation with `other_id` forward to `message_id` with the writer's `cursor`."""
+        # The marker never moves backwards, so a late or repeated request cannot unread messages
+        cursor.execute("""
+            UPDATE conversations SET
+                last_read_1 = CASE WHEN user_id_1 = :user_id THEN MAX(last_read_1, :message_id) ELSE last_read_1 END,
+                last_read_2 = CASE WHEN user_id_2 = :user_id THEN MAX(last_read_2, :message_id) ELSE last_read_2 END
+            WHERE user_id_1 = :user_id_1 AND user_id_2 = :user_id_2
+        """, {
+            "user_id": user_id, "message_id": message_id,
+            "user_id_1": min(user_id, other_id), "user_id_2": max(user_id, other_id)
+        })
+        return cursor.rowcount > 0
+
+    def delete_text_messages(self, message_ids) -> list[bool]:
+        """
+        Deletes messages from the database based on the given message ids, in one transaction.
+        Conversations left without messages are deleted too, in a single pass at the end.
+        """
+        message_ids = [int(message_id) for message_id in message_ids]
+        unique_ids = list(dict.fromkeys(message_ids))
+        found, conversation_ids = set(), set()
+        with self.writing() as cursor:
+            for i in range(0, len(unique_ids), DELETE_CHUNK_SIZE):
+                chunk = unique_ids[i:i + DELETE_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"SELECT message_id, conversation_id FROM messages WHERE message_id IN ({placeholders})", chunk)
+                for message_id, conversation_id in cursor.fetchall():
+                    found.add(message_id)
+                    conversation_ids.add(conversation_id)
+                cursor.execute(f"DELETE FROM messages WHERE message_id IN ({placeholders})", chunk)
+
+            # Garbage-collect the touched conversations that are now empty
+            conversation_ids = list(conversation_ids)
+            for i in range(0, len(conversation_ids), DELETE_CHUNK_SIZE):
+                chunk = conversation_ids[i:i + DELETE_CHUNK_SIZE]
+                cursor.execute(f"""
+                    SELECT conversation_id, user_id_1, user_id_2 FROM conversations c
+                    WHERE conversation_id IN ({",".join("?" * len(chunk))})
+                    AND NOT EXISTS (SELECT 1 FROM messages m WHERE m.conversation_id = c.conversation_id)
+                """, chunk)
+                empty = cursor.fetchall()
+                cursor.executemany("DELETE FROM conversations WHERE conversation_id = ?", [(row[0],) for row in empty])
+                for _, user_id_1, user_id_2 in empty:
+                    self.invalidate(self.conversation_cache, (user_id_1, user_id_2))
+
+        # Only the first occurrence of a repeated id did the deleting
+        statuses = []
+        for message_id in message_ids:
+            statuses.append(message_id in found)
+            found.discard(message_id)
+        return statuses
 
     def delete_account(self, username: str) -> bool:
         """
         Deletes the specified user's account and all messages (and conversations) 
         associated with that user.
         """
-        with self.query_lock:
-            conn = self.get_conn()
-            cursor = conn.cursor()
-
+        with self.writing() as cursor:
             # 1. Find the user ID
             cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
             row = cursor.fetchone()
             if not row:
-                print(f"[Server] Error: User '{username}' does not exist.")
+                logger.info("[Server] Error: User '%s' does not exist.", username)
                 return False
             user_id = row[0]
 
-            # 2. Find all conversations in which this user participates (as user_id_1 or user_id_2)
-            cursor.execute(
-                "SELECT conversation_id FROM conversations WHERE user_id_1 = ? OR user_id_2 = ?",
-                (user_id, user_id)
+            # 2. Delete all conversations in which this user participates, with their messages
+            self.purge_conversations(cursor, user_id)
+
+            # 3. Finally, delete the user record
+            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            self.invalidate(self.user_cache, username)
+
+            logger.info("[Server] Account '%s' and all associated data removed successfully.", username)
+            return True
+
+    def purge_conversations(self, cursor, user_id: int):
+        """
+        Delete every conversation of a user, and their messages, with the writer's `cursor`.
+        Set-based statements keep this to three index-driven queries however many conversations there are.
+        """
+        cursor.execute("""
+            DELETE FROM messages WHERE conversation_id IN (
+                SELECT conversation_id FROM conversations WHERE user_id_1 = :user_id
+                UNION ALL
+                SELECT conversation_id FROM conversations WHERE user_id_2 = :user_id
             )
-            conversation_ids = cursor.fetchall()
+        """, {"user_id": user_id})
+        cursor.execute("DELETE FROM conversations WHERE user_id_1 = :user_id OR user_id_2 = :user_id", {"user_id": user_id})
+        if cursor.rowcount:
+            # Every cached pair involving the user is gone; dropping them all beats finding each one
+            self.invalidate(self.conversation_cache, None)
 
-            # 3. For each conversation, delete all messages and then delete the conversation
-            for (conv_id,) in conversation_ids:
-                cursor.execute("DELETE FROM messages WHERE conversation_id = ?", (conv_id,))
-                cursor.execute("DELETE FROM conversations WHERE conversation_id = ?", (conv_id,))
+    def close(self):
+        """Commit any queued messages, then close the read connection for the current thread and the writer connection."""
+        if self.committer is not None:
+            self.committer.stop()
+            self.committer = None
+        if hasattr(self.local, 'conn'):
+            self.local.conn.close()
+            del self.local.conn
+        with self.write_lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
 
-            # 4. Finally, delete the user record
-            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            
-            conn.commit()
-            cursor.close()
+class MemoryDatabase(StorageBackend):
+    """
+    Storage kept entirely in dictionaries, for load tests and ephemeral deployments.
+    Each conversation holds its newest `max_messages` messages in a ring buffer; older ones are dropped.
+    """
+
+    def __init__(self, max_messages=1024):
+        self.max_messages = max_messages
+        self.lock = threading.Lock()
+        self.users = {}  # username -> (id, password_hash)
+        self.usernames = {}  # id -> username
+        self.conversations = {}  # (smaller user id, larger user id) -> conversation_id
+        self.conversation_pairs = {}  # conversation_id -> (smaller user id, larger user id)
+        self.user_conversations = {}  # user id -> conversation_ids
+        self.conversation_messages = {}  # conversation_id -> deque of (message_id, sender_id, message_text)
+        self.message_conversations = {}  # message_id -> conversation_id
+        self.read_markers = {}  # (conversation_id, user id) -> newest message id the user has read
+        self.next_user_id = 1
+        self.next_conversation_id = 1
+        self.next_message_id = 1
+
+    def create_account(self, username: str, hashed_password: str) -> bool:
+        """Adds an account to the user database given a `username` and `password`."""
+        if not username or not hashed_password:
+            logger.info("[Server] Error: Empty username or password.")
+            return False
+
+        with self.lock:
+            if username in self.users:
+                logger.info("[Server] Error: Username already exists.")
+                return False
+            user_id = self.next_user_id
+            self.next_user_id += 1
+            self.users[username] = (user_id, hashed_password)
+            self.usernames[user_id] = username
+            self.user_conversations[user_id] = set()
+            logger.info("[Server] Account '%s' added successfully.", username)
+            return True
+
+    def login_account(self, username: str, hashed_password: str) -> bool:
+        """Check if username and password match."""
+        user = self.users.get(username)
+        return user is not None and hashed_password == user[1]
+
+    def get_conversation_id(self, user_id_1: int, user_id_2: int) -> int:
+        """Find or create the conversation between two users (with `lock` held)."""
+        pair = (min(user_id_1, user_id_2), max(user_id_1, user_id_2))
+        conversation_id = self.conversations.get(pair)
+        if conversation_id is None:
+            conversation_id = self.next_conversation_id
+            self.next_conversation_id += 1
+            self.conversations[pair] = conversation_id
+            self.conversation_pairs[conversation_id] = pair
+            self.conversation_messages[conversation_id] = deque(maxlen=self.max_messages)
+            for user_id in pair:
+                self.user_conversations[user_id].add(conversation_id)
+        return conversation_id
+
+    def remove_conversation(self, conversation_id: int):
+        """Delete a conversation and its messages (with `lock` held)."""
+        pair = self.conversation_pairs.pop(conversation_id)
+        del self.conversations[pair]
+        for m_id, _, _ in self.conversation_messages.pop(conversation_id):
+            del self.message_conversations[m_id]
+        for user_id in pair:
+            self.user_conversations[user_id].discard(conversation_id)
+            self.read_markers.pop((conversation_id, user_id), None)
+
+    def create_conversation(self, username_1: str, username_2: str) -> bool:
+        """Create a conversation (chat) between two users."""
+        if username_1 == username_2:
+            logger.info("[Server] Error: Users are the same.")
+            return False
 
-            print(f"[Server] Account '{username}' and all associated data removed successfully.")
+        with self.lock:
+            user_1, user_2 = self.users.get(username_1), self.users.get(username_2)
+            if user_1 is None or user_2 is None:
+                logger.info("[Server] Error: One or more users not found.")
+                return False
+            if (min(user_1[0], user_2[0]), max(user_1[0], user_2[0])) in self.conversations:
+                logger.info("[Server] Error: Conversation between '%s' and '%s' already exists.", username_1, username_2)
+                return False
+            self.get_conversation_id(user_1[0], user_2[0])
+            logger.info("[Server] Conversation between '%s' and '%s' created.", username_1, username_2)
+            return True
+
+    def store_text_message(self, username_1: str, username_2: str, message_text: str) -> int | None:
+        """Like `send_text_message`, but returns the new message's id (or None if it could not be delivered)."""
+        if not message_text:
+            logger.info("[Server] Error: Empty message.")
+            return None
+
+        with self.lock:
+            sender, receiver = self.users.get(username_1), self.users.get(username_2)
+            if sender is None or receiver is None or sender[0] == receiver[0]:
+                logger.info("[Server] Message could not be delivered.")
+                return None
+
+            conversation_id = self.get_conversation_id(sender[0], receiver[0])
+            messages = self.conversation_messages[conversation_id]
+            if len(messages) == messages.maxlen:
+                # The ring buffer is full, so the oldest message is about to be overwritten
+                del self.message_conversations[messages[0][0]]
+            m_id = self.next_message_id
+            self.next_message_id += 1
+            messages.append((m_id, sender[0], message_text))
+            self.message_conversations[m_id] = conversation_id
+            return m_id
+
+    def fetch_text_message_page(self, username_1: str, direction: str, cursor_id: int, k: int) -> list[tuple]:
+        """
+        Retrieve up to k messages involving a user, paging by message id.
+        `direction` "before" returns the messages just older than `cursor_id` (newest first; 0 starts at the newest),
+        and "after" returns the messages just newer than `cursor_id` (oldest first).
+        Rows are (message_id, sender, receiver, message_text).
+        """
+        if direction == "before":
+            if cursor_id <= 0:
+                cursor_id = MAX_MESSAGE_ID
+        elif direction != "after":
+            logger.info("[Server] Error: Unknown page direction '%s'.", direction)
+            return []
+
+        with self.lock:
+            user = self.users.get(username_1)
+            if user is None:
+                return []
+            user_id = user[0]
+            rows = []
+            for conversation_id in self.user_conversations[user_id]:
+                pair = self.conversation_pairs[conversation_id]
+                # Each ring buffer is in id order, so only its first k matches can make the page
+                if direction == "before":
+                    matches = (message for message in reversed(self.conversation_messages[conversation_id]) if message[0] < cursor_id)
+                else:
+                    matches = (message for message in self.conversation_messages[conversation_id] if message[0] > cursor_id)
+                for _, (m_id, sender_id, message_text) in zip(range(k), matches):
+                    receiver_id = pair[1] if sender_id == pair[0] else pair[0]
+                    rows.append((m_id, self.usernames[sender_id], self.usernames[receiver_id], message_text))
+            rows.sort(key=lambda row: row[0], reverse=(direction == "before"))
+            return rows[:k]
+
+    def fetch_conversation_page(self, username_1: str, username_2: str, direction: str, cursor_id: int, k: int) -> list[tuple]:
+        """
+        Retrieve up to k messages between two users, paging by message id like `fetch_text_message_page`.
+        Rows are (message_id, sender, receiver, message_text).
+        """
+        if direction == "before":
+            if cursor_id <= 0:
+                cursor_id = MAX_MESSAGE_ID
+        elif direction != "after":
+            logger.info("[Server] Error: Unknown page direction '%s'.", direction)
+            return []
+
+        with self.lock:
+            user_1, user_2 = self.users.get(username_1), self.users.get(username_2)
+            if user_1 is None or user_2 is None:
+                return []
+            conversation_id = self.conversations.get((min(user_1[0], user_2[0]), max(user_1[0], user_2[0])))
+            if conversation_id is None:
+                return []
+            if direction == "before":
+                matches = (message for message in reversed(self.conversation_messages[conversation_id]) if message[0] < cursor_id)
+            else:
+                matches = (message for message in self.conversation_messages[conversation_id] if message[0] > cursor_id)
+            return [
+                (m_id, username_1, username_2, message_text) if sender_id == user_1[0] else (m_id, username_2, username_1, message_text)
+                for _, (m_id, sender_id, message_text) in zip(range(k), matches)
+            ]
+
+    def fetch_conversation_list(self, username: str) -> list[tuple]:
+        """
+        Retrieve a user's conversations, most recently active first, as
+        (counterparty, last_message_id, last_sender, last_message_text, unread) rows.
+        """
+        with self.lock:
+            user = self.users.get(username)
+            if user is None:
+                return []
+            user_id = user[0]
+            rows = []
+            for conversation_id in self.user_conversations[user_id]:
+                pair = self.conversation_pairs[conversation_id]
+                other_id = pair[1] if pair[0] == user_id else pair[0]
+                messages = self.conversation_messages[conversation_id]
+                read_marker = self.read_markers.get((conversation_id, user_id), 0)
+                unread = 0
+                for m_id, sender_id, _ in reversed(messages):
+                    if m_id <= read_marker:
+                        break
+                    unread += sender_id != user_id
+                if messages:
+                    m_id, sender_id, message_text = messages[-1]
+                    rows.append((self.usernames[other_id], m_id, self.usernames[sender_id], message_text, unread))
+                else:
+                    rows.append((self.usernames[other_id], 0, "", "", 0))
+            rows.sort(key=lambda row: row[1], reverse=True)
+            return rows
+
+    def mark_conversation_read(self, username_1: str, username_2: str, message_id: int) -> bool:
+        """Marks the messages `username_1` received from `username_2` up to `message_id` as read."""
+        with self.lock:
+            user_1, user_2 = self.users.get(username_1), self.users.get(username_2)
+            if user_1 is None or user_2 is None:
+                return False
+            conversation_id = self.conversations.get((min(user_1[0], user_2[0]), max(user_1[0], user_2[0])))
+            if conversation_id is None:
+                return False
+            key = (conversation_id, user_1[0])
+            # The marker never moves backwards, so a late or repeated request cannot unread messages
+            self.read_markers[key] = max(self.read_markers.get(key, 0), int(message_id))
+            return True
+
+    def delete_text_messages(self, message_ids) -> list[bool]:
+        """
+        Deletes messages from the database based on the given message ids.
+        Conversations left without messages are deleted too.
+        """
+        statuses = []
+        deleted = {}  # conversation_id -> ids deleted from it
+        with self.lock:
+            for message_id in message_ids:
+                message_id = int(message_id)
+                conversation_id = self.message_conversations.pop(message_id, None)
+                statuses.append(conversation_id is not None)
+                if conversation_id is not None:
+                    deleted.setdefault(conversation_id, set()).add(message_id)
+
+            # Rebuild each touched ring buffer once rather than searching it per id
+            for conversation_id, ids in deleted.items():
+                messages = self.conversation_messages[conversation_id]
+                kept = [message for message in messages if message[0] not in ids]
+                if kept:
+                    self.conversation_messages[conversation_id] = deque(kept, maxlen=self.max_messages)
+                else:
+                    messages.clear()
+                    self.remove_conversation(conversation_id)
+        return statuses
+
+    def delete_account(self, username: str) -> bool:
+        """
+        Deletes the specified user's account and all messages (and conversations) 
+        associated with that user.
+        """
+        with self.lock:
+            user = self.users.pop(username, None)
+            if user is None:
+                logger.info("[Server] Error: User '%s' does not exist.", username)
+                return False
+            user_id = user[0]
+            for conversation_id in list(self.user_conversations[user_id]):
+                self.remove_conversation(conversation_id)
+            del self.user_conversations[user_id]
+            del self.usernames[user_id]
+            logger.info("[Server] Account '%s' and all associated data removed successfully.", username)
             return True
 
+class ShardedDatabase(StorageBackend):
+    """
+    Conversations and messages split across `shards` SQLite files, with users in a directory database.
+    A conversation lives on the shard picked by a stable hash of its canonical user pair, so sends
+    to different shards commit in parallel on their own writer connections.
+    Message ids are `sequence * shards + shard`, so each id names the shard its message is stored on.
+    Each shard takes its next sequence inside the transaction that inserts the message, so processes
+    sharing the shard files never hand out the same id. The sequence is raised to the highest one this
+    instance has used on any shard, which keeps its ids increasing with time across shards.
+    """
+
+    def __init__(self, db_name, shards=2, **options):
+        self.num_shards = shards
+        self.directory = AccountDatabase(db_name, **options)
+        root, ext = os.path.splitext(db_name)
+        self.shards = [AccountDatabase(f"{root}.shard{i}{ext}", **options) for i in range(shards)]
+
+        self.sequence_lock = threading.Lock()
+        self.sequence = 1
+        for shard in self.shards:
+            with shard.reading() as cursor:
+                cursor.execute("SELECT MAX(message_id) FROM messages")
+                max_id = cursor.fetchone()[0]
+            if max_id is not None:
+                self.sequence = max(self.sequence, max_id // shards + 1)
+
+    def shard_index(self, user_id_1: int, user_id_2: int) -> int:
+        """Shard of the conversation between two users (stable across processes and restarts)."""
+        pair = f"{min(user_id_1, user_id_2)}:{max(user_id_1, user_id_2)}"
+        return zlib.crc32(pair.encode()) % self.num_shards
+
+    def next_sequence(self) -> int:
+        """The lowest sequence the next message may take on any shard."""
+        with self.sequence_lock:
+            return self.sequence
+
+    def used_message_id(self, message_id: int):
+        """Raise the sequence past an id a shard allocated."""
+        with self.sequence_lock:
+            self.sequence = max(self.sequence, message_id // self.num_shards + 1)
+
+    def get_user_id(self, username: str) -> int | None:
+        """Look up a user's id in the directory (None if there is no such user)."""
+        with self.directory.reading() as cursor:
+            return self.directory.get_user_id(cursor, username)
+
+    def create_account(self, username: str, hashed_password: str) -> bool:
+        """Adds an account to the directory."""
+        return self.directory.create_account(username, hashed_password)
+
+    def login_account(self, username: str, hashed_password: str) -> bool:
+        """Check if username and password match."""
+        return self.directory.login_account(username, hashed_password)
+
+    def create_conversation(self, username_1: str, username_2: str) -> bool:
+        """Create a conversation (chat) between two users on its shard."""
+        if username_1 == username_2:
+            logger.info("[Server] Error: Users are the same.")
+            return False
+
+        user_1_id, user_2_id = self.get_user_id(username_1), self.get_user_id(username_2)
+        if user_1_id is None or user_2_id is None:
+            logger.info("[Server] Error: One or more users not found.")
+            return False
+
+        shard = self.shards[self.shard_index(user_1_id, user_2_id)]
+        with shard.writing() as cursor:
+            try:
+                cursor.execute(
+                    "INSERT INTO conversations (user_id_1, user_id_2) VALUES (?, ?)",
+                    (min(user_1_id, user_2_id), max(user_1_id, user_2_id))
+                )
+            except sql.IntegrityError:
+                logger.info("[Server] Error: Conversation between '%s' and '%s' already exists.", username_1, username_2)
+                return False
+        logger.info("[Server] Conversation between '%s' and '%s' created.", username_1, username_2)
+        return True
+
+    def store_text_message(self, username_1: str, username_2: str, message_text: str) -> int | None:
+        """Like `send_text_message`, but returns the new message's id (or None if it could not be delivered)."""
+        if not message_text:
+            logger.info("[Server] Error: Empty message.")
+            return None
+
+        sender_id, receiver_id = self.get_user_id(username_1), self.get_user_id(username_2)
+        if sender_id is None or receiver_id is None or sender_id == receiver_id:
+            logger.info("[Server] Message could not be delivered.")
+            return None
+
+        shard_index = self.shard_index(sender_id, receiver_id)
+        try:
+            m_id = self.shards[shard_index].write(self.insert_shard_message, shard_index, sender_id, receiver_id, message_text)
+        except sql.Error as e:
+            logger.warning("[Server] Error: Message could not be stored: %s", e)
+            return None
+        self.used_message_id(m_id)
+        return m_id
+
+    def insert_shard_message(self, cursor, shard_index: int, sender_id: int, receiver_id: int, message_text: str) -> int:
+        """
+        Insert a message with the shard writer's `cursor`, leaving the commit to the caller.
+        Its id is computed by the INSERT itself, from the largest id the shard has ever stored
+        (kept by AUTOINCREMENT in `sqlite_sequence`), so it is taken under the shard's write lock.
+        """
+        conversation_id = self.shards[shard_index].get_conversation_id(cursor, sender_id, receiver_id)
+        cursor.execute("""
+            INSERT INTO messages (message_id, conversation_id, user_id, message_text, timestamp)
+            VALUES (
+                MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'messages'), 0) / :shards + 1, :sequence)
+                    * :shards + :shard,
+                :conversation_id, :user_id, :message_text, :timestamp
+            )
+        """, {
+            "shards": self.num_shards, "shard": shard_index, "sequence": self.next_sequence(),
+            "conversation_id": conversation_id, "user_id": sender_id, "message_text": message_text,
+            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'),
+        })
+        return cursor.lastrowid
+
+    def fetch_text_message_page(self, username_1: str, direction: str, cursor_id: int, k: int) -> list[tuple]:
+        """
+        Retrieve up to k messages involving a user, paging by message id.
+        `direction` "before" returns the messages just older than `cursor_id` (newest first; 0 starts at the newest),
+        and "after" returns the messages just newer than `cursor_id` (oldest first).
+        Rows are (message_id, sender, receiver, message_text).
+        """
+        if direction == "before":
+            query, newest_first = SHARD_PAGE_BEFORE_SQL, True
+            if cursor_id <= 0:
+                cursor_id = MAX_MESSAGE_ID
+        elif direction == "after":
+            query, newest_first = SHARD_PAGE_AFTER_SQL, False
+        else:
+            logger.info("[Server] Error: Unknown page direction '%s'.", direction)
+            return []
+
+        user_id = self.get_user_id(username_1)
+        if user_id is None:
+            return []
+
+        # Every shard returns its own first k rows in order, so merging them yields the page
+        shard_rows = []
+        for shard in self.shards:
+            with shard.reading() as cursor:
+                cursor.execute(query, {"user_id": user_id, "cursor_id": cursor_id, "k": k})
+                shard_rows.append(cursor.fetchall())
+        rows = list(heapq.merge(*shard_rows, key=lambda row: row[0], reverse=newest_first))[:k]
+
+        # Resolve the participants' names in the directory
+        user_ids = {row[2] for row in rows} | {row[3] for row in rows}
+        with self.directory.reading() as cursor:
+            usernames = self.directory.get_usernames(cursor, user_ids)
+        return [
+            (m_id, usernames.get(sender_id), usernames.get(user_id_2 if sender_id == user_id_1 else user_id_1), message_text)
+            for m_id, sender_id, user_id_1, user_id_2, message_text in rows
+        ]
+
+    def fetch_conversation_page(self, username_1: str, username_2: str, direction: str, cursor_id: int, k: int) -> list[tuple]:
+        """
+        Retrieve up to k messages between two users from their conversation's shard, paging like `fetch_text_message_page`.
+        Rows are (message_id, sender, receiver, message_text).
+        """
+        user_1_id, user_2_id = self.get_user_id(username_1), self.get_user_id(username_2)
+        if user_1_id is None or user_2_id is None:
+            return []
+
+        shard = self.shards[self.shard_index(user_1_id, user_2_id)]
+        with shard.reading() as cursor:
+            rows = shard.read_conversation_page(cursor, user_1_id, user_2_id, direction, cursor_id, k)
+        return [
+            (m_id, username_1, username_2, message_text) if sender_id == user_1_id else (m_id, username_2, username_1, message_text)
+            for m_id, sender_id, message_text in rows
+        ]
+
+    def fetch_conversation_list(self, username: str) -> list[tuple]:
+        """
+        Retrieve a user's conversations from every shard, most recently active first, as
+        (counterparty, last_message_id, last_sender, last_message_text, unread) rows.
+        """
+        user_id = self.get_user_id(username)
+        if user_id is None:
+            return []
+
+        rows = []
+        for shard in self.shards:
+            with shard.reading() as cursor:
+                cursor.execute(CONVERSATION_LIST_SQL, {"user_id": user_id})
+                rows.extend(cursor.fetchall())
+        rows.sort(key=lambda row: row[1], reverse=True)
+
+        with self.directory.reading() as cursor:
+            usernames = self.directory.get_usernames(cursor, {row[0] for row in rows} | {user_id})
+        return [
+            (usernames.get(other_id), last_id, usernames.get(sender_id, ""), last_text, unread)
+            for other_id, last_id, sender_id, last_text, unread in rows
+        ]
+
+    def mark_conversation_read(self, username_1: str, username_2: str, message_id: int) -> bool:
+        """Marks the messages `username_1` received from `username_2` up to `message_id` as read."""
+        user_1_id, user_2_id = self.get_user_id(username_1), self.get_user_id(username_2)
+        if user_1_id is None or user_2_id is None:
+            return False
+
+        shard = self.shards[self.shard_index(user_1_id, user_2_id)]
+        with shard.writing() as cursor:
+            return shard.write_read_marker(cursor, user_1_id, user_2_id, int(message_id))
+
+    def delete_text_messages(self, message_ids) -> list[bool]:
+        """
+        Deletes messages from the database based on the given message ids, one transaction per shard.
+        Conversations left without messages are deleted too.
+        """
+        message_ids = [int(message_id) for message_id in message_ids]
+        positions = {}  # shard index -> positions of its ids in `message_ids`
+        for position, message_id in enumerate(message_ids):
+            positions.setdefault(message_id % self.num_shards, []).append(position)
+
+        statuses = [False] * len(message_ids)
+        for index, shard_positions in positions.items():
+            shard_statuses = self.shards[index].delete_text_messages([message_ids[p] for p in shard_positions])
+            for position, status in zip(shard_positions, shard_statuses):
+                statuses[position] = status
+        return statuses
+
+    def delete_account(self, username: str) -> bool:
+        """
+        Deletes the specified user's account and all messages (and conversations)
+        associated with that user.
+        The shards are purged before the user leaves the directory. If a shard fails part way,
+        the account still exists, and deleting it again purges the remaining shards.
+        """
+        user_id = self.get_user_id(username)
+        if user_id is None:
+            logger.info("[Server] Error: User '%s' does not exist.", username)
+            return False
+
+        try:
+            for shard in self.shards:
+                with shard.writing() as cursor:
+                    shard.purge_conversations(cursor, user_id)
+        except sql.Error as e:
+            logger.warning("[Server] Error: Account '%s' could not be deleted: %s", username, e)
+            return False
+        return self.directory.delete_account(username)
+
     def close(self):
-        """Close the connection for the current thread."""
-        with self.query_lock:
-            if hasattr(self.local, 'conn'):
-                self.local.conn.close()
+        """Close the directory and every shard."""
+        self.directory.close()
+        for shard in self.shards:
+            shard.close()
+
+def open_database(db_name: str, backend: str = "sqlite", max_messages: int = 1024, shards: int = 1, **options) -> StorageBackend:
+    """Open the configured storage backend; `options` are passed on to `AccountDatabase`."""
+    if backend == "memory":
+        return MemoryDatabase(max_messages)
+    if shards > 1:
+        return ShardedDatabase(db_name, shards, **options)
+    return AccountDatabase(db_name, **options)
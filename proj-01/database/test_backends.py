@@ -0,0 +1,214 @@
+import glob
+import os
+import tempfile
+import pytest
+
+from db import AccountDatabase, MemoryDatabase, ShardedDatabase
+
+@pytest.fixture(params=["sqlite", "memory", "sharded"])
+def backend(request):
+    """Each test runs against a fresh database of every storage backend."""
+    if request.param == "memory":
+        yield MemoryDatabase(max_messages=5)
+        return
+    db_path = tempfile.NamedTemporaryFile(suffix=".db", delete=False).name
+    database = AccountDatabase(db_path) if request.param == "sqlite" else ShardedDatabase(db_path, shards=3)
+    yield database
+    database.close()
+    for path in glob.glob(os.path.splitext(db_path)[0] + "*"):
+        os.remove(path)
+
+def test_accounts(backend):
+    assert backend.create_account("alice", "pass") == True
+    assert backend.create_account("alice", "other") == False
+    assert backend.create_account("", "pass") == False
+    assert backend.login_account("alice", "pass") == True
+    assert backend.login_account("alice", "wrong") == False
+    assert backend.login_account("nobody", "pass") == False
+
+def test_conversations(backend):
+    backend.create_account("alice", "pass")
+    backend.create_account("bob", "pass")
+    assert backend.create_conversation("alice", "alice") == False
+    assert backend.create_conversation("alice", "nobody") == False
+    assert backend.create_conversation("alice", "bob") == True
+    assert backend.create_conversation("bob", "alice") == False  # Already exists
+
+def test_send_and_fetch(backend):
+    backend.create_account("alice", "pass")
+    backend.create_account("bob", "pass")
+    first = backend.store_text_message("alice", "bob", "Hi Bob")
+    second = backend.store_text_message("bob", "alice", "Hi | Alice")
+    assert second > first
+    assert backend.send_text_message("alice", "nobody", "Lost") == False
+    assert backend.send_text_message("alice", "bob", "") == False
+    assert backend.fetch_text_messages("alice", 10) == [f"{second}|bob|alice|Hi | Alice", f"{first}|alice|bob|Hi Bob"]
+    assert backend.fetch_text_messages("nobody", 10) == [""]
+
+def test_paging(backend):
+    for name in ("alice", "bob", "carol"):
+        backend.create_account(name, "pass")
+    m_ids = [backend.store_text_message("alice", name, f"To {name} {i}") for i in range(2) for name in ("bob", "carol")]
+
+    newest = backend.fetch_text_message_page("alice", "before", 0, 3)
+    assert [row[0] for row in newest] == m_ids[:0:-1]
+    older = backend.fetch_text_message_page("alice", "before", newest[-1][0], 3)
+    assert [row[0] for row in older] == m_ids[:1]
+    newer = backend.fetch_text_message_page("bob", "after", m_ids[0], 3)
+    assert [row[1:] for row in newer] == [("alice", "bob", "To bob 1")]
+    assert backend.fetch_text_message_page("alice", "sideways", 0, 3) == []
+
+def test_delete_message(backend):
+    backend.create_account("alice", "pass")
+    backend.create_account("bob", "pass")
+    m_id = backend.store_text_message("alice", "bob", "Only message")
+    assert backend.delete_text_message(m_id) == True
+    assert backend.delete_text_message(m_id) == False
+    assert backend.fetch_text_messages("alice", 10) == [""]
+    assert backend.create_conversation("alice", "bob") == True  # The empty conversation was removed
+
+def test_fetch_conversation(backend):
+    backend.create_account("alice", "pass")
+    backend.create_account("bob", "pass")
+    backend.create_account("carol", "pass")
+    m_ids = [backend.store_text_message("alice", "bob", f"To bob {i}") for i in range(3)]
+    backend.store_text_message("carol", "alice", "To alice")
+    m_ids.append(backend.store_text_message("bob", "alice", "To alice"))
+    page = backend.fetch_conversation_page("alice", "bob", "before", 0, 2)
+    assert page == [(m_ids[3], "bob", "alice", "To alice"), (m_ids[2], "alice", "bob", "To bob 2")]
+    assert backend.fetch_conversation_page("bob", "alice", "before", m_ids[2], 5) == [
+        (m_ids[1], "alice", "bob", "To bob 1"), (m_ids[0], "alice", "bob", "To bob 0")
+    ]
+    assert [row[0] for row in backend.fetch_conversation_page("bob", "alice", "after", m_ids[1], 5)] == m_ids[2:]
+    assert backend.fetch_conversation_page("bob", "carol", "before", 0, 5) == []
+    assert backend.fetch_conversation_page("alice", "bob", "sideways", 0, 5) == []
+
+def test_conversation_list(backend):
+    backend.create_account("alice", "pass")
+    backend.create_account("bob", "pass")
+    backend.create_account("carol", "pass")
+    to_alice = [backend.store_text_message("bob", "alice", f"From bob {i}") for i in range(3)]
+    reply_id = backend.store_text_message("alice", "bob", "Reply")
+    carol_id = backend.store_text_message("carol", "alice", "From carol")
+    backend.create_conversation("bob", "carol")
+    assert backend.fetch_conversation_list("alice") == [
+        ("carol", carol_id, "carol", "From carol", 1),
+        ("bob", reply_id, "alice", "Reply", 3),
+    ]
+    assert backend.fetch_conversation_list("bob")[-1] == ("carol", 0, "", "", 0)  # No messages yet
+
+    assert backend.mark_conversation_read("alice", "bob", to_alice[1]) == True
+    assert backend.mark_conversation_read("alice", "bob", to_alice[0]) == True  # Never moves backwards
+    assert backend.fetch_conversation_list("alice")[1][4] == 1
+    assert backend.fetch_conversation_list("bob")[0][4] == 1  # Bob's own marker is separate
+    assert backend.mark_conversation_read("alice", "nobody", 1) == False
+    assert backend.fetch_conversation_list("nobody") == []
+
+def test_delete_messages(backend):
+    backend.create_account("alice", "pass")
+    backend.create_account("bob", "pass")
+    backend.create_account("carol", "pass")
+    to_bob = [backend.store_text_message("alice", "bob", f"To bob {i}") for i in range(3)]
+    to_carol = backend.store_text_message("alice", "carol", "To carol")
+    statuses = backend.delete_text_messages(to_bob[:2] + [to_bob[0], 999999])
+    assert statuses == [True, True, False, False]
+    assert [row[0] for row in backend.fetch_text_message_page("alice", "before", 0, 10)] == [to_carol, to_bob[2]]
+
+    assert backend.delete_text_messages([str(to_bob[2]), to_carol]) == [True, True]
+    assert backend.fetch_text_messages("alice", 10) == [""]
+    assert backend.create_conversation("alice", "bob") == True  # Both emptied conversations were removed
+    assert backend.create_conversation("alice", "carol") == True
+    assert backend.delete_text_messages([]) == []
+
+def test_delete_account(backend):
+    backend.create_account("alice", "pass")
+    backend.create_account("bob", "pass")
+    backend.store_text_message("alice", "bob", "Hello")
+    assert backend.delete_account("alice") == True
+    assert backend.delete_account("alice") == False
+    assert backend.login_account("alice", "pass") == False
+    assert backend.fetch_text_messages("bob", 10) == [""]
+    backend.create_account("alice", "new")
+    assert backend.fetch_text_messages("alice", 10) == [""]  # Nothing carries over to a new account
+
+def test_memory_ring_buffer():
+    backend = MemoryDatabase(max_messages=3)
+    backend.create_account("alice", "pass")
+    backend.create_account("bob", "pass")
+    m_ids = [backend.store_text_message("alice", "bob", f"Message {i}") for i in range(5)]
+    assert [row[0] for row in backend.fetch_text_message_page("bob", "before", 0, 10)] == m_ids[:1:-1]
+    assert backend.delete_text_message(m_ids[0]) == False  # Dropped from the ring buffer
+
+def test_sharded_placement(tmp_path):
+    db_path = str(tmp_path / "sharded.db")
+    backend = ShardedDatabase(db_path, shards=3)
+    names = [f"user_{i}" for i in range(8)]
+    for name in names:
+        backend.create_account(name, "pass")
+    m_ids = {(a, b): backend.store_text_message(a, b, f"{a} to {b}") for a in names[:4] for b in names[4:]}
+
+    # Each message lives on the shard its id names, which is the shard of its pair
+    for (a, b), m_id in m_ids.items():
+        shard_index = backend.shard_index(backend.get_user_id(a), backend.get_user_id(b))
+        assert m_id % 3 == shard_index
+        with backend.shards[shard_index].reading() as cursor:
+            cursor.execute("SELECT message_text FROM messages WHERE message_id = ?", (m_id,))
+            assert cursor.fetchone() == (f"{a} to {b}",)
+    assert len({m_id % 3 for m_id in m_ids.values()}) > 1  # Spread over several shards
+    with backend.directory.reading() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM messages")
+        assert cursor.fetchone()[0] == 0  # The directory only holds users
+
+    # Ids increase in send order across shards, and survive a restart
+    assert sorted(m_ids.values()) == list(m_ids.values())
+    backend.close()
+    reopened = ShardedDatabase(db_path, shards=3)
+    assert reopened.store_text_message("user_0", "user_4", "After restart") > max(m_ids.values())
+    newest = reopened.fetch_text_message_page("user_0", "before", 0, 5)
+    assert [row[3] for row in newest] == ["After restart", "user_0 to user_7", "user_0 to user_6", "user_0 to user_5", "user_0 to user_4"]
+    reopened.close()
+
+def test_sharded_shared_files(tmp_path):
+    db_path = str(tmp_path / "sharded.db")
+    first, second = ShardedDatabase(db_path, shards=3), ShardedDatabase(db_path, shards=3)
+    first.create_account("alice", "pass")
+    first.create_account("bob", "pass")
+
+    # Instances sharing the shard files take their ids from the shard, not from their own memory
+    m_ids = [backend.store_text_message("alice", "bob", f"Message {i}") for i, backend in enumerate([first, second] * 3)]
+    assert None not in m_ids
+    assert m_ids == sorted(set(m_ids))
+
+    # The id of a deleted message is not handed out again
+    assert second.delete_text_message(m_ids[-1]) == True
+    assert first.store_text_message("alice", "bob", "After delete") > m_ids[-1]
+    first.close()
+    second.close()
+
+def test_sharded_store_error(tmp_path):
+    backend = ShardedDatabase(str(tmp_path / "sharded.db"), shards=3)
+    backend.create_account("alice", "pass")
+    backend.create_account("bob", "pass")
+    shard = backend.shards[backend.shard_index(backend.get_user_id("alice"), backend.get_user_id("bob"))]
+    shard.get_writer().execute("PRAGMA query_only = ON")
+    assert backend.store_text_message("alice", "bob", "Hello") is None
+    backend.close()
+
+def test_sharded_delete_account_resumes(tmp_path):
+    backend = ShardedDatabase(str(tmp_path / "sharded.db"), shards=3)
+    names = [f"user_{i}" for i in range(6)]
+    for name in names:
+        backend.create_account(name, "pass")
+    for name in names[1:]:
+        backend.store_text_message(names[0], name, "Hello")
+
+    # A shard that fails part way leaves the account in place, so deleting it again finishes the job
+    backend.shards[-1].get_writer().execute("PRAGMA query_only = ON")
+    assert backend.delete_account(names[0]) == False
+    assert backend.login_account(names[0], "pass") == True
+    backend.shards[-1].get_writer().execute("PRAGMA query_only = OFF")
+    assert backend.delete_account(names[0]) == True
+    assert backend.login_account(names[0], "pass") == False
+    for name in names[1:]:
+        assert backend.fetch_text_messages(name, 10) == [""]
+    backend.close()
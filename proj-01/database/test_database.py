@@ -1,9 +1,12 @@
 import multiprocessing
 import tempfile
 import os
+import sqlite3
+import threading
 import pytest
 
-from db import AccountDatabase
+import db
+from db import AccountDatabase, LRUCache
 
 def send_messages(db_path):
     """Each process should create its own connection to the database."""
@@ -227,7 +230,216 @@ def test_fetch_messages_limit(test_db):
     messages = test_db.fetch_text_messages("henry", 5)
     assert len(messages) == 5  # Should return exactly 5 messages
 
-# ### ---- 9. Edge Cases ---- ###
+# ### ---- 9. Paging Tests ---- ###
+
+def test_fetch_page_before(test_db):
+    test_db.create_account("pager1", "pass")
+    test_db.create_account("pager2", "pass")
+    for i in range(7):
+        test_db.send_text_message("pager1", "pager2", f"Page message {i}")
+
+    first_page = test_db.fetch_text_message_page("pager1", "before", 0, 3)
+    assert [row[3] for row in first_page] == ["Page message 6", "Page message 5", "Page message 4"]
+
+    second_page = test_db.fetch_text_message_page("pager1", "before", first_page[-1][0], 3)
+    assert [row[3] for row in second_page] == ["Page message 3", "Page message 2", "Page message 1"]
+
+    last_page = test_db.fetch_text_message_page("pager1", "before", second_page[-1][0], 3)
+    assert [row[3] for row in last_page] == ["Page message 0"]
+
+def test_fetch_page_after(test_db):
+    test_db.create_account("since1", "pass")
+    test_db.create_account("since2", "pass")
+    test_db.send_text_message("since1", "since2", "Old message")
+    newest_id = test_db.fetch_text_message_page("since1", "before", 0, 1)[0][0]
+
+    assert test_db.fetch_text_message_page("since1", "after", newest_id, 10) == []
+    test_db.send_text_message("since2", "since1", "New message 1")
+    test_db.send_text_message("since1", "since2", "New message 2")
+    page = test_db.fetch_text_message_page("since1", "after", newest_id, 10)
+    assert [row[3] for row in page] == ["New message 1", "New message 2"]  # Oldest first
+
+def test_store_message_returns_id(test_db):
+    test_db.create_account("store1", "pass")
+    test_db.create_account("store2", "pass")
+    m_id = test_db.store_text_message("store1", "store2", "Stored message")
+    assert m_id is not None
+    assert test_db.fetch_text_message_page("store2", "before", 0, 1)[0] == (m_id, "store1", "store2", "Stored message")
+    assert test_db.store_text_message("store1", "nonexistent_user", "Lost message") is None
+
+def test_fetch_page_invalid_direction(test_db):
+    assert test_db.fetch_text_message_page("since1", "sideways", 0, 10) == []
+
+# ### ---- 10. Schema Tests ---- ###
+
+def query_plan(test_db, query, params):
+    cursor = test_db.get_conn().cursor()
+    cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+    return [row[3] for row in cursor.fetchall()]
+
+@pytest.mark.parametrize("query", [db.FETCH_MESSAGES_SQL, db.FETCH_PAGE_BEFORE_SQL, db.FETCH_PAGE_AFTER_SQL])
+def test_fetch_plans_use_indexes(test_db, query):
+    plan = query_plan(test_db, query, {"user_id": 1, "cursor_id": 1, "k": 5})
+    assert not any(step.startswith("SCAN") for step in plan), plan  # No full table scans
+    assert any("idx_messages_conversation" in step for step in plan), plan
+
+@pytest.mark.parametrize("query", [db.CONVERSATION_PAGE_BEFORE_SQL, db.CONVERSATION_PAGE_AFTER_SQL, db.CONVERSATION_LIST_SQL])
+def test_conversation_plans_use_indexes(test_db, query):
+    plan = query_plan(test_db, query, {"user_id": 1, "user_id_1": 1, "user_id_2": 2, "cursor_id": 1, "k": 5})
+    assert not any(step.startswith("SCAN") for step in plan), plan  # No full table scans
+    assert any("idx_messages_conversation" in step for step in plan), plan
+
+def test_send_plan_uses_pair_index(test_db):
+    query = "SELECT conversation_id FROM conversations WHERE user_id_1 = ? AND user_id_2 = ?"
+    plan = query_plan(test_db, query, (1, 2))
+    assert plan == ["SEARCH conversations USING COVERING INDEX idx_conversations_pair (user_id_1=? AND user_id_2=?)"]
+
+def test_fetch_reports_sender_and_receiver(test_db):
+    test_db.create_account("kate", "pass")
+    test_db.create_account("liam", "pass")
+    test_db.send_text_message("liam", "kate", "From Liam")
+    test_db.send_text_message("kate", "liam", "From Kate")
+    messages = test_db.fetch_text_messages("kate", 2)
+    assert messages[0].split("|")[1:] == ["kate", "liam", "From Kate"]
+    assert messages[1].split("|")[1:] == ["liam", "kate", "From Liam"]
+
+def test_wal_mode(test_db):
+    cursor = test_db.get_conn().cursor()
+    assert cursor.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+def test_reads_do_not_wait_for_writes(test_db):
+    test_db.create_account("reader", "pass")
+    results = []
+    with test_db.write_lock:  # A write in progress
+        reader = threading.Thread(target=lambda: results.append(test_db.login_account("reader", "pass")))
+        reader.start()
+        reader.join(timeout=2)
+        assert results == [True]
+
+def test_group_commit(tmp_path):
+    batched_db = AccountDatabase(str(tmp_path / "batched.db"), batch_size=8, batch_delay=200)
+    batched_db.create_account("batch1", "pass")
+    batched_db.create_account("batch2", "pass")
+
+    futures = [batched_db.submit_text_message("batch1", "batch2", f"Batched {i}") for i in range(8)]
+    futures.append(batched_db.submit_text_message("batch1", "nonexistent_user", "Undeliverable"))
+    m_ids = [future.result(timeout=2) for future in futures]
+    assert m_ids[-1] is None  # Each write succeeds or fails on its own
+    assert all(m_ids[:-1]) and len(set(m_ids[:-1])) == 8
+    assert batched_db.committer.batches == 2  # A full batch, then the remainder after the delay
+    assert len(batched_db.fetch_text_messages("batch2", 20)) == 8
+    batched_db.close()
+
+def test_group_commit_isolates_errors(tmp_path):
+    batched_db = AccountDatabase(str(tmp_path / "isolated.db"), batch_size=3, batch_delay=200)
+    batched_db.create_account("iso1", "pass")
+    batched_db.create_account("iso2", "pass")
+
+    def failing_write(cursor):
+        cursor.execute("INSERT INTO users (username, password_hash) VALUES ('partial', 'pass')")
+        raise RuntimeError("write failed")
+
+    first = batched_db.submit_text_message("iso1", "iso2", "Before")
+    failed = batched_db.committer.submit(failing_write)
+    last = batched_db.submit_text_message("iso2", "iso1", "After")
+    assert first.result(timeout=2) and last.result(timeout=2)
+    with pytest.raises(RuntimeError):
+        failed.result(timeout=2)
+    assert batched_db.login_account("partial", "pass") == False  # The failed write was rolled back
+    assert batched_db.send_text_message("iso1", "iso2", "Blocking") == True
+    batched_db.close()
+
+def test_delete_high_fan_out_account(tmp_path):
+    fan_db = AccountDatabase(str(tmp_path / "fan_out.db"))
+    fan_db.create_account("hub", "pass")
+    fan_db.create_account("bystander", "pass")
+    for i in range(300):
+        fan_db.create_account(f"spoke_{i}", "pass")
+        fan_db.send_text_message(f"spoke_{i}", "hub", f"Hello hub {i}")
+    fan_db.send_text_message("spoke_0", "bystander", "Unrelated")
+
+    assert fan_db.delete_account("hub") == True
+    cursor = fan_db.get_conn().cursor()
+    assert cursor.execute("SELECT COUNT(*) FROM conversations").fetchone()[0] == 1
+    assert cursor.execute("SELECT message_text FROM messages").fetchall() == [("Unrelated",)]
+    assert fan_db.send_text_message("spoke_1", "hub", "Too late") == False
+    fan_db.close()
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put("a", 1, cache.version)
+    cache.put("b", 2, cache.version)
+    assert cache.get("a") == 1
+    cache.put("c", 3, cache.version)  # Evicts "b", the least recently used
+    assert cache.get("b") is None and cache.get("c") == 3
+
+    version = cache.version
+    cache.invalidate("a")
+    cache.put("a", 1, version)  # Read before the invalidation, so not cached
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 1, "capacity": 2, "hits": 2, "misses": 2}
+
+def test_login_uses_cache(test_db):
+    test_db.create_account("cached_user", "pass")
+    assert test_db.login_account("cached_user", "pass") == True
+    hits = test_db.cache_stats()["users"]["hits"]
+    assert test_db.login_account("cached_user", "wrong") == False
+    assert test_db.login_account("cached_user", "pass") == True
+    assert test_db.cache_stats()["users"]["hits"] == hits + 2
+
+def test_delete_account_invalidates_cache(test_db):
+    test_db.create_account("cached_gone", "pass")
+    test_db.create_account("cached_peer", "pass")
+    assert test_db.send_text_message("cached_gone", "cached_peer", "Cached hello")
+    assert test_db.login_account("cached_gone", "pass") == True
+    assert test_db.delete_account("cached_gone") == True
+    assert test_db.login_account("cached_gone", "pass") == False
+    assert test_db.send_text_message("cached_peer", "cached_gone", "Too late") == False
+
+    # A new account under the same name gets a new id and a new conversation
+    test_db.create_account("cached_gone", "new_pass")
+    assert test_db.login_account("cached_gone", "new_pass") == True
+    assert test_db.send_text_message("cached_peer", "cached_gone", "Welcome back")
+    assert [row[3] for row in test_db.fetch_text_message_page("cached_gone", "before", 0, 10)] == ["Welcome back"]
+
+def test_delete_last_message_invalidates_cache(test_db):
+    test_db.create_account("cached_a", "pass")
+    test_db.create_account("cached_b", "pass")
+    m_id = test_db.store_text_message("cached_a", "cached_b", "Only message")
+    assert test_db.delete_text_message(m_id) == True  # Deletes the conversation too
+    assert test_db.send_text_message("cached_a", "cached_b", "New conversation")
+    cursor = test_db.get_conn().cursor()
+    cursor.execute("""
+        SELECT COUNT(*) FROM messages m
+        LEFT JOIN conversations c ON c.conversation_id = m.conversation_id
+        WHERE c.conversation_id IS NULL
+    """)
+    assert cursor.fetchone()[0] == 0  # No message points at a deleted conversation
+
+def test_migrate_legacy_schema(tmp_path):
+    legacy_path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(legacy_path)
+    conn.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password_hash TEXT);
+        CREATE TABLE conversations (conversation_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id_1 INTEGER, user_id_2 INTEGER);
+        CREATE TABLE messages (message_id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id INTEGER,
+                               user_id INTEGER, message_text TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+        INSERT INTO users (username, password_hash) VALUES ('old_a', 'pass'), ('old_b', 'pass');
+        INSERT INTO conversations (user_id_1, user_id_2) VALUES (2, 1), (1, 2);
+        INSERT INTO messages (conversation_id, user_id, message_text) VALUES (1, 'old_b', 'First'), (2, 'old_a', 'Second');
+    """)
+    conn.close()
+
+    legacy_db = AccountDatabase(legacy_path)
+    cursor = legacy_db.get_conn().cursor()
+    assert cursor.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION
+    assert cursor.execute("SELECT user_id_1, user_id_2 FROM conversations").fetchall() == [(1, 2)]
+    assert cursor.execute("SELECT conversation_id, user_id FROM messages").fetchall() == [(1, 2), (1, 1)]
+    assert legacy_db.fetch_text_messages("old_a", 2) == ["2|old_a|old_b|Second", "1|old_b|old_a|First"]
+    assert legacy_db.create_conversation("old_b", "old_a") == False  # Pair already exists
+    legacy_db.close()
+
+# ### ---- 11. Edge Cases ---- ###
 
 def test_empty_database_fetch(test_db):
     assert test_db.fetch_text_messages("empty_user", 5) == ['']  # No messages should exist
@@ -1,18 +1,66 @@
+import logging
 import socket
 import threading
+import time
 import queue
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
 from collections.abc import Iterable as iterable
 
 from database import db
 from utils import message as MSG
 from utils import config
 from utils import utils
+from utils import log as LOG
+from utils import metrics as METRICS
+from utils import scheduler as SCHEDULER
 from actions import actions
 
+logger = logging.getLogger("chat.server")
+
+class AsyncConnection:
+    """
+    Handle of a client served by the asyncio engine, with the `send` method of a `utils.FrameWriter`.
+    Executor threads write through it; the writes are handed to the event loop. A client that lets
+    more than `max_pending` bytes pile up in the transport's buffer has stopped reading, and is aborted.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop, max_pending: int = 1 << 20):
+        self.writer = writer
+        self.loop = loop
+        self.max_pending = max_pending
+        self.closed = False
+        self.overflowed = False
+
+    def send(self, payloads) -> bool:
+        """Schedule `payloads` to be written to the client's stream together, as frames."""
+        if self.closed:
+            return False
+        buffers = []
+        for payload in payloads:
+            buffers.append(utils.FRAME_LENGTH.pack(len(payload)))
+            buffers.append(payload)
+        self.loop.call_soon_threadsafe(self.write, buffers)
+        return True
+
+    def write(self, buffers: list):
+        """Write `buffers` on the event loop, unless the client has fallen more than `max_pending` bytes behind."""
+        if self.closed or self.writer.is_closing():
+            return
+        pending = self.writer.transport.get_write_buffer_size()
+        if pending and pending + sum(map(len, buffers)) > self.max_pending:
+            self.overflowed = True
+            self.close()
+            self.writer.transport.abort()
+            return
+        self.writer.writelines(buffers)
+
+    def close(self):
+        self.closed = True
+
 class Server:
-    def __init__(self):
-        CFG = config.Config()
+    def __init__(self, config_file="config.ini"):
+        CFG = config.Config(config_file)
+        LOG.configure(**CFG.get_logging_config())
         self.account_db_name = CFG.get_account_db()
         self.action_dict_name = CFG.get_actions_dict()
 
@@ -23,117 +71,442 @@ class Server:
         self.msg_min_size = self.msg_magic_size + self.msg_type_size + self.msg_magic_size
         self.msg_max_size = CFG.get_msg_max_size()
 
-        self.account_db = db.AccountDatabase(self.account_db_name)
+        self.account_db = db.open_database(self.account_db_name, **CFG.get_account_db_config())
         self.host = CFG.get_server_config()['host']
         self.port = CFG.get_server_config()['port']
+        self.engine = CFG.get_server_config()['engine']
+        self.backlog = CFG.get_server_config()['backlog']
+        self.workers = CFG.get_server_config()['workers']
+        self.batch_responses = CFG.get_server_config()['batch_responses']
+        self.queue_size = CFG.get_server_config()['queue_size']
+        self.send_buffer = CFG.get_server_config()['send_buffer']
+        self.overload = CFG.get_server_config()['overload']
+        if self.overload not in ("block", "reject", "shed"):
+            raise ValueError(f"Unknown overload policy '{self.overload}'.")
+        self.metrics_dump_file = CFG.get_metrics_config()['dump_file']
+        self.metrics_dump_interval = CFG.get_metrics_config()['dump_interval']
 
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.action_handler = actions.ServerActionHandler(self, self.action_dict_name)
 
+        # Each client waits on its own requests, so they run in order while
+        # different clients' requests run in parallel on the worker pool.
+        # Requests carrying a request id are not waited on, so a client that
+        # pipelines them has them run concurrently, matching responses by id.
+        # A client queue holds at most `queue_size` requests (0 means unbounded), and at most
+        # `queue_size` of its requests with an id run at once; `overload` says what happens beyond that.
         self.client_message_queues = {}
-        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.client_addrs = {}
+        self.client_protocols = {}
+        # Each connection's responses and pushes are written by its own writer, so a client that
+        # stops reading stalls only itself; past `send_buffer` unsent bytes it is disconnected.
+        self.client_writers = {}
+
+        # Per-action latencies and connection counts, served by the `stats` action
+        self.metrics = METRICS.Metrics()
 
-        print("Server host:", self.host)
-        print("Server port:", self.port)
+        # Actions run on `workers` threads, taking turns across clients and by priority class
+        scheduler_config = CFG.get_scheduler_config()
+        for action_name in scheduler_config['action_classes']:
+            if action_name not in self.action_handler.inverse_action_map:
+                raise ValueError(f"Unknown action '{action_name}' in the scheduler classes.")
+        self.scheduler = SCHEDULER.FairScheduler(self.workers, metrics=self.metrics, **scheduler_config)
+
+        # Connections of each logged-in user, so new messages can be pushed to them,
+        # and the user each connection is logged in as
+        self.sessions = {}
+        self.session_users = {}
+        self.session_lock = threading.RLock()
+
+        logger.info("Server host: %s", self.host)
+        logger.info("Server port: %s", self.port)
+        logger.info("Server engine: %s", self.engine)
+        logger.info("Server workers: %s", self.workers)
 
         self.start()
     
     def start(self):
-        """Start the server and accept client connections."""
+        """Start the server and accept client connections using the configured engine."""
         self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
-        print(f"[Server] Server started on {self.host}:{self.port}")
+        self.server_socket.listen(self.backlog)
+        logger.info("[Server] Server started on %s:%s", self.host, self.port)
+        if self.metrics_dump_file:
+            threading.Thread(target=self.dump_metrics, daemon=True).start()
 
+        if self.engine == "asyncio":
+            asyncio.run(self.start_async())
+        else:
+            self.start_threaded()
+
+    def start_threaded(self):
+        """Accept client connections, serving each with a receive and a processing thread."""
         while True:
             client_socket, addr = self.server_socket.accept()
-            print(f"[Server] New connection from {addr}")
+            # Frames are written whole, so there is nothing for Nagle's algorithm to coalesce
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            logger.info("[Server] New connection from %s", addr)
 
             # Each client has its own message queue
-            client_message_queue = queue.Queue()
+            client_message_queue = queue.Queue(maxsize=self.queue_size)
             self.client_message_queues[client_socket] = client_message_queue
+            self.client_writers[client_socket] = utils.FrameWriter(client_socket, self.send_buffer)
+            self.client_addrs[client_socket] = addr
+            self.metrics.connection_opened()
 
             threading.Thread(target=self.recv_client_message, args=(client_socket, addr), daemon=True).start()
             threading.Thread(target=self.process_queued_messages, args=(client_socket,), daemon=True).start()
 
+    async def start_async(self):
+        """Accept client connections, serving all of them from one event loop."""
+        async_server = await asyncio.start_server(self.handle_async_client, sock=self.server_socket, backlog=self.backlog)
+        async with async_server:
+            await async_server.serve_forever()
+
+    async def handle_async_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Receive and process a client's messages (serially) on the event loop."""
+        addr = writer.get_extra_info("peername")
+        logger.info("[Server] New connection from %s", addr)
+
+        loop = asyncio.get_running_loop()
+        client_connection = AsyncConnection(writer, loop, self.send_buffer)
+        # Legacy messages are bounded in characters, which may take up to 4 bytes each
+        max_frame_size = 4 * self.msg_max_size
+        in_flight = set()  # Actions of requests with an id, which are not waited on
+        self.client_writers[client_connection] = client_connection
+        self.client_addrs[client_connection] = addr
+        self.metrics.connection_opened()
+        try:
+            while True:
+                # First read the message length (4 bytes)
+                length_bytes = await reader.readexactly(4)
+                message_length = int.from_bytes(length_bytes, 'big')
+                if message_length > max_frame_size:
+                    logger.warning("[Server] Closing %s, which sent a frame of %d bytes (the maximum is %d).", addr, message_length, max_frame_size)
+                    break
+
+                # Now read the actual message
+                message_bytes = await reader.readexactly(message_length)
+
+                # And process it off the event loop
+                received_at = time.perf_counter()
+                message = MSG.Message.from_bytes(message_bytes, self)
+                if message.valid():
+                    message_type, message_args = message.unpack_args()
+                    self.client_protocols[client_connection] = message.version
+                    message_args = self.decode_request(client_connection, message_type, message_args, message.request_id)
+                    if message_args is None:
+                        continue
+                    if message.request_id is not None and self.queue_size and len(in_flight) >= self.queue_size:
+                        if self.overload == "block":
+                            # Stop reading until one finishes, so TCP pushes back on the client
+                            await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                        else:
+                            # Queued requests are already with the scheduler, so `shed` also refuses the newest
+                            self.send_busy(client_connection, message_type, message.request_id)
+                            continue
+                    action = asyncio.wrap_future(self.scheduler.submit(
+                        client_connection, self.action_handler.action_map.get(message_type),
+                        self.perform_action, message_type, message_args, client_connection, message.request_id, received_at
+                    ))
+                    if message.request_id is None:
+                        await action
+                        await writer.drain()
+                    else:
+                        in_flight.add(action)
+                        action.add_done_callback(in_flight.discard)
+                        action.add_done_callback(self.report_action_error)
+                else:
+                    # Ignore invalid messages.
+                    pass
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            logger.info("[Server] Client %s disconnected.", addr)
+        except Exception as e:
+            logger.warning("[Server] Message reception error due to: %s", e)
+        finally:
+            self.end_session(client_connection)
+            self.client_protocols.pop(client_connection, None)
+            self.client_writers.pop(client_connection, None)
+            client_connection.close()
+            if client_connection.overflowed:
+                logger.warning("[Server] Disconnected %s, which stopped reading its responses.", addr)
+            self.client_addrs.pop(client_connection, None)
+            self.metrics.connection_closed()
+            writer.close()
+
     def send_client_message(self, client_socket, message: MSG.Message):
         """Send a message to the client."""
+        self.send_client_messages(client_socket, [message])
+
+    def send_client_messages(self, client_socket, messages: list[MSG.Message]):
+        """Send several messages to the client, writing their frames together."""
+        # Queued for the connection's writer, so the calling worker never waits on the client
+        writer = self.client_writers.get(client_socket)
+        if writer is None:
+            return
         try:
-            if message.valid():
-                encoded_message = message.encode()
-                length = len(encoded_message)
-                client_socket.sendall(length.to_bytes(4, 'big'))
-                client_socket.sendall(encoded_message)
+            if not writer.send([message.encode() for message in messages if message.valid()]):
+                logger.debug("[Server] Dropped %d message(s) for a closed connection.", len(messages))
         except Exception as e:
-            print("[Server] Error sending message to client:", e)
+            logger.warning("[Server] Error sending message to client: %s", e)
+
+    def start_session(self, username: str, client_socket):
+        """Subscribe a connection to pushes for `username` (a connection follows its latest login)."""
+        with self.session_lock:
+            self.end_session(client_socket)
+            self.sessions.setdefault(username, set()).add(client_socket)
+            self.session_users[client_socket] = username
+        logger.info("[Server] %s subscribed to message delivery.", username)
+
+    def end_session(self, client_socket):
+        """Unsubscribe a connection from pushes."""
+        with self.session_lock:
+            username = self.session_users.pop(client_socket, None)
+            if username is not None:
+                self.sessions[username].discard(client_socket)
+                if not self.sessions[username]:
+                    del self.sessions[username]
+
+    def end_user_sessions(self, username: str):
+        """Unsubscribe every connection logged in as `username`, so an account re-created under the name gets none of them."""
+        with self.session_lock:
+            for client_socket in self.sessions.pop(username, ()):
+                del self.session_users[client_socket]
+
+    def push_text_message(self, m_id: int, sender: str, receiver: str, message_text: str):
+        """
+        Deliver a newly stored message to every connection the receiver is logged in on.
+        Each push is queued on the connection's writer, so a receiver that stops reading never holds up the sender.
+        """
+        with self.session_lock:
+            client_sockets = list(self.sessions.get(receiver, ()))
+        for client_socket in client_sockets:
+            version = self.client_protocols.get(client_socket, MSG.PROTOCOL_LEGACY)
+            msg_content = MSG.MessageArgs(str(m_id), sender, receiver, message_text)
+            msg = MSG.Message(message_args=msg_content, message_type="push_text_message", endpoint=self, version=version)
+            self.send_client_message(client_socket, msg)
+        if client_sockets:
+            logger.debug("[Server] Pushed message %s to %d connection(s) of %s.", m_id, len(client_sockets), receiver)
 
     def recv_client_message(self, client_socket, addr) -> bool:
         """Handle client messages."""
+        # Legacy messages are bounded in characters, which may take up to 4 bytes each
+        frame_reader = utils.FrameReader(client_socket, max_frame_size=4 * self.msg_max_size)
         try:
             while True:
-                # First read the message length (4 bytes)
-                length_bytes = utils.recv_all(client_socket, 4)
-                if length_bytes is None:
-                    print(f"[Server] Client {addr} disconnected.")
-                    break
-                message_length = int.from_bytes(length_bytes, 'big')
-
-                # Now read the actual message
-                message_bytes = utils.recv_all(client_socket, message_length)
+                # Read the next length-prefixed message out of the receive buffer
+                message_bytes = frame_reader.read_frame()
                 if message_bytes is None:
-                    print(f"[Server] Client {addr} disconnected.")
+                    logger.info("[Server] Client %s disconnected.", addr)
                     break
 
                 # And process it
-                message = MSG.Message.from_bytes(message_bytes.decode("utf-8"), self)
+                received_at = time.perf_counter()
+                message = MSG.Message.from_bytes(message_bytes, self)
                 if message.valid():
-                    message_type, message_content = message.unpack()
-                    # print(f"Received message type {message_type} from {addr}: {message_content}")
-                    message_args = MSG.MessageArgs.to_arglist(message_content)
+                    message_type, message_args = message.unpack_args()
+                    # print(f"Received message type {message_type} from {addr}: {message_args}")
 
-                    self.client_message_queues[client_socket].put((message_type, message_args))
+                    # Reply in whichever protocol the client last spoke
+                    self.client_protocols[client_socket] = message.version
+                    message_args = self.decode_request(client_socket, message_type, message_args, message.request_id)
+                    if message_args is not None:
+                        self.enqueue_request(client_socket, (message_type, message_args, message.request_id, received_at))
                 else:
                     # Ignore invalid messages.
                     pass
         except ConnectionResetError:
-            print(f"[Server] Client {addr} disconnected.")
+            logger.info("[Server] Client %s disconnected.", addr)
         except Exception as e:
-            print("[Server] Message reception error due to:", e)
+            logger.warning("[Server] Message reception error due to: %s", e)
         finally:
+            self.end_session(client_socket)
+            self.client_protocols.pop(client_socket, None)
+            writer = self.client_writers.pop(client_socket, None)
+            if writer is not None:
+                writer.close()
+                if writer.overflowed:
+                    logger.warning("[Server] Disconnected %s, which stopped reading its responses.", addr)
+            self.client_addrs.pop(client_socket, None)
+            self.metrics.connection_closed()
             if client_socket in self.client_message_queues:
                 del self.client_message_queues[client_socket]
                 client_socket.close()
 
+    def enqueue_request(self, client_socket, request: tuple):
+        """
+        Queue a (message_type, message_args, request_id, received_at) request for processing.
+        When the queue is full, `block` waits for room, which leaves the socket unread so TCP pushes
+        back on the client; `reject` refuses the new request and `shed` the oldest queued one, each
+        with a busy status.
+        """
+        client_message_queue = self.client_message_queues[client_socket]
+        if self.overload == "block":
+            client_message_queue.put(request)
+        else:
+            try:
+                client_message_queue.put_nowait(request)
+            except queue.Full:
+                refused = request
+                if self.overload == "shed":
+                    try:
+                        refused = client_message_queue.get_nowait()
+                    except queue.Empty:
+                        refused = None  # Drained meanwhile, so there is room after all and nothing is refused
+                    client_message_queue.put_nowait(request)
+                if refused is not None:
+                    message_type, _, request_id, _ = refused
+                    self.send_busy(client_socket, message_type, request_id)
+        self.metrics.observe_queue_depth(client_message_queue.qsize())
+
+    def decode_request(self, client_socket, message_type: str, message_args: list[str], request_id: int = None) -> list | None:
+        """
+        Decode a request's arguments with its schema, in the receiving thread, so a malformed
+        request is refused with an invalid status (and None returned) before it takes a worker.
+        """
+        try:
+            return self.action_handler.decode_arguments(message_type, message_args)
+        except ValueError as e:
+            action_name = self.action_handler.action_map.get(message_type, message_type)
+            logger.info("[Server] Invalid %s request: %s", action_name, e)
+            self.metrics.record_invalid(action_name)
+            self.send_status(client_socket, MSG.STATUS_INVALID, request_id)
+            return None
+
+    def send_busy(self, client_socket, message_type: str, request_id: int = None):
+        """Refuse a request with a busy status carrying its id."""
+        self.metrics.record_rejected(self.action_handler.action_map.get(message_type, message_type))
+        self.send_status(client_socket, MSG.STATUS_BUSY, request_id)
+
+    def send_status(self, client_socket, status: str, request_id: int = None):
+        """Send a `status` message, answering the request with id `request_id` if given."""
+        version = self.client_protocols.get(client_socket, MSG.PROTOCOL_LEGACY)
+        msg_content = MSG.MessageArgs(status)
+        msg = MSG.Message(message_args=msg_content, message_type="status", endpoint=self, version=version, request_id=request_id)
+        self.send_client_message(client_socket, msg)
+
     def process_queued_messages(self, client_socket):
-        """Processes messages from a specific client's serverside message queue (serially)."""
+        """
+        Processes messages from a specific client's serverside message queue (serially).
+        Each request is awaited before the next is submitted, which keeps a client's requests in order.
+        At most `queue_size` requests with an id run at once; beyond that the queue backs up.
+        """
+        in_flight = threading.Semaphore(self.queue_size) if self.queue_size else None
         while client_socket in self.client_message_queues:
             try:
-                message_type, message_args = self.client_message_queues[client_socket].get()
-                future = self.executor.submit(self.perform_action, message_type, message_args, client_socket)
-                future.result()
+                message_type, message_args, request_id, received_at = self.client_message_queues[client_socket].get()
+                if request_id is not None and in_flight is not None:
+                    in_flight.acquire()
+                future = self.scheduler.submit(
+                    client_socket, self.action_handler.action_map.get(message_type),
+                    self.perform_action, message_type, message_args, client_socket, request_id, received_at
+                )
+                if request_id is None:
+                    future.result()
+                else:
+                    if in_flight is not None:
+                        future.add_done_callback(lambda _: in_flight.release())
+                    future.add_done_callback(self.report_action_error)
             except queue.Empty:
                 continue  # No messages, spin
             except Exception as e:
-                print("[Server] Message process error due to: ", e)
+                logger.warning("[Server] Message process error due to: %s", e)
                 break  # Client was disconnected
 
-    def perform_action(self, message_type: str, message_args: list[str], client_socket):
-        """Executes an action and sends back the response as a list of messages."""
-        ret_val = self.action_handler.execute_action(message_type, message_args)
+    def report_action_error(self, future):
+        """Report the error of an action that ran without being waited on."""
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("[Server] Message process error due to: %s", future.exception())
+
+    def perform_action(self, message_type: str, message_args: list, client_socket, request_id: int = None, received_at: float = None):
+        """
+        Executes an action with arguments already decoded by `decode_request` and sends back the response,
+        recording its time in `self.metrics`:
+        queued since `received_at` (a `time.perf_counter()` reading), executing, and sending.
+        """
+        started = time.perf_counter()
+        action_name = self.action_handler.action_map.get(message_type, message_type)
+        try:
+            ret_val = self.action_handler.call_action(message_type, message_args)
+        except Exception:
+            self.metrics.record_error(action_name)
+            raise
+        executed = time.perf_counter()
+        if ret_val is True and action_name == "login_account":
+            self.start_session(message_args[0], client_socket)
+        elif ret_val is True and action_name == "delete_account":
+            self.end_user_sessions(message_args[0])
+        self.send_response(ret_val, message_type, client_socket, request_id)
+        self.metrics.record(action_name, started - (received_at or started), executed - started, time.perf_counter() - executed)
+
+    def send_response(self, ret_val, message_type: str, client_socket, request_id: int = None):
+        """
+        Sends an action's return value to the client as a list of messages.
+        Every message echoes `request_id`, and all but the last are flagged as having more to follow.
+        """
+        version = self.client_protocols.get(client_socket, MSG.PROTOCOL_LEGACY)
+        if isinstance(ret_val, MSG.MessageRows):
+            # Many rows per message, split only where `msg_max_size` requires
+            messages = MSG.Message.pack_rows(ret_val, message_type, self, version, request_id)
+            self.send_client_messages(client_socket, messages)
+            logger.debug("[Server] Sent %d rows in %d messages to client.", len(ret_val), len(messages))
+            return
+
         if not isinstance(ret_val, iterable):
             ret_val = [ret_val]
-        
-        print(f"retval item: {ret_val}")
+        if request_id is not None and not ret_val:
+            ret_val = [[]]  # A request with an id always gets an answer to resolve it
 
-        ret_val = [str(item) for item in ret_val]
+        logger.debug("retval: %s", ret_val)
 
-        for item in ret_val:
-            print(f"retval item: {item}")
-            msg_content = MSG.MessageArgs(item)
-            msg = MSG.Message(message_args=msg_content, message_type=message_type, endpoint=self)
-            self.send_client_message(client_socket, msg)
+        # Each item is either a single value or a row of fields
+        ret_val = [[str(field) for field in item] if isinstance(item, (list, tuple)) else [str(item)] for item in ret_val]
+
+        messages = []
+        for i, item in enumerate(ret_val):
+            msg_content = MSG.MessageArgs(*item)
+            msg = MSG.Message(
+                message_args=msg_content, message_type=message_type, endpoint=self, version=version,
+                request_id=request_id, more=(i < len(ret_val) - 1)
+            )
+            if self.batch_responses:
+                messages.append(msg)
+            else:
+                self.send_client_message(client_socket, msg)
+
+        if messages:
+            # Flush every response frame of this action at once
+            self.send_client_messages(client_socket, messages)
+
+        logger.debug("[Server] Sent action status update to client.")
 
-        print("[Server] Sent action status update to client.")
+    def metrics_snapshot(self, peers: bool = True) -> dict:
+        """
+        The server's metrics, with the requests queued across clients, each scheduler class's backlog and the
+        database's cache counters. With `peers`, also every client queue's depth by the client's address,
+        which the `stats` action leaves out so no client learns another's address.
+        """
+        depths = {
+            f"{addr[0]}:{addr[1]}": client_message_queue.qsize()
+            for client_socket, client_message_queue in list(self.client_message_queues.items())
+            if (addr := self.client_addrs.get(client_socket)) is not None
+        }
+        snapshot = self.metrics.snapshot(depths if peers else None)
+        snapshot["queues"]["queued"] = sum(depths.values())
+        for class_name, queued in self.scheduler.queued().items():
+            snapshot["classes"].setdefault(class_name, {})["queued"] = queued
+        if hasattr(self.account_db, "cache_stats"):
+            snapshot["cache"] = self.account_db.cache_stats()
+        return snapshot
+
+    def dump_metrics(self):
+        """Write the metrics snapshot to `metrics_dump_file` every `metrics_dump_interval` seconds."""
+        while True:
+            time.sleep(self.metrics_dump_interval)
+            try:
+                METRICS.dump(self.metrics_snapshot(), self.metrics_dump_file)
+            except OSError as e:
+                logger.warning("[Server] Error writing metrics to %s: %s", self.metrics_dump_file, e)
 
 if __name__ == "__main__":
     server = Server()
@@ -2,8 +2,21 @@ import pytest
 import time
 import hashlib as hasher
 import queue
+import asyncio
+import socket
+from types import SimpleNamespace
 
+import server as SERVER
 from client import Client
+from async_client import AsyncClient
+from utils import message as MSG
+from database import db
+
+# Clients built from `config.ini` need its server, which is started unless one is running
+pytestmark = pytest.mark.usefixtures("chat_server")
+
+def frame(body: bytes) -> bytes:
+    return len(body).to_bytes(4, "big") + body
 
 def process_queue_headless(setup_client, poll_queue=False, timeout=2):
     """
@@ -66,6 +79,20 @@ def setup_client():
     
     yield client  # Provide the client instance to tests
 
+@pytest.fixture(scope="module")
+def binary_client(write_config):
+    """Fixture for a client that negotiates the binary protocol, which requests with ids need."""
+    client = Client(write_config({"MESSAGE": {"msg_protocol": MSG.PROTOCOL_BINARY}}))
+    assert wait_for_condition(lambda: client.connected), "Client failed to connect to server."
+    assert client.protocol_version == MSG.PROTOCOL_BINARY
+    yield client
+    client.disconnect()
+
+def test_protocol_negotiation(setup_client):
+    """Test that the client and server agree on the configured protocol version."""
+    client = setup_client
+    assert client.protocol_version == min(client.msg_protocol, MSG.PROTOCOL_VERSION)
+
 def test_create_account(setup_client):
     """Test creating an account."""
     client = setup_client
@@ -109,6 +136,247 @@ def test_fetch_messages(setup_client):
     assert process_queue_headless(client)
     wait_for_condition(lambda: client.server_message_queue.empty())
 
+def test_fetch_messages_fields(setup_client):
+    """Test that each fetched message arrives as (id, sender, receiver, text) in either protocol."""
+    client = setup_client
+    assert client.action_handler.send_text_message("testuser", "recipientuser", "a|b")
+    assert wait_for_condition(lambda: not client.server_message_queue.empty())
+    # Drop responses left over from earlier tests
+    process_queue_headless(client, poll_queue=True, timeout=0.5)
+    assert client.action_handler.fetch_text_messages("recipientuser", 1)
+    assert wait_for_condition(lambda: not client.server_message_queue.empty())
+    _, message_args = client.server_message_queue.get(timeout=2)
+    # Legacy framing escapes the separator inside the text
+    assert message_args[1:] == ["testuser", "recipientuser", "a|b"]
+    wait_for_condition(lambda: client.server_message_queue.empty())
+
+def test_fetch_messages_batch(setup_client):
+    """Test fetching messages as a batch of rows packed into few frames."""
+    client = setup_client
+    process_queue_headless(client, poll_queue=True, timeout=0.5)
+    assert client.action_handler.fetch_text_messages_batch("recipientuser", 10)
+    rows, frames, more = [], 0, "1"
+    while more == "1":
+        message_type, message_args = client.server_message_queue.get(timeout=2)
+        assert client.action_handler.action_map[message_type] == "fetch_text_messages_batch"
+        more, width, fields = message_args[0], int(message_args[1]), message_args[2:]
+        rows.extend(fields[i:i + width] for i in range(0, len(fields), width))
+        frames += 1
+    assert frames == 1
+    # Including the earlier "a|b" text, whose separator legacy framing escapes
+    assert len(rows) == 5
+    assert all(len(row) == 4 for row in rows)
+
+def test_fetch_message_history(setup_client):
+    """Test paging backward through history and fetching only newer messages."""
+    client = setup_client
+    process_queue_headless(client, poll_queue=True, timeout=0.5)
+
+    def fetch_page(direction, cursor_id, k):
+        assert client.action_handler.fetch_message_history("testuser", direction, cursor_id, k)
+        rows, more = [], "1"
+        while more == "1":
+            message_type, message_args = client.server_message_queue.get(timeout=2)
+            assert client.action_handler.action_map[message_type] == "fetch_message_history"
+            more, width, fields = message_args[0], int(message_args[1]), message_args[2:]
+            if width:
+                rows.extend(fields[i:i + width] for i in range(0, len(fields), width))
+        return [int(row[0]) for row in rows]
+
+    newest = fetch_page("before", 0, 2)
+    assert len(newest) == 2 and newest[0] > newest[1]
+    older = fetch_page("before", newest[-1], 2)
+    assert all(m_id < newest[-1] for m_id in older)
+    assert fetch_page("after", newest[0], 10) == []
+
+def fetch_rows(client, action_name):
+    """Collects the rows of a multi-row response until its last message."""
+    rows, more = [], "1"
+    while more == "1":
+        message_type, message_args = client.server_message_queue.get(timeout=2)
+        assert client.action_handler.action_map[message_type] == action_name
+        more, width, fields = message_args[0], int(message_args[1]), message_args[2:]
+        if width:
+            rows.extend(fields[i:i + width] for i in range(0, len(fields), width))
+    return rows
+
+def test_fetch_conversation(setup_client):
+    """Test fetching the newest messages of one chat."""
+    client = setup_client
+    process_queue_headless(client, poll_queue=True, timeout=0.5)
+    assert client.action_handler.fetch_conversation("testuser", "recipientuser", "before", 0, 2)
+    rows = fetch_rows(client, "fetch_conversation")
+    assert len(rows) == 2 and int(rows[0][0]) > int(rows[1][0])
+    assert all({row[1], row[2]} == {"testuser", "recipientuser"} for row in rows)
+
+    assert client.action_handler.fetch_conversation("testuser", "idontexist", "before", 0, 2)
+    assert fetch_rows(client, "fetch_conversation") == []
+
+def test_conversation_list(setup_client):
+    """Test the chat list's unread count before and after marking a chat read."""
+    client = setup_client
+    process_queue_headless(client, poll_queue=True, timeout=0.5)
+
+    assert client.action_handler.fetch_conversation_list("recipientuser")
+    rows = fetch_rows(client, "fetch_conversation_list")
+    counterparty, last_id, _, _, unread = rows[0]
+    assert counterparty == "testuser" and int(unread) > 0
+
+    assert client.action_handler.mark_conversation_read("recipientuser", "testuser", last_id)
+    _, message_args = client.server_message_queue.get(timeout=2)
+    assert message_args == ["True"]
+    assert client.action_handler.fetch_conversation_list("recipientuser")
+    assert fetch_rows(client, "fetch_conversation_list")[0][4] == "0"
+
+def test_pipelined_requests(binary_client):
+    """Test many requests in flight on one connection, each resolved with its own response."""
+    client = binary_client
+    hashed_password = hasher.sha256("password1".encode()).hexdigest()
+    futures = [
+        client.request("login_account", "testuser", hashed_password if i % 2 else "wrong")
+        for i in range(100)
+    ]
+    for i, future in enumerate(futures):
+        assert future.result(timeout=5) == [(client.action_handler.inverse_action_map["login_account"], [str(bool(i % 2))])]
+
+    rows = client.request("fetch_text_messages_batch", "testuser", "10").result(timeout=5)
+    assert rows[-1][1][0] == "0"  # Resolved on the last message of the batch
+    assert client.request("fetch_text_messages", "testuser", "3").result(timeout=5)
+    assert client.server_message_queue.empty()
+
+def test_invalid_requests(binary_client):
+    """Test that requests not matching their schema are refused as invalid without running."""
+    client = binary_client
+    invalid = [(client.action_handler.inverse_action_map["status"], [MSG.STATUS_INVALID])]
+    requests = [
+        ("fetch_text_messages_batch", "testuser", "ten"),  # Not an int
+        ("fetch_message_history", "testuser", "sideways", "0", "10"),  # Not a direction
+        ("login_account", "testuser"),  # Too few arguments
+        ("delete_account", "testuser", "extra"),  # Too many
+        ("create_account", "x" * 65, "hash"),  # Longer than 64 characters
+        ("delete_text_messages", "1", "two"),  # One variadic id not an int
+        ("fetch_text_messages", "testuser", "-1"),  # Below the minimum of 1, which would lift the limit
+        ("fetch_text_messages_batch", "testuser", "0"),
+        ("fetch_text_messages_batch", "testuser", "1025"),  # Above the maximum of 1024
+        ("fetch_conversation", "testuser", "recipientuser", "before", "0", str(10 ** 9)),
+        ("fetch_message_history", "testuser", "after", "-1", "10"),  # Negative cursor
+        ("mark_conversation_read", "testuser", "recipientuser", "-5"),  # Negative message id
+        ("delete_text_messages", "1", "-2"),
+    ]
+    for request in requests:
+        assert client.request(*request).result(timeout=5) == invalid, request
+    # An empty cursor falls back to its default
+    rows = client.request("fetch_message_history", "testuser", "before", "", "1").result(timeout=5)
+    assert rows[-1][1][0] == "0"
+
+    client.action_handler.stats()
+    stats = dict(fetch_rows(client, "stats"))
+    assert int(stats["actions.create_account.invalid"]) >= 1
+
+def test_stats(setup_client):
+    """Test the server's metrics: action counts, latency percentiles and connections."""
+    client = setup_client
+    client.action_handler.stats()
+    stats = dict(fetch_rows(client, "stats"))
+    assert int(stats["connections.open"]) >= 1
+    # Queued requests are totalled, without the other clients' addresses
+    assert int(stats["queues.queued"]) >= 0
+    assert not [name for name in stats if name.startswith("queues.depths")]
+    # test_pipelined_requests sends 100 logins, but only on the binary protocol
+    assert int(stats["actions.login_account.count"]) >= (100 if client.protocol_version == MSG.PROTOCOL_BINARY else 1)
+    assert stats["actions.login_account.errors"] == "0"
+    for phase in ("queue", "db", "send"):
+        p50 = float(stats[f"actions.login_account.{phase}.p50_ms"])
+        assert 0 <= p50 <= float(stats[f"actions.login_account.{phase}.p99_ms"]) <= float(stats[f"actions.login_account.{phase}.max_ms"])
+
+def test_async_clients():
+    """Test many asyncio client sessions in one event loop."""
+    async def session(i: int, count: int, barrier: asyncio.Barrier):
+        async with AsyncClient() as client:
+            assert await client.create_account(f"async_{i}", "hash")
+            assert await client.login_account(f"async_{i}", "hash")
+            assert not await client.login_account(f"async_{i}", "wrong")
+            await barrier.wait()  # Every account exists before anyone sends
+            assert await client.send_text_message(f"async_{i}", f"async_{(i + 1) % count}", f"Hi from {i}|{i}")
+            await barrier.wait()
+            rows = await client.fetch_text_messages(f"async_{i}", 10)
+            assert {row[3] for row in rows} == {f"Hi from {i}|{i}", f"Hi from {(i - 1) % count}|{(i - 1) % count}"}
+            # The message sent to this session while it was logged in was pushed to it
+            message_type, message_args = client.server_message_queue.get_nowait()
+            assert client.action_handler.action_map[message_type] == "push_text_message"
+            await barrier.wait()  # Deleting an account deletes its messages, so nobody deletes before everyone fetched
+            assert await client.delete_account(f"async_{i}")
+
+    async def main(count: int):
+        barrier = asyncio.Barrier(count)
+        await asyncio.gather(*(session(i, count, barrier) for i in range(count)))
+
+    asyncio.run(main(20))
+
+def test_async_client_status_replies():
+    """Test that row requests answered with a status raise a descriptive error instead of failing to unpack it."""
+    async def main():
+        async with AsyncClient() as client:
+            for k in (0, 1025):  # Outside the schema's 1..1024
+                with pytest.raises(ValueError, match="Invalid fetch_text_messages_batch request"):
+                    await client.fetch_text_messages("testuser", k)
+
+            async def busy(message_type, *args):
+                return [(client.action_handler.inverse_action_map["status"], [MSG.STATUS_BUSY])]
+            client.request_once = busy
+            client.busy_backoff = 0
+            with pytest.raises(RuntimeError, match="busy"):
+                await client.stats()
+
+    asyncio.run(main())
+
+def test_push_text_message(setup_client):
+    """Test that a message is pushed to the recipient's connection as soon as it is stored."""
+    client = setup_client
+    recipient = Client()
+    assert wait_for_condition(lambda: recipient.connected), "Recipient failed to connect to server."
+    hashed_password = hasher.sha256("password1".encode()).hexdigest()
+    assert recipient.action_handler.login_account("recipientuser", hashed_password)
+    assert process_queue_headless(recipient)
+
+    assert client.action_handler.send_text_message("testuser", "recipientuser", "Pushed!")
+    message_type, message_args = recipient.server_message_queue.get(timeout=2)
+    assert recipient.action_handler.action_map[message_type] == "push_text_message"
+    assert message_args[1:] == ["testuser", "recipientuser", "Pushed!"]
+    assert int(message_args[0]) > 0
+    recipient.disconnect()
+    process_queue_headless(client, poll_queue=True, timeout=0.5)
+
+def test_push_after_account_recreated(setup_client):
+    """Test that connections logged in to a deleted account get no pushes for a new account of the same name."""
+    client = setup_client
+    process_queue_headless(client, poll_queue=True, timeout=0.5)
+    hashed_password = hasher.sha256("password1".encode()).hexdigest()
+    old_session, new_session = Client(), Client()
+    assert wait_for_condition(lambda: old_session.connected and new_session.connected), "Client failed to connect to server."
+    assert old_session.action_handler.create_account("reuseduser", hashed_password)
+    assert old_session.action_handler.login_account("reuseduser", hashed_password)
+    assert process_queue_headless(old_session, poll_queue=True, timeout=0.5)
+
+    # Deleted from another connection, then created again by someone else
+    assert client.action_handler.delete_account("reuseduser")
+    assert client.action_handler.create_account("reuseduser", "other")
+    assert process_queue_headless(client, poll_queue=True, timeout=0.5)
+    assert new_session.action_handler.login_account("reuseduser", "other")
+    assert process_queue_headless(new_session)
+
+    assert client.action_handler.send_text_message("testuser", "reuseduser", "Only for the new account")
+    message_type, message_args = new_session.server_message_queue.get(timeout=2)
+    assert new_session.action_handler.action_map[message_type] == "push_text_message"
+    assert message_args[3] == "Only for the new account"
+    with pytest.raises(queue.Empty):
+        old_session.server_message_queue.get(timeout=0.5)
+
+    assert client.action_handler.delete_account("reuseduser")
+    old_session.disconnect()
+    new_session.disconnect()
+    process_queue_headless(client, poll_queue=True, timeout=0.5)
+
 def test_delete_text_message(setup_client):
     """Test deleting a text message."""
     client = setup_client
@@ -123,6 +391,22 @@ def test_delete_text_message(setup_client):
     # test_fetch_messages(setup_client)
     # wait_for_condition(lambda: client.server_message_queue.empty())
 
+def test_delete_text_messages(setup_client):
+    """Test deleting several messages, one of them unknown, with one request."""
+    client = setup_client
+    process_queue_headless(client, poll_queue=True, timeout=0.5)
+    assert client.action_handler.send_text_message("testuser", "recipientuser", "Delete me")
+    assert process_queue_headless(client)
+    assert client.action_handler.fetch_text_messages("testuser", 1)
+    _, message_args = client.server_message_queue.get(timeout=2)
+    message_id = message_args[0]
+
+    assert client.action_handler.delete_text_messages([message_id, "999999"])
+    message_type, message_args = client.server_message_queue.get(timeout=2)
+    assert client.action_handler.action_map[message_type] == "delete_text_messages"
+    assert message_args == ["True", "False"]
+    wait_for_condition(lambda: client.server_message_queue.empty())
+
 def test_delete_account(setup_client):
     """Test deleting an existing account."""
     client = setup_client
@@ -331,3 +615,153 @@ def test_create_and_delete_same_user_rapidly(setup_client):
         wait_for_condition(lambda: not client.server_message_queue.empty())
         process_queue_headless(client, poll_queue=True)
         wait_for_condition(lambda: client.server_message_queue.empty())
+
+@pytest.mark.parametrize("engine", ["threaded", "asyncio"])
+@pytest.mark.parametrize("overload", ["block", "reject", "shed"])
+def test_overload(engine, overload, tmp_path, write_config, start_server):
+    """Test a server with tiny client queues: `block` answers everything, `reject` and `shed` answer busy."""
+    port = 5600
+    config_file = write_config({
+        "SERVER": {"port": port, "engine": engine, "workers": 1, "queue_size": 2, "overload": overload},
+        "CLIENT": {"port": port},
+        "ACCOUNT": {"db_name": str(tmp_path / "overload.db")},
+        "MESSAGE": {"msg_protocol": 2},  # Request ids need the binary protocol
+    })
+    start_server(config_file, port)
+    client = Client(config_file)
+    assert wait_for_condition(lambda: client.connected), "Client failed to connect to server."
+    busy = [(client.action_handler.inverse_action_map["status"], [MSG.STATUS_BUSY])]
+    futures = [client.request("login_account", "nobody", "hash") for _ in range(300)]
+    responses = [future.result(timeout=10) for future in futures]
+    refused = sum(response == busy for response in responses)
+    if overload == "block":
+        assert refused == 0
+    else:
+        assert 0 < refused < len(responses)
+    client.disconnect()
+
+    async def retry():
+        async with AsyncClient(config_file) as async_client:
+            async_client.busy_retries = 100
+            return await asyncio.gather(*(async_client.request("login_account", "nobody", "hash") for _ in range(50)))
+    # Retried until answered, so every login fails for the missing account rather than as busy
+    login_failed = [(client.action_handler.inverse_action_map["login_account"], ["False"])]
+    assert asyncio.run(retry()) == [login_failed] * 50
+
+class DrainedQueue(queue.Queue):
+    """A client queue that a worker drains between `put_nowait` finding it full and `get_nowait`."""
+    def put_nowait(self, item):
+        if not getattr(self, "was_full", False):
+            self.was_full = True
+            raise queue.Full
+        super().put_nowait(item)
+
+    def get_nowait(self):
+        raise queue.Empty
+
+def test_shed_after_queue_drained():
+    """Test that `shed` refuses nothing when the full queue drains before it can drop the oldest request."""
+    refused = []
+    server = SimpleNamespace(
+        overload="shed", client_message_queues={"client": DrainedQueue(maxsize=1)},
+        send_busy=lambda *args: refused.append(args), metrics=SimpleNamespace(observe_queue_depth=lambda depth: None),
+    )
+    request = ("00000005", ["alice", "bob", "Sent once"], 7, 0.0)
+    SERVER.Server.enqueue_request(server, "client", request)
+    # Queued to run, and not also answered busy, which would make a retrying client send it twice
+    assert refused == []
+    assert server.client_message_queues["client"].get(timeout=1) == request
+
+@pytest.mark.parametrize("engine", ["threaded", "asyncio"])
+def test_client_that_never_reads(engine, tmp_path, write_config, start_server, make_endpoint):
+    """Test that a client pipelining large fetches without reading its socket stalls no other client."""
+    port = 5601
+    db_name = str(tmp_path / "never_reads.db")
+    account_db = db.AccountDatabase(db_name)
+    account_db.create_account("alice", "hash")
+    account_db.create_account("bob", "hash")
+    for i in range(1000):
+        account_db.send_text_message("alice", "bob", f"Message number {i} from alice to bob.")
+    account_db.close()
+    config_file = write_config({
+        "SERVER": {"port": port, "engine": engine, "workers": 2, "send_buffer": 65536},
+        "CLIENT": {"port": port},
+        "ACCOUNT": {"db_name": db_name},
+        "MESSAGE": {"msg_protocol": 2},  # Request ids need the binary protocol
+    })
+    start_server(config_file, port)
+    endpoint = make_endpoint(config_file, protocol_version=MSG.PROTOCOL_BINARY)
+    reader = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    reader.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    reader.connect(("127.0.0.1", port))
+    # About 15 MB of responses, more than the kernel's socket buffers can absorb
+    try:
+        for request_id in range(256):
+            msg = MSG.Message(MSG.MessageArgs("alice", 1000), "fetch_text_messages_batch", endpoint, request_id=request_id)
+            reader.sendall(frame(msg.encode()))
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # Already disconnected for falling behind
+    time.sleep(0.5)
+
+    client = Client(config_file)
+    assert wait_for_condition(lambda: client.connected, timeout=5), "Client failed to connect to server."
+    logged_in = [(client.action_handler.inverse_action_map["login_account"], ["True"])]
+    assert client.request("login_account", "bob", "hash").result(timeout=5) == logged_in
+    client.disconnect()
+
+    # Having fallen more than `send_buffer` bytes behind, the reader is disconnected
+    reader.settimeout(10)
+    try:
+        while reader.recv(65536):
+            pass
+    except ConnectionResetError:
+        pass
+    reader.close()
+
+def test_push_to_client_that_never_reads(tmp_path, write_config, start_server, make_endpoint):
+    """Test that pushes to a logged-in client that never reads neither block nor slow its senders."""
+    port = 5602
+    config_file = write_config({
+        "SERVER": {"port": port, "workers": 1, "send_buffer": 65536},
+        "CLIENT": {"port": port},
+        "ACCOUNT": {"db_name": str(tmp_path / "push.db")},
+        "MESSAGE": {"msg_protocol": 2},  # Request ids need the binary protocol
+    })
+    start_server(config_file, port)
+    sender = Client(config_file)
+    assert wait_for_condition(lambda: sender.connected, timeout=5), "Client failed to connect to server."
+    created = [(sender.action_handler.inverse_action_map["create_account"], ["True"])]
+    assert sender.request("create_account", "alice", "hash").result(timeout=5) == created
+    assert sender.request("create_account", "bob", "hash").result(timeout=5) == created
+
+    endpoint = make_endpoint(config_file, protocol_version=MSG.PROTOCOL_BINARY)
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    receiver.connect(("127.0.0.1", port))
+    msg = MSG.Message(MSG.MessageArgs("bob", "hash"), "login_account", endpoint, request_id=1)
+    receiver.sendall(frame(msg.encode()))
+    time.sleep(0.2)
+
+    # Every push to bob piles up unread, yet each send is answered
+    sent = [(sender.action_handler.inverse_action_map["send_text_message"], ["True"])]
+    for i in range(500):
+        assert sender.request("send_text_message", "alice", "bob", f"{i} " + "x" * 900).result(timeout=5) == sent
+    sender.disconnect()
+    receiver.close()
+
+@pytest.mark.parametrize("engine", ["threaded", "asyncio"])
+def test_oversized_frame(engine, tmp_path, write_config, start_server):
+    """Test that a frame header announcing more than the largest message closes the connection."""
+    port = 5603
+    config_file = write_config({
+        "SERVER": {"port": port, "engine": engine},
+        "CLIENT": {"port": port},
+        "ACCOUNT": {"db_name": str(tmp_path / "oversized.db")},
+    })
+    start_server(config_file, port)
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall((1 << 31).to_bytes(4, "big") + b"x" * 1024)
+        try:
+            assert sock.recv(1) == b""
+        except ConnectionResetError:
+            pass
@@ -10,6 +10,13 @@ class Config:
         return {
             "host": self.config.get("SERVER", "host"),
             "port": self.config.getint("SERVER", "port"),
+            "engine": self.config.get("SERVER", "engine", fallback="threaded"),
+            "backlog": self.config.getint("SERVER", "backlog", fallback=5),
+            "workers": self.config.getint("SERVER", "workers", fallback=1),
+            "batch_responses": self.config.getboolean("SERVER", "batch_responses", fallback=False),
+            "queue_size": self.config.getint("SERVER", "queue_size", fallback=0),
+            "overload": self.config.get("SERVER", "overload", fallback="block"),
+            "send_buffer": self.config.getint("SERVER", "send_buffer", fallback=1048576),
         }
 
     def get_client_config(self):
@@ -23,6 +30,59 @@ class Config:
         """Returns account database file name."""
         return self.config.get("ACCOUNT", "db_name")
 
+    def get_account_db_config(self):
+        """Returns account database tuning as a dictionary."""
+        return {
+            "backend": self.config.get("ACCOUNT", "backend", fallback="sqlite"),
+            "max_messages": self.config.getint("ACCOUNT", "max_messages", fallback=1024),
+            "shards": self.config.getint("ACCOUNT", "shards", fallback=1),
+            "journal_mode": self.config.get("ACCOUNT", "journal_mode", fallback="wal"),
+            "synchronous": self.config.get("ACCOUNT", "synchronous", fallback="normal"),
+            "busy_timeout": self.config.getint("ACCOUNT", "busy_timeout", fallback=5000),
+            "batch_size": self.config.getint("ACCOUNT", "batch_size", fallback=1),
+            "batch_delay": self.config.getfloat("ACCOUNT", "batch_delay", fallback=0.0),
+            "cache_size": self.config.getint("ACCOUNT", "cache_size", fallback=1024),
+        }
+
+    def get_logging_config(self):
+        """Returns logging settings as a dictionary; `modules` maps module names to levels."""
+        modules = self.config.get("LOGGING", "modules", fallback="")
+        return {
+            "level": self.config.get("LOGGING", "level", fallback="info"),
+            "modules": dict(
+                (name.strip(), level.strip())
+                for name, _, level in (entry.partition(":") for entry in modules.split(",") if entry.strip())
+            ),
+            "sample_rate": self.config.getfloat("LOGGING", "sample_rate", fallback=1.0),
+        }
+
+    def get_scheduler_config(self):
+        """
+        Returns scheduler settings as a dictionary: `classes` maps class names to weights, and
+        `action_classes` maps action names to classes, from each class's list of actions.
+        """
+        classes = {}
+        for entry in self.config.get("SCHEDULER", "classes", fallback="default:1").split(","):
+            name, _, weight = entry.partition(":")
+            classes[name.strip()] = int(weight or 1)
+        action_classes = {}
+        for name in classes:
+            for action in self.config.get("SCHEDULER", name, fallback="").split(","):
+                if action.strip():
+                    action_classes[action.strip()] = name
+        return {
+            "classes": classes,
+            "action_classes": action_classes,
+            "default_class": self.config.get("SCHEDULER", "default_class", fallback=next(iter(classes))),
+        }
+
+    def get_metrics_config(self):
+        """Returns metrics dump settings as a dictionary (an empty `dump_file` disables the dump)."""
+        return {
+            "dump_file": self.config.get("METRICS", "dump_file", fallback=""),
+            "dump_interval": self.config.getfloat("METRICS", "dump_interval", fallback=10.0),
+        }
+
     def get_msg_magic(self):
         """Returns message magic string."""
         return self.config.get("MESSAGE", "msg_magic") 
@@ -39,6 +99,10 @@ class Config:
         """Returns message maximum size."""
         return int(self.config.get("MESSAGE", "msg_max_size")) 
     
+    def get_msg_protocol(self):
+        """Returns the preferred wire protocol version."""
+        return self.config.getint("MESSAGE", "msg_protocol", fallback=1)
+
     def get_actions_dict(self):
         """Returns actions dictionary file name."""
         return self.config.get("ACTIONS", "actions")
@@ -0,0 +1,84 @@
+"""
+Leveled, asynchronous logging for the server and client.
+
+Modules log through standard `logging` loggers under "chat" ("chat.server",
+"chat.actions", "chat.db", "chat.message"), so they depend on nothing but the
+standard library and cost one level check per call when their level is off.
+`configure` sets the levels, samples records below WARNING, and hands records to
+a queue; a listener thread writes them, so a request never waits on output.
+"""
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+ROOT_LOGGER = "chat"
+MODULES = ("server", "actions", "db", "message")
+
+# Above CRITICAL, so nothing is logged
+OFF = logging.CRITICAL + 10
+
+_listener = None
+
+class SampleFilter(logging.Filter):
+    """Passes a `rate` fraction of the records below `level`, and all of the others."""
+
+    def __init__(self, rate: float, level: int = logging.WARNING):
+        super().__init__()
+        self.rate = rate
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self.level or random.random() < self.rate
+
+def parse_level(name: str) -> int:
+    """Returns the level named `name` ("debug", "info", ..., or "off")."""
+    name = name.strip().upper()
+    if name == "OFF":
+        return OFF
+    level = logging.getLevelName(name)
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level '{name}'.")
+    return level
+
+def configure(level: str = "info", modules: dict = None, sample_rate: float = 1.0, stream=None) -> logging.Logger:
+    """
+    Route the "chat" loggers through a queue to `stream` (stdout by default).
+    `modules` overrides the level of single modules, as {"db": "warning"}; records
+    below WARNING are kept with probability `sample_rate`.
+    """
+    global _listener
+    shutdown()
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(parse_level(level))
+    root.propagate = False
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for module in MODULES:
+        logging.getLogger(f"{ROOT_LOGGER}.{module}").setLevel(logging.NOTSET)
+    for module, module_level in (modules or {}).items():
+        logging.getLogger(f"{ROOT_LOGGER}.{module}").setLevel(parse_level(module_level))
+
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    if sample_rate < 1:
+        handler.addFilter(SampleFilter(sample_rate))
+    root.addHandler(handler)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter("%(message)s"))
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    return root
+
+def shutdown():
+    """Write out the queued records and stop the listener."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(shutdown)
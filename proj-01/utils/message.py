@@ -1,4 +1,46 @@
 import json
+import logging
+import struct
+
+logger = logging.getLogger("chat.message")
+
+# Wire protocol versions. Version 1 is the original text framing; version 2 is the
+# binary framing with a struct-packed header and length-prefixed fields.
+PROTOCOL_LEGACY = 1
+PROTOCOL_BINARY = 2
+PROTOCOL_VERSION = PROTOCOL_BINARY
+
+# Content of the `status` message used to negotiate the protocol version.
+PROTOCOL_HELLO = "protocol:"
+
+# Content of the `status` message that refuses a request because the server is overloaded.
+# It echoes the request's id; the client may retry after backing off.
+STATUS_BUSY = "busy"
+
+# Content of the `status` message that refuses a request whose arguments do not match
+# its schema in `actions.json`. It echoes the request's id.
+STATUS_INVALID = "invalid"
+
+# Binary header: [Magic (2)] [Version (1)] [Opcode (2)] [Flags (1)] [Content Length (4)]
+BINARY_MAGIC = b"\xd5\x5d"
+BINARY_HEADER = struct.Struct("!2sBHBI")
+BINARY_FIELD = struct.Struct("!H")
+
+# Binary header flags. A message with a request id carries it right after the header
+# (counted in the content length); every response message echoes the request's id.
+FLAG_REQUEST_ID = 0x01
+FLAG_MORE = 0x02  # Further messages of the same response follow
+BINARY_REQUEST_ID = struct.Struct("!I")
+# The header followed by a request id, packed and unpacked in one step
+BINARY_HEADER_ID = struct.Struct("!2sBHBII")
+# Length prefixes of fields shorter than a message's usual maximum, packed once
+BINARY_FIELD_PREFIXES = [BINARY_FIELD.pack(length) for length in range(4096)]
+
+def escape_legacy(field: str) -> str:
+    """Escapes the legacy separator '|' and the escape character '\\' in one field."""
+    if "|" not in field and "\\" not in field:
+        return field
+    return field.replace("\\", "\\\\").replace("|", "\\|")
 
 class MessageArgs:
     def __init__(self, *args):
@@ -10,13 +52,40 @@ class MessageArgs:
         self.args = args
 
     def to_string(self) -> str:
-        """Returns the arguments as a string separated by '|'."""
-        return "|".join(map(str, self.args))
+        """
+        Returns the arguments as a string separated by '|'. A '|' or '\\' inside an argument is escaped
+        with a backslash, so an argument such as a message text cannot shift the ones after it.
+        """
+        return "|".join(escape_legacy(str(arg)) for arg in self.args)
+
+    def to_fields(self) -> list[str]:
+        """Returns the arguments as separate fields (for the binary protocol)."""
+        args = self.args
+        return [arg if type(arg) is str else str(arg) for arg in args]
 
     @classmethod
     def to_arglist(cls, arg_string: str):
-        """Parses a string separated by '|' and returns an argument list."""
-        args = arg_string.split("|")
+        """Parses a string separated by '|', undoing the escapes of `to_string`, and returns an argument list."""
+        if "\\" not in arg_string:
+            return arg_string.split("|")
+        if "\0" not in arg_string and "\1" not in arg_string:
+            # Hide the escapes behind two control characters for a single split. Replacing
+            # escaped backslashes first matches the left-to-right scan of the loop below.
+            masked = arg_string.replace("\\\\", "\0").replace("\\|", "\1")
+            return [field.replace("\1", "|").replace("\0", "\\") for field in masked.split("|")]
+        args, field = [], []
+        chars = iter(arg_string)
+        for char in chars:
+            if char == "\\":
+                escaped = next(chars, "")
+                # Any other backslash is kept as it is, as older peers send them unescaped
+                field.append(escaped if escaped in ("\\", "|") else char + escaped)
+            elif char == "|":
+                args.append("".join(field))
+                field = []
+            else:
+                field.append(char)
+        args.append("".join(field))
         return args
 
 class MessageArgsJSON(MessageArgs):
@@ -28,81 +97,190 @@ class MessageArgsJSON(MessageArgs):
         """Returns the arguments as a JSON-formatted string."""
         return json.dumps(self.args)
 
+    def to_fields(self) -> list[str]:
+        """Returns the arguments as a single JSON-formatted field."""
+        return [self.to_string()]
+
     @classmethod
     def from_json(cls, arg_string: str):
         """Parses a JSON-formatted string and returns an argument list."""
         args = json.loads(arg_string)
         return args
 
+class MessageRows(list):
+    """
+    Rows of fields returned by an action that should be packed into as few messages as possible
+    (see `Message.pack_rows`) rather than sent as one message per row.
+    """
+
 class Message:
     """
     Handles message creation and parsing.
-    Structure: [Magic (8)] [Message Type (8)] [Content (0-1000)] [Magic (8)]
+    Legacy structure: [Magic (8)] [Message Type (8)] [Content (0-1000)] [Magic (8)]
+    Binary structure: [Header (10)] ([Request Id (4)]) ([Field Length (2)] [Field])*
     """
 
-    def __init__(self, message_args, message_type: str, endpoint):
+    # Defaults of every message, so each message only stores what differs from them
+    version = PROTOCOL_LEGACY
+    request_id = None
+    more = False
+    message_type = ""
+    message_content = ""
+    message_args = None
+    message = ""
+    frame = b""  # The encoded binary frame
+    message_valid = False
+
+    def __init__(self, message_args, message_type: str, endpoint, version: int = None, request_id: int = None, more: bool = False):
         """
         Constructor for sending messages.
         Ensures message validity before storing.
+        Encodes with `version`, defaulting to the protocol negotiated by the endpoint.
+        `request_id` and `more` are carried by the binary protocol only.
         """
         self.endpoint = endpoint
-        self.message_type = ""
-        self.message_content = ""
-        self.message = ""
-        self.message_valid = False
-
-        message_content = message_args.to_string()
-
-        if self.endpoint.msg_min_size + len(message_content) <= self.endpoint.msg_max_size and \
-            (message_type in self.endpoint.action_handler.action_map or \
-             message_type in self.endpoint.action_handler.inverse_action_map):
-            if message_type in self.endpoint.action_handler.action_map:
-                self.message_type = message_type
-            else:
-                self.message_type = self.endpoint.action_handler.inverse_action_map[message_type]
-            self.message_content = message_content
-            self.message = (
-                self.endpoint.msg_magic +
-                self.message_type +
-                self.message_content +
-                self.endpoint.msg_magic
-            )
-            self.message_valid = True
+        self.version = version = version or getattr(endpoint, "protocol_version", PROTOCOL_LEGACY)
+        self.more = more
+
+        code_opcode = endpoint.action_handler.code_opcodes.get(message_type)
+        if code_opcode is None:
+            logger.info("[Message] Invalid size or type.")
+            return
+        self.message_type, opcode = code_opcode
+
+        if version == PROTOCOL_BINARY:
+            self.request_id = request_id
+            # The whole frame is built here, in one join, so `encode` only returns it
+            fields = message_args.to_fields()
+            parts = [b""]  # Replaced by the header once the content length is known
+            append = parts.append
+            content_length = BINARY_FIELD.size * len(fields)
+            for field in fields:
+                field = field.encode()
+                field_length = len(field)
+                if field_length < 4096:
+                    append(BINARY_FIELD_PREFIXES[field_length])
+                elif field_length <= 0xFFFF:
+                    append(BINARY_FIELD.pack(field_length))
+                else:
+                    # A single field is too long for its length prefix
+                    content_length = None
+                    break
+                append(field)
+                content_length += field_length
+            if content_length is not None:
+                flags = FLAG_MORE if more else 0
+                try:
+                    if request_id is None:
+                        parts[0] = BINARY_HEADER.pack(BINARY_MAGIC, PROTOCOL_BINARY, opcode, flags, content_length)
+                    else:
+                        content_length += BINARY_REQUEST_ID.size
+                        parts[0] = BINARY_HEADER_ID.pack(
+                            BINARY_MAGIC, PROTOCOL_BINARY, opcode, flags | FLAG_REQUEST_ID, content_length, request_id
+                        )
+                except struct.error:
+                    # The id is too large for its field
+                    content_length = None
+            if content_length is not None and BINARY_HEADER.size + content_length <= endpoint.msg_max_size:
+                self.frame = b"".join(parts)
+                self.message_args = fields
+                self.message_valid = True
         else:
-            print("[Message] Invalid size or type.")
-            self.message_valid = False
+            message_content = message_args.to_string()
+            if endpoint.msg_min_size + len(message_content) <= endpoint.msg_max_size:
+                self.message_content = message_content
+                self.message = endpoint.msg_magic + self.message_type + message_content + endpoint.msg_magic
+                self.message_valid = True
+
+        if not self.message_valid:
+            logger.info("[Message] Invalid size or type.")
 
     @classmethod
-    def from_bytes(cls, message_bytes: str, endpoint):
+    def pack_rows(cls, rows, message_type: str, endpoint, version: int = None, request_id: int = None):
+        """
+        Packs `rows` (lists of fields) into messages of at most `msg_max_size`.
+        Each message's arguments are a "more" flag ("1" if further messages follow, "0" on the last),
+        the row width, and then the fields of its rows back to back.
+        """
+        version = version or getattr(endpoint, "protocol_version", PROTOCOL_LEGACY)
+        width = len(rows[0]) if rows else 0
+        header_size = cls.frame_size(["1", str(width)], version, endpoint)
+        if request_id is not None and version == PROTOCOL_BINARY:
+            header_size += BINARY_REQUEST_ID.size
+
+        chunks = [[]]
+        chunk_size = header_size
+        for row in rows:
+            row = [str(field) for field in row]
+            row_size = cls.fields_size(row, version)
+            if header_size + row_size > endpoint.msg_max_size:
+                logger.warning("[Message] Row too large for a single message; skipped.")
+                continue
+            if chunks[-1] and chunk_size + row_size > endpoint.msg_max_size:
+                chunks.append([])
+                chunk_size = header_size
+            chunks[-1].extend(row)
+            chunk_size += row_size
+
+        return [
+            cls(
+                MessageArgs("1" if i < len(chunks) - 1 else "0", width, *chunk), message_type, endpoint, version,
+                request_id=request_id, more=(i < len(chunks) - 1)
+            )
+            for i, chunk in enumerate(chunks)
+        ]
+
+    @staticmethod
+    def fields_size(fields: list[str], version: int) -> int:
+        """Returns how much `fields` add to a message (characters for legacy, bytes for binary)."""
+        if version == PROTOCOL_BINARY:
+            return sum(BINARY_FIELD.size + (len(field) if field.isascii() else len(field.encode("utf-8"))) for field in fields)
+        return sum(len(escape_legacy(field)) + 1 for field in fields)
+
+    @classmethod
+    def frame_size(cls, fields: list[str], version: int, endpoint) -> int:
+        """Returns the size of a message carrying exactly `fields`, as measured against `msg_max_size`."""
+        if version == PROTOCOL_BINARY:
+            return BINARY_HEADER.size + cls.fields_size(fields, version)
+        return endpoint.msg_min_size + cls.fields_size(fields, version) - 1
+
+    @classmethod
+    def from_bytes(cls, message_bytes, endpoint):
         """
         Alternative constructor for receiving messages.
+        Accepts a frame in either protocol (as bytes, a memoryview, or a decoded string).
         Validates message integrity before returning an instance.
         """
 
         instance = cls.__new__(cls)
         instance.endpoint = endpoint
-        instance.message_type = ""
-        instance.message_content = ""
-        instance.message = ""
-        instance.message_valid = False
+
+        if not isinstance(message_bytes, str):
+            if message_bytes[:len(BINARY_MAGIC)] == BINARY_MAGIC:
+                return instance.parse_binary(message_bytes)
+            try:
+                message_bytes = str(message_bytes, "utf-8")
+            except UnicodeDecodeError:
+                logger.info("[Message] Invalid encoding.")
+                return instance
 
         if not (instance.endpoint.msg_min_size <= len(message_bytes) <= instance.endpoint.msg_max_size):
             instance.message_valid = False
-            print("[Message] Invalid size.")
+            logger.info("[Message] Invalid size.")
             return instance
         
         message_header = message_bytes[:endpoint.msg_magic_size]
         message_footer = message_bytes[-endpoint.msg_magic_size:]
         if message_header != endpoint.msg_magic or message_footer != endpoint.msg_magic:
             instance.message_valid = False
-            print("[Message] Invalid magic values.")
+            logger.info("[Message] Invalid magic values.")
             return instance
 
         message_type = message_bytes[endpoint.msg_magic_size:endpoint.msg_magic_size + endpoint.msg_type_size]
         # TODO: Check message type
         if message_type not in instance.endpoint.action_handler.action_map:
             instance.message_valid = False
-            print("[Message] Invalid type.")
+            logger.info("[Message] Invalid type.")
             return instance
         
         message_content = message_bytes[endpoint.msg_magic_size + endpoint.msg_type_size:-endpoint.msg_magic_size]
@@ -116,8 +294,65 @@ class Message:
 
         return instance
 
+    def parse_binary(self, frame):
+        """
+        Parses a binary frame (bytes or a memoryview): the header and request id with `unpack_from`,
+        then each field decoded straight from its bytes.
+        """
+        frame_length = len(frame)
+        if not (BINARY_HEADER.size <= frame_length <= self.endpoint.msg_max_size):
+            logger.info("[Message] Invalid size.")
+            return self
+
+        _, version, opcode, flags, content_length = BINARY_HEADER.unpack_from(frame)
+        if version != PROTOCOL_BINARY or content_length != frame_length - BINARY_HEADER.size:
+            logger.info("[Message] Invalid header.")
+            return self
+
+        message_type = self.endpoint.action_handler.opcode_map.get(opcode)
+        if message_type is None:
+            logger.info("[Message] Invalid type.")
+            return self
+
+        offset = BINARY_HEADER.size
+        request_id = None
+        if flags & FLAG_REQUEST_ID:
+            if offset + BINARY_REQUEST_ID.size > frame_length:
+                logger.info("[Message] Invalid request id.")
+                return self
+            (request_id,) = BINARY_REQUEST_ID.unpack_from(frame, offset)
+            offset += BINARY_REQUEST_ID.size
+
+        # Short fields slice and decode faster from bytes than from a memoryview, so a view is copied once
+        if not isinstance(frame, bytes):
+            frame = bytes(frame)
+        message_args = []
+        append = message_args.append
+        try:
+            while offset < frame_length:
+                # Each field's end, past its 2-byte length prefix
+                end = offset + 2 + ((frame[offset] << 8) | frame[offset + 1])
+                if end > frame_length:
+                    logger.info("[Message] Invalid field length.")
+                    return self
+                append(frame[offset + 2:end].decode())
+                offset = end
+        except (IndexError, UnicodeDecodeError):
+            logger.info("[Message] Invalid field.")
+            return self
+
+        self.version = PROTOCOL_BINARY
+        self.request_id = request_id
+        self.more = bool(flags & FLAG_MORE)
+        self.message_type = message_type
+        self.message_args = message_args
+        self.message_valid = True
+        return self
+
     def encode(self) -> bytes:
-        """Encodes the message into bytes (UTF-8)."""
+        """Encodes the message into bytes (UTF-8 text for legacy, a packed header and fields for binary)."""
+        if self.version == PROTOCOL_BINARY:
+            return self.frame
         return self.message.encode("utf-8")
 
     def valid(self) -> bool:
@@ -128,4 +363,18 @@ class Message:
         """Unpacks the message into its type and content."""
         if not self.valid():
             return None
+        if self.version == PROTOCOL_BINARY:
+            return self.message_type, "|".join(self.args())
         return self.message_type, self.message_content
+
+    def unpack_args(self):
+        """Unpacks the message into its type and argument list."""
+        if not self.valid():
+            return None
+        return self.message_type, self.args()
+
+    def args(self) -> list[str]:
+        """Returns the message arguments, whichever protocol the message uses."""
+        if self.version == PROTOCOL_BINARY:
+            return self.message_args
+        return MessageArgs.to_arglist(self.message_content)
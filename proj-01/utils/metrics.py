@@ -0,0 +1,169 @@
+"""
+Server instrumentation: per-action counts, error counts and latency histograms.
+
+Every action's time is split into three phases: `queue` (from receipt until a
+worker starts it), `db` (running the action) and `send` (writing the response).
+Each phase has its own `Histogram`. `Metrics.snapshot()` returns everything as
+a dictionary, and `rows()` flattens it into (name, value) pairs.
+"""
+import json
+import os
+import threading
+import time
+
+PHASES = ("queue", "db", "send")
+PERCENTILES = (50, 90, 99, 99.9)
+
+class Histogram:
+    """
+    HDR-style latency histogram: exact below 2**`precision_bits` microseconds and
+    log-linear above, so every recorded value is kept to within 1 / 2**(`precision_bits` - 1)
+    in constant memory per power of two, however many values are recorded.
+    """
+
+    def __init__(self, precision_bits: int = 6):
+        self.precision_bits = precision_bits
+        self.counts = {}  # Bucket index -> count
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def bucket(self, value: int) -> int:
+        """Index of the bucket holding `value` (microseconds)."""
+        shift = max(0, value.bit_length() - self.precision_bits)
+        return (shift << (self.precision_bits - 1)) + (value >> shift)
+
+    def bucket_value(self, index: int) -> int:
+        """The largest value (microseconds) that falls in bucket `index`."""
+        shift = max(0, (index >> (self.precision_bits - 1)) - 1)
+        return ((index - (shift << (self.precision_bits - 1)) + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        """Add a latency in seconds."""
+        value = max(0, int(seconds * 1e6))
+        index = self.bucket(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> int:
+        """The value (microseconds) that `p` percent of the recorded values are at or below."""
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * p / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.bucket_value(index), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """Count, mean, max and `PERCENTILES`, in milliseconds."""
+        summary = {"count": self.count, "mean_ms": round(self.total / self.count / 1000, 3) if self.count else 0.0}
+        for p in PERCENTILES:
+            summary[f"p{p:g}_ms"] = round(self.percentile(p) / 1000, 3)
+        summary["max_ms"] = round(self.max / 1000, 3)
+        return summary
+
+class Metrics:
+    """Thread-safe counters and histograms of the server's actions and connections."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.actions = {}  # Action name -> {"count", "errors", "rejected", "invalid", and a Histogram per phase}
+        self.classes = {}  # Scheduler class -> Histogram of the time its tasks waited for a worker
+        self.connections_open = 0
+        self.connections_total = 0
+        self.max_queue_depth = 0
+
+    def action(self, name: str) -> dict:
+        """The counters of action `name`, created on first use (the caller holds the lock)."""
+        stats = self.actions.get(name)
+        if stats is None:
+            stats = self.actions[name] = {"count": 0, "errors": 0, "rejected": 0, "invalid": 0, **{phase: Histogram() for phase in PHASES}}
+        return stats
+
+    def record(self, name: str, queue: float, db: float, send: float):
+        """Record an action that completed, with the seconds it spent in each phase."""
+        with self.lock:
+            stats = self.action(name)
+            stats["count"] += 1
+            stats["queue"].record(queue)
+            stats["db"].record(db)
+            stats["send"].record(send)
+
+    def record_error(self, name: str):
+        """Record an action that raised."""
+        with self.lock:
+            self.action(name)["errors"] += 1
+
+    def record_rejected(self, name: str):
+        """Record a request refused as busy."""
+        with self.lock:
+            self.action(name)["rejected"] += 1
+
+    def record_invalid(self, name: str):
+        """Record a request refused for malformed arguments."""
+        with self.lock:
+            self.action(name)["invalid"] += 1
+
+    def record_class_wait(self, class_name: str, seconds: float):
+        """Record how long a task of scheduler class `class_name` waited for a worker."""
+        with self.lock:
+            histogram = self.classes.get(class_name)
+            if histogram is None:
+                histogram = self.classes[class_name] = Histogram()
+            histogram.record(seconds)
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections_open += 1
+            self.connections_total += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.connections_open -= 1
+
+    def observe_queue_depth(self, depth: int):
+        """Note a client queue's depth, keeping the largest seen."""
+        if depth > self.max_queue_depth:
+            with self.lock:
+                self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def snapshot(self, queue_depths: dict = None) -> dict:
+        """All metrics as a dictionary; `queue_depths` are the current depths by connection."""
+        with self.lock:
+            return {
+                "uptime_s": round(time.time() - self.started, 3),
+                "connections": {"open": self.connections_open, "total": self.connections_total},
+                "queues": {"max_depth": self.max_queue_depth, "depths": dict(queue_depths or {})},
+                "actions": {
+                    name: {
+                        "count": stats["count"], "errors": stats["errors"], "rejected": stats["rejected"], "invalid": stats["invalid"],
+                        **{phase: stats[phase].summary() for phase in PHASES},
+                    }
+                    for name, stats in self.actions.items()
+                },
+                "classes": {name: {"wait": histogram.summary()} for name, histogram in self.classes.items()},
+            }
+
+def rows(snapshot: dict, prefix: str = "") -> list[tuple[str, str]]:
+    """Flatten a snapshot into (dotted name, value) rows, e.g. ("actions.login_account.db.p99_ms", "0.42")."""
+    flat = []
+    for key, value in snapshot.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.extend(rows(value, f"{name}."))
+        else:
+            flat.append((name, str(value)))
+    return flat
+
+def dump(snapshot: dict, path: str):
+    """Write a snapshot to `path` as JSON, replacing the file in one step so readers never see half of it."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(snapshot, file, indent=2)
+    os.replace(temp_path, path)
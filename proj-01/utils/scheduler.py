@@ -0,0 +1,106 @@
+"""
+Fair scheduling of actions across clients, with weighted priority classes.
+
+Every action belongs to a class (for instance `auth` for logins, `bulk` for history
+fetches). Worker threads take tasks from the classes by deficit round-robin: each
+class may run up to its weight in tasks per round, so a class of weight 4 gets four
+times the turns of a class of weight 1 while both have work, and an idle class
+lends its turns to the others. Within a class, clients take turns one task at a
+time, so a client with thousands of queued requests delays another client's
+request by at most one task per busy client.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+class FairScheduler:
+    """Runs submitted calls on `workers` threads, fairly across clients and by class weight."""
+
+    def __init__(self, workers: int, classes: dict = None, action_classes: dict = None, default_class: str = None, metrics=None):
+        """
+        `classes` maps class names to integer weights (at least 1), and `action_classes` maps
+        action names to classes; other actions fall in `default_class`. The time each task
+        waits is recorded per class with `metrics.record_class_wait(...)` if `metrics` is given.
+        """
+        self.weights = dict(classes or {"default": 1})
+        self.default_class = default_class or next(iter(self.weights))
+        self.action_classes = dict(action_classes or {})
+        for name, weight in self.weights.items():
+            if weight < 1:
+                raise ValueError(f"Scheduler class '{name}' needs a weight of at least 1.")
+        for name in [self.default_class, *self.action_classes.values()]:
+            if name not in self.weights:
+                raise ValueError(f"Unknown scheduler class '{name}'.")
+        self.metrics = metrics
+
+        # Per class, the clients with queued tasks in turn order, each with its own queue
+        self.queues = {name: OrderedDict() for name in self.weights}
+        self.deficits = {name: 0 for name in self.weights}
+        self.class_order = deque(self.weights)
+        self.pending = 0
+        self.condition = threading.Condition()
+
+        self.workers = [threading.Thread(target=self.run_worker, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def class_of(self, action_name: str) -> str:
+        """The class action `action_name` is scheduled in."""
+        return self.action_classes.get(action_name, self.default_class)
+
+    def submit(self, client, action_name: str, fn, *args) -> Future:
+        """Queue `fn(*args)` on behalf of `client` (any hashable key) and return its future."""
+        future = Future()
+        class_name = self.class_of(action_name)
+        with self.condition:
+            self.queues[class_name].setdefault(client, deque()).append((future, fn, args, class_name, time.perf_counter()))
+            self.pending += 1
+            self.condition.notify()
+        return future
+
+    def next_task(self) -> tuple:
+        """Take the next task by deficit round-robin (the caller holds the lock, and a task is pending)."""
+        while True:
+            class_name = self.class_order[0]
+            clients = self.queues[class_name]
+            if clients and self.deficits[class_name] >= 1:
+                self.deficits[class_name] -= 1
+                client, tasks = next(iter(clients.items()))
+                task = tasks.popleft()
+                if tasks:
+                    clients.move_to_end(client)  # Other clients of the class go first
+                else:
+                    del clients[client]
+                return task
+
+            # This class's turn is over; an idle class keeps no credit
+            if not clients:
+                self.deficits[class_name] = 0
+            self.class_order.rotate(-1)
+            class_name = self.class_order[0]
+            if self.queues[class_name]:
+                self.deficits[class_name] += self.weights[class_name]
+
+    def queued(self) -> dict:
+        """The number of queued tasks in each class."""
+        with self.condition:
+            return {name: sum(map(len, clients.values())) for name, clients in self.queues.items()}
+
+    def run_worker(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                future, fn, args, class_name, submitted = self.next_task()
+                self.pending -= 1
+            if not future.set_running_or_notify_cancel():
+                continue
+            if self.metrics is not None:
+                self.metrics.record_class_wait(class_name, time.perf_counter() - submitted)
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
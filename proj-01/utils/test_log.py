@@ -0,0 +1,57 @@
+import io
+import logging
+import pytest
+
+import log
+
+@pytest.fixture
+def output():
+    stream = io.StringIO()
+    yield stream
+    log.shutdown()
+    logging.getLogger(log.ROOT_LOGGER).handlers.clear()
+
+def written(stream) -> list[str]:
+    log.shutdown()  # Waits for the listener to write every queued record
+    return stream.getvalue().splitlines()
+
+def test_levels(output):
+    log.configure("info", stream=output)
+    logger = logging.getLogger("chat.server")
+    logger.debug("hidden")
+    logger.info("shown %s", 1)
+    logger.warning("shown %s", 2)
+    assert written(output) == ["shown 1", "shown 2"]
+
+def test_module_levels(output):
+    log.configure("info", modules={"db": "debug", "message": "off"}, stream=output)
+    logging.getLogger("chat.db").debug("db debug")
+    logging.getLogger("chat.message").warning("message warning")
+    logging.getLogger("chat.actions").debug("actions debug")
+    assert written(output) == ["db debug"]
+
+def test_off_skips_formatting(output):
+    class Unprintable:
+        def __str__(self):
+            raise AssertionError("formatted a record that is off")
+    log.configure("off", stream=output)
+    logging.getLogger("chat.server").critical("%s", Unprintable())
+    assert written(output) == []
+
+def test_sampling(output):
+    log.configure("debug", sample_rate=0.0, stream=output)
+    logger = logging.getLogger("chat.actions")
+    for _ in range(100):
+        logger.info("sampled")
+    logger.warning("kept")
+    assert written(output) == ["kept"]
+
+def test_reconfigure(output):
+    log.configure("debug", modules={"db": "off"}, stream=output)
+    log.configure("debug", stream=output)
+    logging.getLogger("chat.db").debug("db back on")
+    assert written(output) == ["db back on"]
+
+def test_unknown_level():
+    with pytest.raises(ValueError):
+        log.parse_level("loud")
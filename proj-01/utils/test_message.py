@@ -0,0 +1,206 @@
+import json
+import os
+import pytest
+
+import message as MSG
+
+ACTIONS_PATH = os.path.join(os.path.dirname(__file__), "..", "actions", "actions.json")
+
+class ActionMap:
+    def __init__(self):
+        with open(ACTIONS_PATH) as file:
+            # Entries are {"name": ..., "args": [...]}, or just the name
+            self.action_map = {code: action if isinstance(action, str) else action["name"] for code, action in json.load(file).items()}
+        self.inverse_action_map = {v: k for k, v in self.action_map.items()}
+        self.opcode_map = {int(k): k for k in self.action_map}
+        self.code_opcodes = {key: (k, int(k)) for k, v in self.action_map.items() for key in (k, v)}
+
+class Endpoint:
+    """Stands in for a `Client`/`Server` with the settings from `config.ini`."""
+    def __init__(self, protocol_version=MSG.PROTOCOL_LEGACY):
+        self.msg_magic = "87654321"
+        self.msg_magic_size = 8
+        self.msg_type_size = 8
+        self.msg_min_size = 24
+        self.msg_max_size = 1008
+        self.protocol_version = protocol_version
+        self.action_handler = ActionMap()
+
+@pytest.fixture(params=[MSG.PROTOCOL_LEGACY, MSG.PROTOCOL_BINARY])
+def endpoint(request):
+    return Endpoint(request.param)
+
+### ---- 1. Round Trip Tests ---- ###
+
+def test_round_trip(endpoint):
+    msg = MSG.Message(MSG.MessageArgs("alice", "bob", "Hi Bob!"), "send_text_message", endpoint)
+    assert msg.valid()
+    received = MSG.Message.from_bytes(msg.encode(), endpoint)
+    assert received.valid()
+    assert received.version == endpoint.protocol_version
+    assert received.unpack_args() == ("00000005", ["alice", "bob", "Hi Bob!"])
+
+def test_round_trip_by_code(endpoint):
+    msg = MSG.Message(MSG.MessageArgs("ok"), "00000000", endpoint)
+    assert MSG.Message.from_bytes(msg.encode(), endpoint).unpack_args() == ("00000000", ["ok"])
+
+def test_round_trip_unicode(endpoint):
+    msg = MSG.Message(MSG.MessageArgs("héllo 👋"), "status", endpoint)
+    assert MSG.Message.from_bytes(msg.encode(), endpoint).unpack_args()[1] == ["héllo 👋"]
+
+def test_legacy_string_frame():
+    endpoint = Endpoint()
+    msg = MSG.Message(MSG.MessageArgs("a", "b"), "login_account", endpoint)
+    assert MSG.Message.from_bytes(msg.encode().decode("utf-8"), endpoint).unpack() == ("00000003", "a|b")
+
+def test_legacy_escapes_separator():
+    endpoint = Endpoint()
+    msg = MSG.Message(MSG.MessageArgs("alice", "bob", "a|b\\|c\\"), "send_text_message", endpoint)
+    assert MSG.Message.from_bytes(msg.encode(), endpoint).unpack_args()[1] == ["alice", "bob", "a|b\\|c\\"]
+
+def test_legacy_unescaped_backslash():
+    """A backslash that escapes nothing, as older peers send, is kept."""
+    assert MSG.MessageArgs.to_arglist("C:\\temp|x") == ["C:\\temp", "x"]
+
+### ---- 2. Binary Protocol Tests ---- ###
+
+def test_binary_preserves_separator():
+    endpoint = Endpoint(MSG.PROTOCOL_BINARY)
+    msg = MSG.Message(MSG.MessageArgs("alice", "bob", "a|b|c"), "send_text_message", endpoint)
+    assert MSG.Message.from_bytes(msg.encode(), endpoint).unpack_args()[1] == ["alice", "bob", "a|b|c"]
+
+def test_binary_is_smaller():
+    args = MSG.MessageArgs("alice", "bob", "Hello there!")
+    legacy = MSG.Message(args, "send_text_message", Endpoint(MSG.PROTOCOL_LEGACY))
+    binary = MSG.Message(args, "send_text_message", Endpoint(MSG.PROTOCOL_BINARY))
+    assert len(binary.encode()) < len(legacy.encode())
+
+def test_binary_from_memoryview():
+    endpoint = Endpoint(MSG.PROTOCOL_BINARY)
+    frame = MSG.Message(MSG.MessageArgs("x", "y"), "login_account", endpoint).encode()
+    assert MSG.Message.from_bytes(memoryview(frame), endpoint).unpack_args() == ("00000003", ["x", "y"])
+
+def test_either_protocol_accepted():
+    """A receiver decodes both protocols regardless of its own preference."""
+    frame = MSG.Message(MSG.MessageArgs("x"), "status", Endpoint(MSG.PROTOCOL_BINARY)).encode()
+    assert MSG.Message.from_bytes(frame, Endpoint(MSG.PROTOCOL_LEGACY)).valid()
+
+def test_binary_request_id():
+    endpoint = Endpoint(MSG.PROTOCOL_BINARY)
+    msg = MSG.Message(MSG.MessageArgs("alice", "pass"), "login_account", endpoint, request_id=70000, more=True)
+    received = MSG.Message.from_bytes(msg.encode(), endpoint)
+    assert received.valid()
+    assert (received.request_id, received.more) == (70000, True)
+    assert received.unpack_args() == ("00000003", ["alice", "pass"])
+
+    plain = MSG.Message.from_bytes(MSG.Message(MSG.MessageArgs("alice"), "status", endpoint).encode(), endpoint)
+    assert (plain.request_id, plain.more) == (None, False)
+    assert not MSG.Message(MSG.MessageArgs("x"), "status", endpoint, request_id=2**32).valid()
+
+def test_legacy_ignores_request_id():
+    endpoint = Endpoint(MSG.PROTOCOL_LEGACY)
+    msg = MSG.Message(MSG.MessageArgs("alice"), "status", endpoint, request_id=5)
+    assert MSG.Message.from_bytes(msg.encode(), endpoint).request_id is None
+
+### ---- 3. Invalid Message Tests ---- ###
+
+def test_invalid_type(endpoint):
+    assert not MSG.Message(MSG.MessageArgs("x"), "no_such_action", endpoint).valid()
+
+def test_oversized_message(endpoint):
+    assert not MSG.Message(MSG.MessageArgs("x" * 2000), "status", endpoint).valid()
+
+def test_binary_bad_length():
+    endpoint = Endpoint(MSG.PROTOCOL_BINARY)
+    frame = MSG.Message(MSG.MessageArgs("abc"), "status", endpoint).encode()
+    assert not MSG.Message.from_bytes(frame[:-1], endpoint).valid()
+
+def test_binary_bad_field_length():
+    endpoint = Endpoint(MSG.PROTOCOL_BINARY)
+    frame = bytearray(MSG.Message(MSG.MessageArgs("abc"), "status", endpoint).encode())
+    frame[MSG.BINARY_HEADER.size + 1] = 200
+    assert not MSG.Message.from_bytes(frame, endpoint).valid()
+
+def test_binary_unknown_opcode():
+    endpoint = Endpoint(MSG.PROTOCOL_BINARY)
+    frame = bytearray(MSG.Message(MSG.MessageArgs("abc"), "status", endpoint).encode())
+    frame[4] = 99
+    assert not MSG.Message.from_bytes(frame, endpoint).valid()
+
+def test_legacy_bad_magic():
+    endpoint = Endpoint()
+    frame = MSG.Message(MSG.MessageArgs("abc"), "status", endpoint).encode()
+    assert not MSG.Message.from_bytes(b"1" + frame[1:], endpoint).valid()
+
+def test_binary_field_too_long():
+    endpoint = Endpoint(MSG.PROTOCOL_BINARY)
+    endpoint.msg_max_size = 1 << 20
+    assert not MSG.Message(MSG.MessageArgs("x" * 70000), "status", endpoint).valid()
+
+def test_invalid_utf8():
+    assert not MSG.Message.from_bytes(b"\xff" * 30, Endpoint()).valid()
+
+### ---- 4. Row Packing Tests ---- ###
+
+def unpack_rows(messages, endpoint):
+    """Decodes packed messages back into (more flags, rows)."""
+    flags, rows = [], []
+    for msg in messages:
+        assert msg.valid()
+        _, args = MSG.Message.from_bytes(msg.encode(), endpoint).unpack_args()
+        more, width, fields = args[0], int(args[1]), args[2:]
+        flags.append(more)
+        if width:
+            rows.extend(fields[i:i + width] for i in range(0, len(fields), width))
+    return flags, rows
+
+def test_pack_rows_single_message(endpoint):
+    rows = [[str(i), "alice", "bob", f"text {i}"] for i in range(5)]
+    messages = MSG.Message.pack_rows(rows, "fetch_text_messages_batch", endpoint)
+    assert len(messages) == 1
+    assert unpack_rows(messages, endpoint) == (["0"], rows)
+
+def test_pack_rows_chunks(endpoint):
+    rows = [[str(i), "alice", "bob", "x" * 100] for i in range(50)]
+    messages = MSG.Message.pack_rows(rows, "fetch_text_messages_batch", endpoint)
+    assert 1 < len(messages) < len(rows)
+    flags, unpacked = unpack_rows(messages, endpoint)
+    assert flags == ["1"] * (len(messages) - 1) + ["0"]
+    assert unpacked == rows
+
+def test_pack_rows_fill_to_limit(endpoint):
+    """Chunks are filled right up to `msg_max_size` but never past it."""
+    rows = [[str(i), "a", "b", "y" * (i % 37)] for i in range(200)]
+    messages = MSG.Message.pack_rows(rows, "fetch_text_messages_batch", endpoint)
+    assert unpack_rows(messages, endpoint)[1] == rows
+    for msg, next_msg in zip(messages, messages[1:]):
+        _, next_args = next_msg.unpack_args()
+        next_row = next_args[2:6]
+        combined = MSG.Message(MSG.MessageArgs(*msg.unpack_args()[1], *next_row), "fetch_text_messages_batch", endpoint)
+        assert not combined.valid()
+
+def test_pack_rows_separator_in_text(endpoint):
+    """Rows whose text holds the legacy separator keep their width, and still fit `msg_max_size`."""
+    rows = [[str(i), "alice", "bob", "a|b\\" * (i % 50)] for i in range(100)]
+    messages = MSG.Message.pack_rows(rows, "fetch_text_messages_batch", endpoint)
+    assert len(messages) > 1
+    assert unpack_rows(messages, endpoint)[1] == rows
+
+def test_pack_rows_request_id():
+    endpoint = Endpoint(MSG.PROTOCOL_BINARY)
+    rows = [[str(i), "alice", "bob", "x" * 100] for i in range(50)]
+    messages = MSG.Message.pack_rows(rows, "fetch_text_messages_batch", endpoint, request_id=9)
+    assert all(msg.valid() for msg in messages)
+    received = [MSG.Message.from_bytes(msg.encode(), endpoint) for msg in messages]
+    assert [msg.request_id for msg in received] == [9] * len(messages)
+    assert [msg.more for msg in received] == [True] * (len(messages) - 1) + [False]
+    assert unpack_rows(messages, endpoint)[1] == rows
+
+def test_pack_rows_empty(endpoint):
+    messages = MSG.Message.pack_rows([], "fetch_text_messages_batch", endpoint)
+    assert unpack_rows(messages, endpoint) == (["0"], [])
+
+def test_pack_rows_skips_oversized_row(endpoint):
+    rows = [["1", "a", "b", "ok"], ["2", "a", "b", "z" * 5000]]
+    messages = MSG.Message.pack_rows(rows, "fetch_text_messages_batch", endpoint)
+    assert unpack_rows(messages, endpoint)[1] == [["1", "a", "b", "ok"]]
@@ -0,0 +1,54 @@
+import json
+import pytest
+
+import metrics
+
+def test_histogram_precision():
+    histogram = metrics.Histogram()
+    for value in (0, 1, 63, 64, 1000, 123456, 10**8):
+        index = histogram.bucket(value)
+        assert histogram.bucket_value(index) >= value
+        assert histogram.bucket_value(index) - value <= value / 32
+        assert index == 0 or histogram.bucket_value(index - 1) < value
+
+def test_histogram_percentiles():
+    histogram = metrics.Histogram()
+    for ms in range(1, 101):
+        histogram.record(ms / 1000)
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert summary["mean_ms"] == pytest.approx(50.5)
+    assert summary["p50_ms"] == pytest.approx(50, rel=1 / 32)
+    assert summary["p99_ms"] == pytest.approx(99, rel=1 / 32)
+    assert summary["max_ms"] == 100.0
+
+def test_empty_histogram():
+    summary = metrics.Histogram().summary()
+    assert summary["count"] == 0 and summary["p99_ms"] == 0 and summary["max_ms"] == 0
+
+def test_metrics_snapshot():
+    server_metrics = metrics.Metrics()
+    server_metrics.connection_opened()
+    server_metrics.connection_opened()
+    server_metrics.connection_closed()
+    server_metrics.observe_queue_depth(3)
+    server_metrics.observe_queue_depth(1)
+    server_metrics.record("login_account", 0.001, 0.002, 0.0005)
+    server_metrics.record_error("login_account")
+
+    snapshot = server_metrics.snapshot({"127.0.0.1:5000": 1})
+    assert snapshot["connections"] == {"open": 1, "total": 2}
+    assert snapshot["queues"] == {"max_depth": 3, "depths": {"127.0.0.1:5000": 1}}
+    login = snapshot["actions"]["login_account"]
+    assert login["count"] == 1 and login["errors"] == 1
+    assert login["db"]["max_ms"] == 2.0
+
+    rows = dict(metrics.rows(snapshot))
+    assert rows["actions.login_account.count"] == "1"
+    assert rows["queues.depths.127.0.0.1:5000"] == "1"
+
+def test_dump(tmp_path):
+    path = tmp_path / "metrics.json"
+    metrics.dump({"connections": {"open": 2}}, str(path))
+    assert json.loads(path.read_text()) == {"connections": {"open": 2}}
+    assert [p.name for p in tmp_path.iterdir()] == ["metrics.json"]
@@ -0,0 +1,64 @@
+import threading
+import pytest
+
+import metrics
+import scheduler
+
+def blocked(fair_scheduler):
+    """Occupies the scheduler's single worker until the returned event is set."""
+    release, started = threading.Event(), threading.Event()
+    def hold():
+        started.set()
+        release.wait()
+    fair_scheduler.submit("holder", "hold", hold)
+    assert started.wait(timeout=2)
+    return release
+
+def run_order(fair_scheduler, submissions: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """Submits (client, action) tasks while the worker is busy; returns the order they ran in."""
+    order = []
+    release = blocked(fair_scheduler)
+    futures = [fair_scheduler.submit(client, action, order.append, (client, action)) for client, action in submissions]
+    release.set()
+    for future in futures:
+        future.result(timeout=2)
+    return order
+
+def test_result_and_exception():
+    fair_scheduler = scheduler.FairScheduler(2)
+    assert fair_scheduler.submit("a", "add", lambda x, y: x + y, 1, 2).result(timeout=2) == 3
+    with pytest.raises(ZeroDivisionError):
+        fair_scheduler.submit("a", "divide", lambda: 1 / 0).result(timeout=2)
+
+def test_clients_take_turns():
+    fair_scheduler = scheduler.FairScheduler(1)
+    order = run_order(fair_scheduler, [("flood", "fetch")] * 100 + [("other", "login")])
+    # The other client's only request runs right after the flooding client's first
+    assert order.index(("other", "login")) == 1
+
+def test_class_weights():
+    fair_scheduler = scheduler.FairScheduler(1, {"auth": 3, "bulk": 1}, {"login": "auth", "fetch": "bulk"})
+    order = run_order(fair_scheduler, [("a", "fetch")] * 20 + [("b", "login")] * 20)
+    # While both classes have work, auth gets three turns for each of bulk's
+    first = [action for _, action in order[:20]]
+    assert first.count("login") == 15 and first.count("fetch") == 5
+    assert len(order) == 40
+
+def test_idle_class_lends_turns():
+    fair_scheduler = scheduler.FairScheduler(1, {"auth": 8, "bulk": 1}, {"login": "auth"}, default_class="bulk")
+    order = run_order(fair_scheduler, [("a", "fetch")] * 10)
+    assert order == [("a", "fetch")] * 10
+
+def test_class_wait_metrics():
+    server_metrics = metrics.Metrics()
+    fair_scheduler = scheduler.FairScheduler(1, {"auth": 1, "bulk": 1}, {"login": "auth"}, "bulk", metrics=server_metrics)
+    fair_scheduler.submit("a", "login", lambda: None).result(timeout=2)
+    fair_scheduler.submit("a", "fetch", lambda: None).result(timeout=2)
+    classes = server_metrics.snapshot()["classes"]
+    assert classes["auth"]["wait"]["count"] == 1 and classes["bulk"]["wait"]["count"] == 1
+
+def test_unknown_class():
+    with pytest.raises(ValueError):
+        scheduler.FairScheduler(1, {"auth": 1}, {"login": "bulk"})
+    with pytest.raises(ValueError):
+        scheduler.FairScheduler(1, {"auth": 0})
@@ -0,0 +1,150 @@
+import importlib.util
+import os
+import socket
+import threading
+import pytest
+
+# Loaded under a name of its own, since `utils` also names the package that holds it
+spec = importlib.util.spec_from_file_location("frame_utils", os.path.join(os.path.dirname(__file__), "utils.py"))
+utils = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(utils)
+
+def frame(body: bytes) -> bytes:
+    return len(body).to_bytes(4, "big") + body
+
+@pytest.fixture
+def sockets():
+    left, right = socket.socketpair()
+    yield left, right
+    left.close()
+    right.close()
+
+### ---- 1. recv_all Tests ---- ###
+
+def test_recv_all(sockets):
+    left, right = sockets
+    left.sendall(b"hello world")
+    assert utils.recv_all(right, 5) == b"hello"
+    assert utils.recv_all(right, 6) == b" world"
+
+def test_recv_all_closed(sockets):
+    left, right = sockets
+    left.sendall(b"abc")
+    left.close()
+    assert utils.recv_all(right, 5) is None
+
+### ---- 2. FrameReader Tests ---- ###
+
+def test_several_frames_in_one_packet(sockets):
+    left, right = sockets
+    left.sendall(frame(b"one") + frame(b"two") + frame(b"") + frame(b"three"))
+    reader = utils.FrameReader(right)
+    assert [bytes(reader.read_frame()) for _ in range(4)] == [b"one", b"two", b"", b"three"]
+
+def test_frame_split_across_packets(sockets):
+    left, right = sockets
+    data = frame(b"split body")
+    reader = utils.FrameReader(right)
+    sender = threading.Thread(target=lambda: [left.sendall(data[i:i + 1]) for i in range(len(data))])
+    sender.start()
+    assert bytes(reader.read_frame()) == b"split body"
+    sender.join()
+
+def test_frames_wrap_small_buffer(sockets):
+    left, right = sockets
+    bodies = [bytes([i]) * (i % 7 + 1) for i in range(50)]
+    left.sendall(b"".join(frame(body) for body in bodies))
+    reader = utils.FrameReader(right, buffer_size=16)
+    assert [bytes(reader.read_frame()) for _ in bodies] == bodies
+
+def test_frame_larger_than_buffer(sockets):
+    left, right = sockets
+    body = b"x" * 100000
+    sender = threading.Thread(target=left.sendall, args=(frame(body) + frame(b"after"),))
+    sender.start()
+    reader = utils.FrameReader(right, buffer_size=64)
+    assert bytes(reader.read_frame()) == body
+    assert bytes(reader.read_frame()) == b"after"
+    sender.join()
+
+def test_iterate_until_closed(sockets):
+    left, right = sockets
+    left.sendall(frame(b"a") + frame(b"b"))
+    left.close()
+    assert [bytes(f) for f in utils.FrameReader(right)] == [b"a", b"b"]
+
+def test_closed_mid_frame(sockets):
+    left, right = sockets
+    left.sendall(frame(b"complete")[:6])
+    left.close()
+    assert utils.FrameReader(right).read_frame() is None
+
+def test_frame_too_large(sockets):
+    left, right = sockets
+    left.sendall((5000).to_bytes(4, "big"))
+    with pytest.raises(ValueError):
+        utils.FrameReader(right, max_frame_size=1008).read_frame()
+
+### ---- 3. send_frames Tests ---- ###
+
+class TrickleSocket:
+    """Accepts at most `limit` bytes per `sendmsg` call."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = bytearray()
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        data = b"".join(bytes(buffer) for buffer in buffers)[:self.limit]
+        self.data += data
+        return len(data)
+
+def test_send_frames(sockets):
+    left, right = sockets
+    utils.send_frames(left, [b"one", b"", bytearray(b"three")])
+    reader = utils.FrameReader(right)
+    assert [bytes(reader.read_frame()) for _ in range(3)] == [b"one", b"", b"three"]
+
+def test_send_frames_single_call():
+    sock = TrickleSocket(limit=1 << 20)
+    utils.send_frames(sock, [b"a" * 10, b"b" * 20])
+    assert sock.calls == 1
+    assert bytes(sock.data) == frame(b"a" * 10) + frame(b"b" * 20)
+
+def test_send_frames_partial_writes():
+    sock = TrickleSocket(limit=3)
+    bodies = [b"hello", b"", b"world!"]
+    utils.send_frames(sock, bodies)
+    assert bytes(sock.data) == b"".join(frame(body) for body in bodies)
+
+def test_send_frames_many_buffers():
+    sock = TrickleSocket(limit=1 << 20)
+    bodies = [bytes([i % 256]) for i in range(utils.IOV_MAX)]
+    utils.send_frames(sock, bodies)
+    assert bytes(sock.data) == b"".join(frame(body) for body in bodies)
+
+### ---- 4. FrameWriter Tests ---- ###
+
+def test_frame_writer(sockets):
+    left, right = sockets
+    writer = utils.FrameWriter(left)
+    assert writer.send([b"one", b"two"])
+    assert writer.send([b"three"])
+    reader = utils.FrameReader(right)
+    assert [bytes(reader.read_frame()) for _ in range(3)] == [b"one", b"two", b"three"]
+    writer.close()
+    assert not writer.send([b"late"])
+
+def test_frame_writer_peer_stops_reading(sockets):
+    left, right = sockets
+    left.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    writer = utils.FrameWriter(left, max_pending=65536)
+    # Sends never block, and once the unread backlog passes `max_pending` the connection is shut down
+    for _ in range(1000):
+        if not writer.send([b"x" * 1000]):
+            break
+    assert writer.overflowed
+    right.settimeout(5)
+    while right.recv(65536):
+        pass
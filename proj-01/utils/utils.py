@@ -1,9 +1,180 @@
+import socket as socket_module
+import struct
+import threading
+
+FRAME_LENGTH = struct.Struct("!I")
+
+# Most platforms cap the number of buffers in a single vectored write at 1024
+IOV_MAX = 1024
+
 def recv_all(socket, n):
     """Helper function to receive exactly `n` bytes or return None if the connection is closed."""
-    data = b""
-    while len(data) < n:
-        packet = socket.recv(n - len(data))
-        if not packet:  # Connection closed
+    data = bytearray(n)
+    view = memoryview(data)
+    received = 0
+    while received < n:
+        count = socket.recv_into(view[received:])
+        if not count:  # Connection closed
             return None
-        data += packet
-    return data
+        received += count
+    return bytes(data)
+
+def send_frames(socket, payloads):
+    """
+    Sends each payload with its 4-byte length prefix using vectored writes, so a batch
+    of frames normally leaves in a single `sendmsg` syscall without being copied together.
+    """
+    buffers = []
+    for payload in payloads:
+        buffers.append(FRAME_LENGTH.pack(len(payload)))
+        buffers.append(payload)
+
+    if not hasattr(socket, "sendmsg"):
+        socket.sendall(b"".join(buffers))
+        return
+
+    while buffers:
+        sent = socket.sendmsg(buffers[:IOV_MAX])
+        # Drop what was written, keeping the unsent tail of a partially written buffer
+        index = 0
+        while index < len(buffers) and sent >= len(buffers[index]):
+            sent -= len(buffers[index])
+            index += 1
+        buffers = buffers[index:]
+        if sent:
+            buffers[0] = memoryview(buffers[0])[sent:]
+
+class FrameReader:
+    """
+    Reads length-prefixed frames from a socket through a single reusable buffer.
+    Each `recv_into` pulls as much as the kernel has ready, so a burst of small frames
+    costs one syscall rather than two per frame.
+    """
+
+    def __init__(self, socket, buffer_size: int = 65536, max_frame_size: int = None):
+        self.socket = socket
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First unconsumed byte
+        self.end = 0    # One past the last received byte
+
+    def __iter__(self):
+        """Yields frames until the connection is closed."""
+        while True:
+            frame = self.read_frame()
+            if frame is None:
+                return
+            yield frame
+
+    def read_frame(self):
+        """
+        Returns the next frame's body as a memoryview into the buffer, or None if the connection is closed.
+        The view is only valid until the next call, so callers should parse it right away.
+        """
+        while True:
+            available = self.end - self.start
+            if available >= FRAME_LENGTH.size:
+                (frame_length,) = FRAME_LENGTH.unpack_from(self.buffer, self.start)
+                if self.max_frame_size is not None and frame_length > self.max_frame_size:
+                    raise ValueError(f"Frame of {frame_length} bytes exceeds the maximum of {self.max_frame_size}.")
+                if available >= FRAME_LENGTH.size + frame_length:
+                    frame_start = self.start + FRAME_LENGTH.size
+                    self.start = frame_start + frame_length
+                    return self.view[frame_start:self.start]
+                self.reserve(FRAME_LENGTH.size + frame_length)
+            else:
+                self.reserve(FRAME_LENGTH.size)
+
+            count = self.socket.recv_into(self.view[self.end:])
+            if not count:  # Connection closed
+                return None
+            self.end += count
+
+    def reserve(self, frame_size: int):
+        """Makes room after the unconsumed bytes for a frame of `frame_size` bytes, moving or growing the buffer only when needed."""
+        if self.start == self.end:
+            self.start = self.end = 0
+        if self.start + frame_size <= len(self.buffer) and self.end < len(self.buffer):
+            return
+
+        available = self.end - self.start
+        if frame_size <= len(self.buffer):
+            # Shift the partial frame to the front of the buffer
+            self.buffer[:available] = self.buffer[self.start:self.end]
+        else:
+            buffer = bytearray(max(frame_size, 2 * len(self.buffer)))
+            buffer[:available] = self.view[self.start:self.end]
+            self.buffer = buffer
+            self.view = memoryview(self.buffer)
+        self.start, self.end = 0, available
+
+class FrameWriter:
+    """
+    Writes length-prefixed frames to a socket from a thread of its own, so callers never
+    block on a peer that is slow to read. Frames queued while a write is under way leave
+    together in the next one. A peer that lets more than `max_pending` bytes pile up has
+    stopped reading, and its connection is shut down.
+    """
+
+    def __init__(self, socket, max_pending: int = 1 << 20):
+        self.socket = socket
+        self.max_pending = max_pending
+        self.pending = []  # Frames not yet handed to the socket
+        self.pending_bytes = 0  # Including those of the write under way
+        self.closed = False
+        self.overflowed = False
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def send(self, payloads) -> bool:
+        """
+        Queues payloads to be written as frames, returning False if they were dropped because the
+        connection is closed or because the peer fell more than `max_pending` bytes behind.
+        A single response larger than `max_pending` is still accepted when nothing else is pending.
+        """
+        payloads = list(payloads)
+        size = sum(FRAME_LENGTH.size + len(payload) for payload in payloads)
+        with self.condition:
+            if self.closed:
+                return False
+            if self.pending_bytes and self.pending_bytes + size > self.max_pending:
+                self.overflowed = True
+                self.abort()
+                return False
+            self.pending.extend(payloads)
+            self.pending_bytes += size
+            self.condition.notify()
+        return True
+
+    def close(self):
+        """Stops the writer, discarding frames not yet written."""
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.condition.notify()
+
+    def abort(self):
+        """Stops the writer and shuts the connection down, which also wakes a write blocked on the peer."""
+        self.close()
+        try:
+            self.socket.shutdown(socket_module.SHUT_RDWR)
+        except OSError:
+            pass  # Already disconnected
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                payloads, self.pending = self.pending, []
+                size = sum(FRAME_LENGTH.size + len(payload) for payload in payloads)
+            try:
+                send_frames(self.socket, payloads)
+            except OSError:
+                self.close()
+                return
+            with self.condition:
+                self.pending_bytes -= size